@@ -10,6 +10,7 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/4.2/ref/settings/
 """
 
+import os
 from pathlib import Path
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -84,6 +85,21 @@ DATABASES = {
 }
 
 
+# Cache
+# https://docs.djangoproject.com/en/4.2/topics/cache/
+# 多进程部署(gunicorn)时必须改为共享缓存(如Redis): 角色路由缓存、token版本、注销的token和强制下线记录都保存在默认缓存中,
+# 使用LocMemCache时注销/强制下线只在处理该请求的进程内生效(check提示users.W001, check --deploy报错users.E001)
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    }
+}
+
+# 角色路由/权限缓存时长(秒)
+RBAC_CACHE_TIMEOUT = 60 * 60 * 24
+
+
 # Password validation
 # https://docs.djangoproject.com/en/4.2/ref/settings/#auth-password-validators
 
@@ -131,15 +147,42 @@ TABLE_PREFIX = "devops_"
 
 AUTH_USER_MODEL = "users.Users"
 USERNAME_FIELD = "username"
+AUTHENTICATION_BACKENDS = ["users.utils.hashers.CustomBackend"]
+
+# 密码哈希: 新密码使用迭代次数可配置的PBKDF2, 其余哈希器用于校验旧密码, 登录成功后自动升级
+PASSWORD_HASHERS = [
+    "users.utils.hashers.ConfigurablePBKDF2PasswordHasher",
+    "django.contrib.auth.hashers.PBKDF2PasswordHasher",
+    "django.contrib.auth.hashers.PBKDF2SHA1PasswordHasher",
+    "django.contrib.auth.hashers.Argon2PasswordHasher",
+    "django.contrib.auth.hashers.BCryptSHA256PasswordHasher",
+    "django.contrib.auth.hashers.ScryptPasswordHasher",
+]
+# PBKDF2迭代次数(Django 4.2默认600000), 调整后用户下次登录时按新值重新哈希;
+# 重新哈希改变了密码哈希, 该用户其它会话的access/refresh token随之失效(需要重新登录)
+PASSWORD_HASH_ITERATIONS = 600000
+# 兼容旧版本以MD5摘要保存的密码, 所有用户升级后可关闭
+PASSWORD_LEGACY_MD5 = True
+
+# 登录线程池(users.utils.login_pool): 校验密码的线程数, 等待和执行中的登录请求上限(超过时返回429), 429的Retry-After(秒)
+LOGIN_POOL_WORKERS = os.cpu_count() or 1
+LOGIN_POOL_MAX_PENDING = LOGIN_POOL_WORKERS * 4
+LOGIN_RETRY_AFTER = 1
 
 # Django Rest FrameWork 配置
 REST_FRAMEWORK = {
     "DATETIME_FORMAT": "%Y-%m-%d %H:%M:%S",  # 日期时间格式配置
     "DATE_FORMAT": "%Y-%m-%d",
     "DEFAULT_AUTHENTICATION_CLASSES": (
-        "rest_framework_simplejwt.authentication.JWTAuthentication",
+        # 由token声明构建用户, 不查询用户表; 需要逐请求查询用户时改回 rest_framework_simplejwt.authentication.JWTAuthentication
+        "users.utils.authentication.StatelessJWTAuthentication",
         "rest_framework.authentication.SessionAuthentication",
     ),
+    "DEFAULT_RENDERER_CLASSES": [
+        # 安装了orjson时使用orjson编码, 输出与 rest_framework.renderers.JSONRenderer 一致
+        "users.utils.renderers.CustomJSONRenderer",
+        "rest_framework.renderers.BrowsableAPIRenderer",
+    ],
     "DEFAULT_PERMISSION_CLASSES": [
         "rest_framework.permissions.IsAuthenticated",  # 只有经过身份认证确定用户身份才能访问
         # 'rest_framework.permissions.IsAdminUser', # is_staff=True才能访问 —— 管理员(员工)权限
@@ -151,6 +194,9 @@ REST_FRAMEWORK = {
 # JWT配置
 from datetime import timedelta
 
+# 无状态认证中token版本(密码/状态/角色)的缓存时间(秒), 绕过信号的变更(如queryset.update)最长在该时间后使旧token失效
+TOKEN_VERSION_TIMEOUT = 60
+
 SIMPLE_JWT = {
     # token有效时长
     "ACCESS_TOKEN_LIFETIME": timedelta(minutes=60),
@@ -159,6 +205,7 @@ SIMPLE_JWT = {
     # 设置前缀
     # "AUTH_HEADER_TYPES": ("JWT",),
     "ROTATE_REFRESH_TOKENS": True,
-    'BLACKLIST_AFTER_ROTATION': True,
+    # 未安装token_blacklist, 轮换后的旧refresh token由 users.utils.authentication.revoke_token 注销
+    'BLACKLIST_AFTER_ROTATION': False,
     'AUTH_TOKEN_CLASSES': ('rest_framework_simplejwt.tokens.AccessToken',),
 }
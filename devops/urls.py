@@ -22,7 +22,7 @@ from django.urls import path, include, re_path
 #     TokenRefreshView,
 # )
 
-from users.views.login import LoginView, LogoutView, CustomTokenRefreshView
+from users.views.login import AsyncLoginView, LogoutView, CustomTokenRefreshView
 from drf_yasg import openapi
 from drf_yasg.views import get_schema_view
 from rest_framework import permissions
@@ -53,7 +53,7 @@ schema_view = get_schema_view(
 
 urlpatterns += [
     # 登录登出
-    path("api/v1/auth/login/", LoginView.as_view(), name="token_obtain_pair"),
+    path("api/v1/auth/login/", AsyncLoginView.as_view(), name="token_obtain_pair"),
     path("api/v1/auth/logout/", LogoutView.as_view(), name="token_obtain_pair"),
     path("token/refresh/", CustomTokenRefreshView.as_view(), name="token_refresh"),
 
@@ -5,3 +5,7 @@ class UsersConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'users'
     verbose_name = "RBAC用户权限"
+
+    def ready(self):
+        import users.checks  # noqa: F401
+        import users.signals  # noqa: F401
@@ -0,0 +1,47 @@
+# -*- coding: utf-8 -*-
+
+"""
+@Remark: 系统检查
+token注销、强制下线、token版本和角色路由缓存都保存在默认缓存中, 多进程部署时必须使用进程间共享的缓存
+"""
+from django.conf import settings
+from django.core.checks import Error, Tags, Warning, register
+
+# 只在当前进程内生效的缓存后端
+PROCESS_LOCAL_CACHES = (
+    "django.core.cache.backends.locmem.LocMemCache",
+    "django.core.cache.backends.dummy.DummyCache",
+)
+SHARED_CACHE_HINT = "多进程部署(gunicorn等)时请把CACHES['default']改为共享缓存(如Redis)"
+
+
+def uses_process_local_cache():
+    return settings.CACHES.get("default", {}).get("BACKEND") in PROCESS_LOCAL_CACHES
+
+
+@register(Tags.caches, Tags.security)
+def check_shared_cache(app_configs, **kwargs):
+    """
+    默认缓存只在当前进程内生效时, 注销和强制下线只对处理该请求的进程有效
+    """
+    if not uses_process_local_cache():
+        return []
+    return [Warning(
+        "默认缓存只在当前进程内生效, 注销/强制下线的token在其它进程中仍然可用",
+        hint=SHARED_CACHE_HINT,
+        id="users.W001",
+    )]
+
+
+@register(Tags.caches, Tags.security, deploy=True)
+def check_shared_cache_deploy(app_configs, **kwargs):
+    """
+    check --deploy 时作为错误报告
+    """
+    if not uses_process_local_cache():
+        return []
+    return [Error(
+        "部署环境的默认缓存不能只在当前进程内生效, 否则注销/强制下线的token在其它进程中仍然可用",
+        hint=SHARED_CACHE_HINT,
+        id="users.E001",
+    )]
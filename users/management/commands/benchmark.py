@@ -0,0 +1,215 @@
+# -*- coding: utf-8 -*-
+
+"""
+@Remark: 性能基准
+在回滚的事务中生成测试数据并计时, 不修改数据库中已有的数据:
+python manage.py benchmark [基准名称 ...] [--rows 行数] [--repeat 次数]
+"""
+import time
+from unittest import mock
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext, override_settings
+from rest_framework.request import Request
+from rest_framework.test import APIRequestFactory, force_authenticate
+
+from users.models import Menu, Role, Users
+from users.utils.filters import CustomDjangoFilterBackend
+from users.utils.permission import ApiMatcher, CustomPermission, ValidationApi
+from users.utils.rbac_cache import invalidate_rbac_cache
+
+# {基准名称: (说明, 函数)}
+BENCHMARKS = {}
+
+
+def benchmark(name, description):
+    def decorator(func):
+        BENCHMARKS[name] = (description, func)
+        return func
+    return decorator
+
+
+class Command(BaseCommand):
+    help = "运行性能基准, 数据在回滚的事务中生成"
+
+    def add_arguments(self, parser):
+        parser.add_argument("names", nargs="*", help="基准名称, 默认全部运行")
+        parser.add_argument("--rows", type=int, default=1000, help="生成的测试数据行数")
+        parser.add_argument("--repeat", type=int, default=5, help="每项计时重复的次数, 取最快的一次")
+
+    def handle(self, *args, **options):
+        names = options["names"] or list(BENCHMARKS)
+        unknown = [name for name in names if name not in BENCHMARKS]
+        if unknown:
+            raise CommandError(f"未知的基准: {', '.join(unknown)}, 可选: {', '.join(BENCHMARKS)}")
+        self.rows, self.repeat = options["rows"], options["repeat"]
+        for name in names:
+            description, func = BENCHMARKS[name]
+            self.stdout.write(self.style.MIGRATE_HEADING(f"{name}: {description}"))
+            # APIRequestFactory的请求主机为testserver
+            with transaction.atomic(), override_settings(ALLOWED_HOSTS=["testserver"]):
+                func(self)
+                transaction.set_rollback(True)
+            # 缓存中可能留有回滚数据的角色和接口
+            invalidate_rbac_cache()
+
+    def timeit(self, label, func, number=1):
+        """
+        重复repeat次, 每次调用number次, 输出最快一次的单次耗时和查询数
+        :return: 最后一次调用的返回值
+        """
+        best, result = None, None
+        for _ in range(self.repeat):
+            with CaptureQueriesContext(connection) as context:
+                start = time.perf_counter()
+                for _ in range(number):
+                    result = func()
+                elapsed = (time.perf_counter() - start) / number
+            best = elapsed if best is None else min(best, elapsed)
+        queries = len(context.captured_queries) // number
+        if best >= 1e-3:
+            duration = f"{best * 1e3:.2f}ms"
+        else:
+            duration = f"{best * 1e6:.1f}µs"
+        self.stdout.write(f"  {label:<40} {duration:>12}  {queries}条查询")
+        return result
+
+    def create_users(self, count):
+        """
+        生成count个用户(每个用户2个角色)和count个菜单, 返回超级管理员
+        """
+        admin = Users.objects.create(username="benchmark-admin", name="基准", is_superuser=True)
+        roles = Role.objects.bulk_create(Role(name=f"基准角色{index}", key=f"benchmark{index}") for index in range(20))
+        users = Users.objects.bulk_create(
+            Users(username=f"benchmark{index}", name=f"基准用户{index}", creator=admin, modifier=str(admin.id))
+            for index in range(count)
+        )
+        Users.role.through.objects.bulk_create(
+            Users.role.through(users_id=user.id, role_id=roles[(index + offset) % len(roles)].id)
+            for index, user in enumerate(users) for offset in range(2)
+        )
+        Menu.objects.bulk_create(
+            Menu(name=f"基准菜单{index}", menu_type="MENU", creator=admin, modifier=str(admin.id))
+            for index in range(count)
+        )
+        return admin
+
+
+@benchmark("list", "列表接口: values()快速路径与序列化器路径")
+def list_paths(command):
+    from users.views.menu import MenuViewSet
+    from users.views.user import UserViewSet
+
+    admin = command.create_users(command.rows)
+    factory = APIRequestFactory()
+    for viewset, url in ((UserViewSet, "/api/v1/users/user/?page_size=100"), (MenuViewSet, "/api/v1/users/menu/")):
+        view = viewset.as_view({"get": "list"})
+
+        def render():
+            request = factory.get(url)
+            force_authenticate(request, admin)
+            return view(request).render().content
+
+        values_queryset = viewset.values_queryset
+        fast = command.timeit(f"{viewset.__name__} values()", render)
+        viewset.values_queryset = None
+        try:
+            slow = command.timeit(f"{viewset.__name__} 序列化器", render)
+        finally:
+            viewset.values_queryset = values_queryset
+        if fast != slow:
+            raise CommandError(f"{viewset.__name__}两种路径的输出不一致")
+
+
+def create_api_user(count):
+    """
+    生成一个角色关联count个接口按钮的普通用户, 角色id与无状态认证一样来自token
+    """
+    role = Role.objects.create(name="基准角色", key="benchmark")
+    role.menu.set(Menu.objects.bulk_create(
+        Menu(name=f"基准按钮{index}", menu_type="BUTTON", api=f"/api/v1/benchmark{index}/{{id}}/", method="GET")
+        for index in range(count)
+    ))
+    user = Users.objects.create(username="benchmark-user", name="基准")
+    user.role.add(role)
+    user.token_role_ids = [role.id]
+    return user
+
+
+@benchmark("permission", "CustomPermission.has_permission: 普通用户的单次接口权限检查(匹配器已编译, 目标50µs以内)")
+def permission_check(command):
+    user = create_api_user(command.rows)
+    factory = APIRequestFactory()
+    check = CustomPermission().has_permission
+    for label, path in (("允许", f"/api/v1/benchmark{command.rows - 1}/1/"), ("拒绝", "/api/v1/users/dept/")):
+        request = Request(factory.get(path))
+        request.user = user
+
+        def run():
+            request._request._permission_context = None
+            return check(request, None)
+
+        # 预热缓存和匹配器
+        run()
+        command.timeit(f"has_permission {label}", run, number=1000)
+
+
+@benchmark("filterset", "CustomDjangoFilterBackend.filter_queryset: 缓存的FilterSet类与每次重新生成")
+def filterset(command):
+    from users.views.role import RoleViewSet
+    from users.views.user import UserViewSet
+
+    factory = APIRequestFactory()
+    backend = CustomDjangoFilterBackend()
+    for viewset, params in ((UserViewSet, {"name": "基准", "username": "benchmark"}), (RoleViewSet, {"name": "基准"})):
+        view = viewset()
+        request = Request(factory.get("/", params))
+        queryset = viewset.queryset.all()
+
+        def run():
+            return backend.filter_queryset(request, queryset, view)
+
+        def run_uncached():
+            backend.filterset_class_cache.clear()
+            backend.orm_lookup_map_cache.clear()
+            return run()
+
+        uncached = command.timeit(f"{viewset.__name__} 每次重新生成", run_uncached, number=100)
+        cached = command.timeit(f"{viewset.__name__} 缓存", run, number=100)
+        if str(cached.query) != str(uncached.query):
+            raise CommandError(f"{viewset.__name__}两种方式的过滤条件不一致")
+
+
+@benchmark("matcher", "接口匹配: 合并编译的ApiMatcher与逐个调用ValidationApi")
+def api_matcher(command):
+    rules = [("GET", f"/api/v1/module{index}/{{id}}/") for index in range(command.rows)]
+    matcher = ApiMatcher(rules)
+    for label, path in (("匹配最后一个接口", f"/api/v1/module{command.rows - 1}/1/"), ("不匹配", "/api/v1/users/dept/")):
+        looped = command.timeit(f"ValidationApi 逐个 {label}",
+                                lambda: any(ValidationApi(path, api) for _, api in rules), number=100)
+        combined = command.timeit(f"ApiMatcher {label}", lambda: matcher.is_allowed("GET", path), number=1000)
+        if looped != combined:
+            raise CommandError("两种方式的匹配结果不一致")
+
+
+class UncachedDict(dict):
+    """
+    不保存任何内容的字典, 用于测量不缓存时的耗时
+    """
+
+    def __setitem__(self, key, value):
+        pass
+
+
+@benchmark("verbose_names", "批量新增每行都校验失败时读取errors: 缓存的verbose_name映射与每行重新计算")
+def verbose_names(command):
+    from users.views.user import UserCreateSerializer
+
+    serializer = UserCreateSerializer(data=[{"username": "", "name": ""}] * command.rows, many=True)
+    serializer.is_valid()
+    cached = command.timeit(f"{command.rows}行 缓存", lambda: serializer.errors)
+    with mock.patch("users.utils.serializers._verbose_names", UncachedDict()):
+        uncached = command.timeit(f"{command.rows}行 每行重新计算", lambda: serializer.errors)
+    if cached != uncached:
+        raise CommandError("两种方式的错误信息不一致")
@@ -0,0 +1,216 @@
+# -*- coding: utf-8 -*-
+
+"""
+@Remark: 批量导入用户
+逐行读取CSV/NDJSON文件, 按批校验并写入: 密码哈希在进程池中计算, 用户和用户-角色关联按批bulk_create;
+每批提交后记录断点, 中断后再次执行同一命令从断点继续
+"""
+import csv
+import itertools
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import django
+from django.contrib.auth.hashers import make_password
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections, reset_queries, transaction
+
+from users.models import Role
+from users.utils.export import iter_chunks
+from users.views.user import UserCreateSerializer
+
+# 可导入的用户字段, 另外支持 password(明文密码) 和 roles(角色权限字符)
+IMPORT_FIELDS = ("username", "name", "mobile", "email", "avatar", "description", "is_active")
+
+
+def hash_passwords(passwords):
+    """
+    在进程池中计算密码哈希, 空密码生成不可用密码
+    """
+    return [make_password(password or None) for password in passwords]
+
+
+def read_csv(path):
+    with open(path, newline="", encoding="utf-8-sig") as file:
+        yield from csv.DictReader(file)
+
+
+def read_ndjson(path):
+    with open(path, encoding="utf-8") as file:
+        for line in file:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                yield json.loads(line)
+            except ValueError:
+                # 无法解析的行按校验失败处理, 不中断导入
+                yield None
+
+
+READERS = {"csv": read_csv, "ndjson": read_ndjson}
+
+
+class Command(BaseCommand):
+    help = "从CSV/NDJSON文件批量导入用户及其角色, 中断后再次执行从断点继续"
+
+    def add_arguments(self, parser):
+        parser.add_argument("path",
+                            help=f"导入文件, 列: {','.join(IMPORT_FIELDS)},password,roles(逗号分隔的角色权限字符)")
+        parser.add_argument("--format", choices=list(READERS),
+                            help="文件格式, 默认按扩展名判断(.csv为csv, 其它为ndjson)")
+        parser.add_argument("--chunk-size", type=int, default=1000, help="每批校验和写入的行数")
+        parser.add_argument("--workers", type=int, default=os.cpu_count() or 1,
+                            help="计算密码哈希的进程数, 0表示在当前进程中计算")
+        parser.add_argument("--checkpoint", help="断点文件, 默认为导入文件路径加.checkpoint")
+        parser.add_argument("--restart", action="store_true", help="忽略已有的断点, 从头导入")
+
+    def handle(self, *args, **options):
+        path = os.path.abspath(options["path"])
+        if not os.path.isfile(path):
+            raise CommandError(f"文件不存在: {path}")
+        file_format = options["format"] or ("csv" if path.lower().endswith(".csv") else "ndjson")
+        chunk_size, workers = options["chunk_size"], options["workers"]
+        if chunk_size < 1:
+            raise CommandError("--chunk-size必须大于0")
+        checkpoint_path = options["checkpoint"] or f"{path}.checkpoint"
+        state = None if options["restart"] else self.load_checkpoint(checkpoint_path, path)
+        if state is None:
+            state = {"source": path, "offset": 0, "imported": 0, "skipped": 0}
+        else:
+            self.stdout.write(f"从断点继续: 跳过已处理的{state['offset']}条数据")
+
+        self.verbose_names = UserCreateSerializer.get_verbose_names()
+        # 角色权限字符只解析一次
+        self.role_ids = dict(Role.objects.values_list("key", "id"))
+        records = itertools.islice(enumerate(READERS[file_format](path), 1), state["offset"], None)
+
+        pool = None
+        if workers > 0:
+            # 创建子进程前关闭数据库连接, 子进程不继承父进程的连接
+            connections.close_all()
+            pool = ProcessPoolExecutor(max_workers=workers, initializer=django.setup)
+        start, processed = time.monotonic(), 0
+        try:
+            for chunk in iter_chunks(records, chunk_size):
+                imported, errors = self.import_chunk(chunk, pool, workers)
+                # DEBUG模式下每批清空查询日志, 内存占用不随导入行数增长
+                reset_queries()
+                for line_no, error in sorted(errors.items()):
+                    self.stderr.write(f"第{line_no}条数据: {json.dumps(error, ensure_ascii=False)}")
+                state["offset"] = chunk[-1][0]
+                state["imported"] += imported
+                state["skipped"] += len(errors)
+                self.save_checkpoint(checkpoint_path, state)
+                processed += len(chunk)
+                self.stdout.write(
+                    f"已处理{state['offset']}条, 导入{state['imported']}条, 跳过{state['skipped']}条, "
+                    f"{processed / (time.monotonic() - start):.0f}条/秒"
+                )
+        finally:
+            if pool is not None:
+                pool.shutdown(cancel_futures=True)
+
+        if os.path.exists(checkpoint_path):
+            os.remove(checkpoint_path)
+        self.stdout.write(self.style.SUCCESS(
+            f"导入完成: 共{state['offset']}条, 导入{state['imported']}条, 跳过{state['skipped']}条"
+        ))
+
+    def load_checkpoint(self, checkpoint_path, path):
+        if not os.path.exists(checkpoint_path):
+            return None
+        try:
+            with open(checkpoint_path, encoding="utf-8") as file:
+                state = json.load(file)
+        except ValueError:
+            raise CommandError(f"断点文件无法解析: {checkpoint_path}, 使用--restart从头导入")
+        if state.get("source") != path:
+            raise CommandError(f"断点文件属于其它导入文件({state.get('source')}), 使用--restart从头导入")
+        return state
+
+    def save_checkpoint(self, checkpoint_path, state):
+        # 先写临时文件再替换, 中断时不会留下不完整的断点文件
+        tmp_path = f"{checkpoint_path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as file:
+            json.dump(state, file)
+        os.replace(tmp_path, checkpoint_path)
+
+    def field_error(self, field_name, message):
+        return {str(self.verbose_names.get(field_name, field_name)): [message]}
+
+    def parse_record(self, record):
+        """
+        :return: ((序列化器数据, 明文密码), 错误)
+        """
+        if not isinstance(record, dict):
+            return None, {"non_field_errors": ["不是有效的JSON对象"]}
+        # CSV中的空单元格视为未填写
+        data = {field: record[field] for field in IMPORT_FIELDS if record.get(field) not in (None, "")}
+        role_keys = record.get("roles") or []
+        if isinstance(role_keys, str):
+            role_keys = [key.strip() for key in role_keys.split(",") if key.strip()]
+        if not isinstance(role_keys, list):
+            return None, self.field_error("role", "角色格式不正确")
+        role_keys = [str(key) for key in role_keys]
+        missing = [key for key in role_keys if key not in self.role_ids]
+        if missing:
+            return None, self.field_error("role", f"角色不存在: {', '.join(missing)}")
+        data["role"] = [self.role_ids[key] for key in role_keys]
+        return (data, str(record.get("password") or "")), None
+
+    def import_chunk(self, chunk, pool, workers):
+        """
+        校验并写入一批数据
+        :param chunk: [(行号, 原始数据)]
+        :return: (导入数量, {行号: 错误})
+        """
+        errors, rows = {}, []
+        for line_no, record in chunk:
+            parsed, error = self.parse_record(record)
+            if error:
+                errors[line_no] = error
+            else:
+                rows.append((line_no, *parsed))
+
+        # 校验期间由进程池计算密码哈希
+        line_nos = [line_no for line_no, _, _ in rows]
+        wait_hashes = self.submit_hashes(pool, workers, [password for _, _, password in rows])
+        rows, serializer = self.validate_rows(rows, errors)
+        hashed = dict(zip(line_nos, wait_hashes()))
+        if not rows:
+            return 0, errors
+        for (line_no, _, _), attrs in zip(rows, serializer.validated_data):
+            attrs["password"] = hashed[line_no]
+        with transaction.atomic():
+            serializer.save()
+        return len(rows), errors
+
+    def submit_hashes(self, pool, workers, passwords):
+        """
+        把密码按进程数分片提交到进程池
+        :return: 等待并按原顺序返回全部哈希的函数
+        """
+        if pool is None:
+            return lambda: hash_passwords(passwords)
+        size = max(1, -(-len(passwords) // workers))
+        futures = [pool.submit(hash_passwords, passwords[i:i + size]) for i in range(0, len(passwords), size)]
+        return lambda: [encoded for future in futures for encoded in future.result()]
+
+    def validate_rows(self, rows, errors):
+        """
+        按批校验, 校验失败的行(包括本批内重复或已存在的账号)记录到errors后对其余行重新校验
+        :return: (校验通过的行, 序列化器)
+        """
+        while rows:
+            serializer = UserCreateSerializer(data=[data for _, data, _ in rows], many=True)
+            if serializer.is_valid():
+                return rows, serializer
+            row_errors = serializer.errors
+            if not isinstance(row_errors, list):
+                raise CommandError(f"第{rows[0][0]}~{rows[-1][0]}条数据校验失败: {row_errors}")
+            errors.update((line_no, error) for (line_no, _, _), error in zip(rows, row_errors) if error)
+            rows = [row for row, error in zip(rows, row_errors) if not error]
+        return rows, None
@@ -0,0 +1,46 @@
+# -*- coding: utf-8 -*-
+
+"""
+@Remark: 重建菜单物化路径
+"""
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from users.models import Menu
+
+
+class Command(BaseCommand):
+    help = "根据parent关系重建所有菜单的物化路径(tree_path), 用于历史数据回填"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=500, help="每批更新的菜单数量")
+
+    def handle(self, *args, **options):
+        parents = dict(Menu.objects.values_list("id", "parent_id"))
+        paths = {}
+
+        def resolve(menu_id):
+            # 迭代向上查找已计算路径的祖先, 避免深层菜单递归过深
+            chain = []
+            node_id = menu_id
+            while node_id is not None and node_id not in paths:
+                if node_id in chain:
+                    raise ValueError(f"菜单存在循环引用: {chain}")
+                chain.append(node_id)
+                node_id = parents.get(node_id)
+            prefix = paths[node_id] if node_id is not None else "/"
+            for chain_id in reversed(chain):
+                prefix = f"{prefix}{chain_id}/"
+                paths[chain_id] = prefix
+            return paths[menu_id]
+
+        changed = []
+        for menu in Menu.objects.only("id", "tree_path").iterator():
+            tree_path = resolve(menu.id)
+            if menu.tree_path != tree_path:
+                menu.tree_path = tree_path
+                changed.append(menu)
+
+        with transaction.atomic():
+            Menu.objects.bulk_update(changed, ["tree_path"], batch_size=options["batch_size"])
+        self.stdout.write(self.style.SUCCESS(f"共{len(parents)}个菜单, 更新{len(changed)}个菜单的物化路径"))
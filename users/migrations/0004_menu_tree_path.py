@@ -0,0 +1,18 @@
+# Generated by Django 4.2.7 on 2026-10-19 03:27
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0003_menu_roles_alter_role_menu'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='menu',
+            name='tree_path',
+            field=models.CharField(blank=True, db_index=True, default='', editable=False, help_text='从根节点到当前节点的id路径, 如/1/5/9/', max_length=255, verbose_name='物化路径'),
+        ),
+    ]
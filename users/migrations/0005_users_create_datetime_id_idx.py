@@ -0,0 +1,17 @@
+# Generated by Django 4.2.7 on 2026-10-19 03:31
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0004_menu_tree_path'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='users',
+            index=models.Index(fields=['create_datetime', 'id'], name='users_create_datetime_id_idx'),
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 4.2.7 on 2026-10-19 03:36
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0005_users_create_datetime_id_idx'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='menu',
+            name='api',
+            field=models.CharField(blank=True, help_text='【按钮】授权访问的接口地址, {id}匹配路径参数, 如/api/v1/users/user/{id}/', max_length=255, null=True, verbose_name='接口地址'),
+        ),
+        migrations.AddField(
+            model_name='menu',
+            name='method',
+            field=models.CharField(blank=True, choices=[('*', '全部'), ('GET', 'GET'), ('POST', 'POST'), ('PUT', 'PUT'), ('PATCH', 'PATCH'), ('DELETE', 'DELETE')], default='*', help_text='【按钮】接口请求方法', max_length=8, null=True, verbose_name='接口请求方法'),
+        ),
+    ]
@@ -1,6 +1,8 @@
 from django.contrib.auth.models import AbstractUser
 from django.contrib.auth.hashers import make_password
-from django.db import models
+from django.db import connections, models
+from django.db.models import Value
+from django.db.models.functions import Concat, Substr
 from users.utils.models import CoreModel, table_prefix
 
 
@@ -19,6 +21,12 @@ class Users(CoreModel, AbstractUser):
     def set_password(self, raw_password):
         self.password = make_password(raw_password)
 
+    def refresh_from_db(self, using=None, fields=None):
+        # 由token构建的用户(见StatelessJWTAuthentication)首次访问未加载的字段时一次性加载全部字段
+        if fields is not None and hasattr(self, "token_role_ids"):
+            fields = set(fields) | self.get_deferred_fields()
+        super().refresh_from_db(using, fields)
+
     def __str__(self):
         return self.username
 
@@ -27,6 +35,10 @@ class Users(CoreModel, AbstractUser):
         verbose_name = "用户表"
         verbose_name_plural = verbose_name
         ordering = ("-create_datetime",)
+        indexes = [
+            # 游标分页按(create_datetime, id)定位
+            models.Index(fields=["create_datetime", "id"], name="users_create_datetime_id_idx"),
+        ]
 
 
 class Role(CoreModel):
@@ -49,6 +61,52 @@ class Role(CoreModel):
         ordering = ("sort",)
 
 
+def parse_tree_path(tree_path):
+    """
+    解析菜单的物化路径, "/1/5/9/" => [1, 5, 9]
+    """
+    return [int(node_id) for node_id in tree_path.strip("/").split("/") if node_id]
+
+
+class MenuQuerySet(models.QuerySet):
+    def bulk_create(self, objs, *args, **kwargs):
+        """
+        批量创建后按父级菜单的物化路径批量写入新菜单的路径, 数据库无法返回批量插入的主键时逐个保存
+        """
+        objs = list(objs)
+        if not connections[self.db].features.can_return_rows_from_bulk_insert:
+            for obj in objs:
+                obj.save(force_insert=True, using=self.db)
+            return objs
+        objs = super().bulk_create(objs, *args, **kwargs)
+        created = [obj for obj in objs if obj.pk is not None]
+        parent_paths = dict(
+            self.model._default_manager.using(self.db)
+            .filter(pk__in={obj.parent_id for obj in created if obj.parent_id is not None})
+            .values_list("pk", "tree_path")
+        )
+        for obj in created:
+            parent_path = "/" if obj.parent_id is None else parent_paths.get(obj.parent_id)
+            obj.tree_path = f"{parent_path}{obj.pk}/" if parent_path else obj.get_tree_path()
+        self.model._default_manager.using(self.db).bulk_update(created, ["tree_path"],
+                                                               batch_size=kwargs.get("batch_size"))
+        return objs
+
+    def bulk_update(self, objs, fields, *args, **kwargs):
+        """
+        批量更新, 父级菜单变化的节点逐个重新计算物化路径并同步子孙节点
+        """
+        objs = list(objs)
+        moved = []
+        if "parent" in fields or "parent_id" in fields:
+            old_parents = dict(self.filter(pk__in=[obj.pk for obj in objs]).values_list("pk", "parent_id"))
+            moved = [obj for obj in objs if obj.pk in old_parents and old_parents[obj.pk] != obj.parent_id]
+        rows = super().bulk_update(objs, fields, *args, **kwargs)
+        for obj in moved:
+            obj.update_tree_path()
+        return rows
+
+
 class Menu(CoreModel):
     name = models.CharField(max_length=64, verbose_name="菜单名称", help_text="菜单名称")
     MENU_TYPE_CHOICES = (
@@ -74,6 +132,18 @@ class Menu(CoreModel):
                                 help_text="跳转路径")
     perm = models.CharField(max_length=128, verbose_name="按钮权限", null=True, blank=True,
                             help_text="按钮权限")
+    METHOD_CHOICES = (
+        ('*', '全部'),
+        ('GET', 'GET'),
+        ('POST', 'POST'),
+        ('PUT', 'PUT'),
+        ('PATCH', 'PATCH'),
+        ('DELETE', 'DELETE'),
+    )
+    api = models.CharField(max_length=255, verbose_name="接口地址", null=True, blank=True,
+                           help_text="【按钮】授权访问的接口地址, {id}匹配路径参数, 如/api/v1/users/user/{id}/")
+    method = models.CharField(max_length=8, verbose_name="接口请求方法", choices=METHOD_CHOICES, default='*',
+                              null=True, blank=True, help_text="【按钮】接口请求方法")
     keep_alive = models.BooleanField(default=False, blank=True, verbose_name="是否开启页面缓存",
                                      help_text="【菜单】是否开启页面缓存(1:是 0:否)")
     always_show = models.BooleanField(default=False, blank=True, verbose_name="只有一个子路由是否始终显示",
@@ -82,10 +152,60 @@ class Menu(CoreModel):
                                null=True, blank=True, related_name='children', help_text="父级菜单")
     roles = models.ManyToManyField(to="Role", verbose_name="关联角色", db_constraint=False,
                                    related_name="menu_roles", help_text="关联角色")
+    tree_path = models.CharField(max_length=255, default="", blank=True, db_index=True, editable=False,
+                                 verbose_name="物化路径", help_text="从根节点到当前节点的id路径, 如/1/5/9/")
+
+    objects = MenuQuerySet.as_manager()
 
     def __str__(self):
         return self.name
 
+    def get_tree_path(self):
+        """
+        根据父级菜单计算当前节点的物化路径
+        """
+        if self.parent_id is None:
+            return f"/{self.pk}/"
+        parent_path = Menu.objects.filter(pk=self.parent_id).values_list("tree_path", flat=True).first()
+        if not parent_path:
+            parent_path = self.parent.get_tree_path()
+        if f"/{self.pk}/" in parent_path:
+            raise ValueError("不能将菜单移动到自身或其子菜单下")
+        return f"{parent_path}{self.pk}/"
+
+    def move_descendants(self, old_path):
+        """
+        移动节点时同步更新所有子孙节点的路径前缀
+        """
+        if old_path and old_path != self.tree_path:
+            Menu.objects.filter(tree_path__startswith=old_path).exclude(pk=self.pk).update(
+                tree_path=Concat(Value(self.tree_path), Substr("tree_path", len(old_path) + 1))
+            )
+
+    def update_tree_path(self):
+        """
+        父级菜单已直接写入数据库(如bulk_update)后, 重新计算并保存当前节点及子孙节点的路径
+        """
+        old_path = Menu.objects.filter(pk=self.pk).values_list("tree_path", flat=True).first()
+        self.tree_path = self.get_tree_path()
+        Menu.objects.filter(pk=self.pk).update(tree_path=self.tree_path)
+        self.move_descendants(old_path)
+
+    def save(self, *args, **kwargs):
+        old_path = None
+        if self.pk is not None:
+            old_path = Menu.objects.filter(pk=self.pk).values_list("tree_path", flat=True).first()
+            self.tree_path = self.get_tree_path()
+            if kwargs.get("update_fields") is not None:
+                kwargs["update_fields"] = {*kwargs["update_fields"], "tree_path"}
+        super().save(*args, **kwargs)
+        if old_path is None:
+            # 新建节点保存后才有id
+            self.tree_path = self.get_tree_path()
+            Menu.objects.filter(pk=self.pk).update(tree_path=self.tree_path)
+        else:
+            self.move_descendants(old_path)
+
     class Meta:
         db_table = table_prefix + "system_menu"
         verbose_name = "菜单表"
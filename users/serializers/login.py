@@ -2,6 +2,7 @@ from rest_framework_simplejwt.serializers import TokenObtainPairSerializer
 from django.utils.translation import gettext_lazy as _
 
 from users.models import Users
+from users.utils.authentication import add_token_claims
 
 
 class LoginSerializer(TokenObtainPairSerializer):
@@ -17,6 +18,10 @@ class LoginSerializer(TokenObtainPairSerializer):
 
     default_error_messages = {"no_active_account": _("账号/密码错误")}
 
+    @classmethod
+    def get_token(cls, user):
+        return add_token_claims(super().get_token(user), user)
+
     def validate(self, attrs):
         try:
             super().validate(attrs)
@@ -0,0 +1,46 @@
+# -*- coding: utf-8 -*-
+
+"""
+@Remark: 信号处理
+"""
+from django.db.models.signals import post_save, post_delete, m2m_changed
+from django.dispatch import receiver
+
+from users.models import Users, Role, Menu
+from users.utils.authentication import invalidate_token_version
+from users.utils.rbac_cache import invalidate_rbac_cache
+
+
+@receiver(post_save, sender=Menu)
+@receiver(post_delete, sender=Menu)
+@receiver(post_save, sender=Role)
+@receiver(post_delete, sender=Role)
+def rbac_model_changed(sender, **kwargs):
+    """菜单/角色变更时清空角色路由缓存"""
+    invalidate_rbac_cache()
+
+
+@receiver(m2m_changed, sender=Role.menu.through)
+@receiver(m2m_changed, sender=Menu.roles.through)
+@receiver(m2m_changed, sender=Users.role.through)
+def rbac_relation_changed(sender, action, **kwargs):
+    """角色-菜单、用户-角色关联变更时清空角色路由缓存"""
+    if action in ("post_add", "post_remove", "post_clear"):
+        invalidate_rbac_cache()
+
+
+@receiver(post_save, sender=Users)
+@receiver(post_delete, sender=Users)
+def user_changed(sender, instance, **kwargs):
+    """用户变更(密码、状态等)时清除token版本缓存"""
+    invalidate_token_version(instance.pk)
+
+
+@receiver(m2m_changed, sender=Users.role.through)
+def user_role_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    """用户角色变更时清除token版本缓存, 从角色一侧清空关联时由缓存过期处理"""
+    if action not in ("post_add", "post_remove", "post_clear"):
+        return
+    user_ids = (pk_set or ()) if reverse else [instance.pk]
+    for user_id in user_ids:
+        invalidate_token_version(user_id)
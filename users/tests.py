@@ -1,3 +1,1519 @@
-from django.test import TestCase
+import asyncio
+import csv
+import hashlib
+import io
+import json
+import os
+import random
+import statistics
+import tempfile
+import threading
+import time
+from base64 import urlsafe_b64encode
+from datetime import datetime, timedelta
+from unittest import mock
 
-# Create your tests here.
+from django.contrib.auth.hashers import check_password, make_password
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import connection
+from django.db.models.signals import m2m_changed
+from django.test import AsyncClient, SimpleTestCase, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from rest_framework.renderers import JSONRenderer
+from rest_framework.request import Request
+from rest_framework.test import APIClient, APIRequestFactory
+from rest_framework_simplejwt.tokens import RefreshToken
+
+from users.models import Menu, Role, Users
+from users.serializers.login import LoginSerializer
+from users.utils import login_pool, permission
+from users.utils.authentication import add_token_claims
+from users.utils.deletion import DELETE_CHUNK_SIZE, delete_by_keys
+from users.utils.filters import CustomDjangoFilterBackend, construct_queryset
+from users.utils.rbac_cache import invalidate_rbac_cache
+from users.utils.renderers import CustomJSONRenderer
+from users.utils.serializers import CustomListSerializer, CustomModelSerializer
+from users.utils.viewset import CustomCursorPagination
+from users.views.login import LoginView
+from users.views.menu import MenuSerializer, MenuViewSet
+from users.views.role import RoleCreateUpdateSerializer, RoleSerializer
+from users.views.user import UserSerializer, UserViewSet
+
+
+@override_settings(PASSWORD_HASH_ITERATIONS=1000)
+class ApiTestCase(TestCase):
+    """
+    以超级管理员身份调用接口
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = Users.objects.create(username="admin", name="超管", is_superuser=True)
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.admin)
+
+
+class BulkUniqueErrorTests(ApiTestCase):
+    """
+    批量新增/批量更新时唯一性校验失败按行返回错误
+    """
+
+    def test_create_reports_unique_errors_per_row(self):
+        response = self.client.post("/api/v1/users/user/", [
+            {"username": "a1", "name": "甲"},
+            {"username": "a1", "name": "乙"},
+            {"username": "admin", "name": "丙"},
+            {"username": "a2", "name": "丁"},
+        ], format="json")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data["code"], 400)
+        self.assertEqual(response.data["data"], [
+            {"index": 0, "errors": {"用户账号": ["账号必须唯一"]}},
+            {"index": 1, "errors": {"用户账号": ["账号必须唯一"]}},
+            {"index": 2, "errors": {"用户账号": ["账号必须唯一"]}},
+        ])
+        self.assertFalse(Users.objects.filter(username__in=["a1", "a2"]).exists())
+
+    def test_multiple_update_reports_unique_errors_per_row(self):
+        role1 = Role.objects.create(name="运维", key="ops")
+        role2 = Role.objects.create(name="开发", key="dev")
+        response = self.client.patch("/api/v1/users/role/multiple_update/", [
+            {"id": role1.id, "key": "dev"},
+            {"id": role2.id, "key": "dev"},
+        ], format="json")
+        self.assertEqual(response.data["code"], 400)
+        self.assertEqual([row["index"] for row in response.data["data"]], [0, 1])
+        self.assertEqual(response.data["data"][0]["errors"], {"权限字符": ["权限字符必须唯一"]})
+        self.assertEqual(Role.objects.get(id=role1.id).key, "ops")
+
+
+class MultipleUpdateTests(ApiTestCase):
+    """
+    批量更新: 修改人和修改时间、多对多关联的增删、菜单物化路径
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        cls.roles = [Role.objects.create(name=f"角色{index}", key=f"role{index}") for index in range(3)]
+        cls.users = [Users.objects.create(username=f"user{index}", name=f"用户{index}") for index in range(2)]
+        cls.users[0].role.set(cls.roles[:2])
+        cls.users[1].role.set(cls.roles[1:])
+
+    def test_stamps_modifier_and_update_datetime(self):
+        user_ids = [user.id for user in self.users]
+        Users.objects.filter(id__in=user_ids).update(modifier=None, update_datetime=datetime(2020, 1, 1))
+        before = datetime.now() - timedelta(seconds=1)
+        response = self.client.patch("/api/v1/users/user/multiple_update/", [
+            {"id": self.users[0].id, "name": "甲"},
+            {"id": self.users[1].id, "name": "乙"},
+        ], format="json")
+        self.assertEqual(response.data["msg"], "更新成功")
+        rows = Users.objects.filter(id__in=user_ids).order_by("username")
+        self.assertEqual([row.name for row in rows], ["甲", "乙"])
+        for row in rows:
+            self.assertEqual(row.modifier, str(self.admin.id))
+            self.assertGreater(row.update_datetime, before)
+
+    def test_many_to_many_diff(self):
+        changes = []
+
+        def receiver(sender, instance, action, pk_set, **kwargs):
+            if action.startswith("post_"):
+                changes.append((instance.id, action, pk_set))
+
+        m2m_changed.connect(receiver, sender=Users.role.through)
+        self.addCleanup(m2m_changed.disconnect, receiver, sender=Users.role.through)
+        role0, role1, role2 = (role.id for role in self.roles)
+        response = self.client.patch("/api/v1/users/user/multiple_update/", [
+            {"id": self.users[0].id, "role": [role1, role2]},
+            {"id": self.users[1].id, "role": [role1, role2]},
+        ], format="json")
+        self.assertEqual(response.data["msg"], "更新成功")
+        for user in self.users:
+            self.assertCountEqual(user.role.values_list("id", flat=True), [role1, role2])
+        # 只增删有差异的关联, 没有变化的行不发信号
+        self.assertEqual(changes, [(self.users[0].id, "post_remove", {role0}), (self.users[0].id, "post_add", {role2})])
+
+    def test_menu_moves(self):
+        root = Menu.objects.create(name="系统", menu_type="CATALOG")
+        child = Menu.objects.create(name="用户", menu_type="MENU", parent=root)
+        leaf = Menu.objects.create(name="新增", menu_type="BUTTON", parent=child)
+        other = Menu.objects.create(name="监控", menu_type="CATALOG")
+        # 同一请求中同时移动节点和它的新父级
+        response = self.client.patch("/api/v1/users/menu/multiple_update/", [
+            {"id": child.id, "parent": other.id},
+            {"id": other.id, "parent": root.id},
+        ], format="json")
+        self.assertEqual(response.data["msg"], "更新成功")
+        self.assertEqual(dict(Menu.objects.values_list("id", "tree_path")), {
+            root.id: f"/{root.id}/",
+            other.id: f"/{root.id}/{other.id}/",
+            child.id: f"/{root.id}/{other.id}/{child.id}/",
+            leaf.id: f"/{root.id}/{other.id}/{child.id}/{leaf.id}/",
+        })
+
+
+@override_settings(PASSWORD_HASH_ITERATIONS=1000)
+class ImportUsersTests(TestCase):
+    """
+    import_users命令: 校验失败的行跳过, 其余行导入
+    """
+
+    def test_skips_invalid_rows(self):
+        Role.objects.create(name="运维", key="ops")
+        Users.objects.create(username="exists", name="已有")
+        rows = [
+            {"username": "u1", "name": "甲", "password": "pw", "roles": ["ops"]},
+            {"username": "u2", "name": "乙"},
+            {"username": "u2", "name": "乙2"},
+            {"username": "exists", "name": "丙"},
+            {"username": "u3", "name": "丁", "roles": ["nope"]},
+        ]
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            path = os.path.join(tmp_dir, "users.ndjson")
+            with open(path, "w", encoding="utf-8") as file:
+                file.writelines(json.dumps(row, ensure_ascii=False) + "\n" for row in rows)
+            stderr = io.StringIO()
+            call_command("import_users", path, "--workers", "0", stdout=io.StringIO(), stderr=stderr)
+            self.assertFalse(os.path.exists(f"{path}.checkpoint"))
+        self.assertEqual(stderr.getvalue().count("账号必须唯一"), 3)
+        self.assertIn("角色不存在: nope", stderr.getvalue())
+        user = Users.objects.get(username="u1")
+        self.assertTrue(user.check_password("pw"))
+        self.assertEqual(list(user.role.values_list("key", flat=True)), ["ops"])
+        self.assertFalse(Users.objects.filter(username__in=["u2", "u3"]).exists())
+
+
+class BulkUniqueValidatorTests(TestCase):
+    """
+    CustomUniqueValidator批量校验: 请求数据内的重复值和数据库中的已有值
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.ops = Role.objects.create(name="运维", key="ops")
+        cls.dev = Role.objects.create(name="开发", key="dev")
+
+    def get_serializer(self, *args, **kwargs):
+        return RoleCreateUpdateSerializer(*args, many=True, **kwargs)
+
+    def test_duplicates_inside_payload(self):
+        serializer = self.get_serializer(data=[
+            {"name": "a", "key": "k1"},
+            {"name": "b", "key": "k1"},
+            {"name": "c", "key": "k2"},
+        ])
+        self.assertFalse(serializer.is_valid())
+        self.assertEqual(serializer.errors, [
+            {"权限字符": ["权限字符必须唯一"]},
+            {"权限字符": ["权限字符必须唯一"]},
+            {},
+        ])
+
+    def test_collision_with_existing_row(self):
+        serializer = self.get_serializer(data=[{"name": "a", "key": "ops"}, {"name": "b", "key": "k2"}])
+        self.assertFalse(serializer.is_valid())
+        self.assertEqual(serializer.errors, [{"权限字符": ["权限字符必须唯一"]}, {}])
+
+    def test_update_row_keeps_own_value(self):
+        serializer = self.get_serializer([self.ops, self.dev], data=[
+            {"key": "ops", "name": "运维组"},
+            {"key": "dev", "name": "开发"},
+        ], partial=True)
+        self.assertTrue(serializer.is_valid(), serializer.errors)
+
+    def test_update_row_takes_other_rows_value(self):
+        serializer = self.get_serializer([self.ops], data=[{"key": "dev"}], partial=True)
+        self.assertFalse(serializer.is_valid())
+        self.assertEqual(serializer.errors, [{"权限字符": ["权限字符必须唯一"]}])
+
+
+
+class VerboseNameTests(TestCase):
+    """
+    错误中字段名替换为verbose_name: 映射每个序列化器类只计算一次
+    """
+
+    def test_computed_once_per_serializer_class(self):
+        data = [{"name": f"角色{index}", "key": ""} for index in range(50)]
+        with mock.patch.dict("users.utils.serializers._verbose_names", clear=True), \
+                mock.patch.object(Role._meta, "get_fields", wraps=Role._meta.get_fields) as get_fields:
+            for _ in range(2):
+                serializer = RoleCreateUpdateSerializer(data=data, many=True)
+                self.assertFalse(serializer.is_valid())
+                self.assertEqual(serializer.errors, [{"权限字符": ["该字段不能为空。"]}] * 50)
+            serializer = RoleCreateUpdateSerializer(data={"name": "", "key": "k"})
+            self.assertFalse(serializer.is_valid())
+            self.assertEqual(list(serializer.errors), ["角色名称"])
+            self.assertEqual(get_fields.call_count, 1)
+
+    def test_verbose_names_not_evaluated(self):
+        # 保存原始的verbose_name, 懒翻译字符串在替换时才按当前语言求值
+        verbose_names = RoleCreateUpdateSerializer.get_verbose_names()
+        self.assertIs(verbose_names["key"], Role._meta.get_field("key").verbose_name)
+
+
+class ListSerializerTests(TestCase):
+    """
+    many=True时使用的列表序列化器
+    """
+
+    def test_many_init_keeps_meta(self):
+        class ParentSerializer(CustomModelSerializer):
+            class Meta:
+                model = Role
+                fields = ["id", "name", "key"]
+
+        class ChildSerializer(ParentSerializer):
+            class Meta(ParentSerializer.Meta):
+                fields = ["id", "name"]
+
+        class ExplicitListSerializer(CustomListSerializer):
+            pass
+
+        class ExplicitSerializer(ParentSerializer):
+            class Meta(ParentSerializer.Meta):
+                list_serializer_class = ExplicitListSerializer
+
+        for serializer_class in (ChildSerializer, ParentSerializer):
+            serializer = serializer_class([], many=True, max_length=5)
+            self.assertIs(type(serializer), CustomListSerializer)
+            self.assertEqual(serializer.max_length, 5)
+            self.assertIs(type(serializer.child), serializer_class)
+        self.assertFalse(hasattr(ParentSerializer.Meta, "list_serializer_class"))
+        self.assertFalse(hasattr(ChildSerializer.Meta, "list_serializer_class"))
+        self.assertIs(type(ExplicitSerializer([], many=True)), ExplicitListSerializer)
+
+    def test_child_create_and_update_overrides(self):
+        calls = []
+
+        class RowSerializer(CustomModelSerializer):
+            class Meta:
+                model = Role
+                fields = ["id", "name", "key"]
+
+            def create(self, validated_data):
+                calls.append(("create", validated_data["key"]))
+                return super().create(validated_data)
+
+            def update(self, instance, validated_data):
+                calls.append(("update", instance.key))
+                return super().update(instance, validated_data)
+
+        serializer = RowSerializer(data=[{"name": "运维", "key": "ops"}, {"name": "开发", "key": "dev"}], many=True)
+        self.assertTrue(serializer.is_valid(), serializer.errors)
+        roles = serializer.save()
+        self.assertEqual(calls, [("create", "ops"), ("create", "dev")])
+
+        serializer = RowSerializer(roles, data=[{"name": "运维组"}, {"name": "开发组"}], many=True, partial=True)
+        self.assertTrue(serializer.is_valid(), serializer.errors)
+        serializer.save()
+        self.assertEqual(calls[2:], [("update", "ops"), ("update", "dev")])
+        self.assertEqual(list(Role.objects.order_by("id").values_list("name", flat=True)), ["运维组", "开发组"])
+
+class MenuTreePathTests(ApiTestCase):
+    """
+    物化路径只在内部维护, 不在菜单接口中返回
+    """
+
+    def test_tree_path_not_in_responses(self):
+        root = Menu.objects.create(name="系统", menu_type="CATALOG")
+        child = Menu.objects.create(name="用户", menu_type="MENU", parent=root)
+        self.assertEqual(Menu.objects.get(id=child.id).tree_path, f"/{root.id}/{child.id}/")
+        rows = self.client.get("/api/v1/users/menu/").data["data"]["data"]
+        self.assertEqual([row["id"] for row in rows], [root.id])
+        self.assertNotIn("tree_path", rows[0])
+        self.assertNotIn("tree_path", self.client.get(f"/api/v1/users/menu/{child.id}/").data["data"])
+
+
+class MenuRoutesTests(ApiTestCase):
+    """
+    routes: 超级管理员返回全部菜单; 其余用户返回所有角色关联的菜单, 子菜单同样按角色过滤
+    """
+    url = "/api/v1/users/menu/routes/"
+
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        cls.system = Menu.objects.create(name="系统管理", menu_type="CATALOG", path="/system", sort=1)
+        cls.user_menu = Menu.objects.create(name="用户管理", menu_type="MENU", path="user", parent=cls.system, sort=1)
+        cls.role_menu = Menu.objects.create(name="角色管理", menu_type="MENU", path="role", parent=cls.system, sort=2)
+        cls.log = Menu.objects.create(name="日志", menu_type="CATALOG", path="/log", sort=2)
+        cls.login_log = Menu.objects.create(name="登录日志", menu_type="MENU", path="login", parent=cls.log)
+        cls.ops = Role.objects.create(name="运维", key="ops", sort=1)
+        cls.dev = Role.objects.create(name="开发", key="dev", sort=2)
+        cls.ops.menu.set([cls.system, cls.user_menu])
+        # 父菜单"日志"没有关联角色
+        cls.dev.menu.set([cls.role_menu, cls.login_log])
+        # meta.roles 来自菜单自身关联的角色(Menu.roles)
+        cls.system.roles.set([cls.ops, cls.dev])
+        cls.role_menu.roles.set([cls.dev])
+        cls.user = Users.objects.create(username="ops", name="运维")
+        cls.user.role.set([cls.ops, cls.dev])
+
+    def setUp(self):
+        super().setUp()
+        cache.clear()
+
+    def get_routes(self):
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        return response.data["data"]
+
+    def names(self, routes):
+        return [(route["name"], self.names(route["children"])) for route in routes]
+
+    def test_superuser_gets_all_menus(self):
+        self.assertEqual(self.names(self.get_routes()), [
+            ("系统管理", [("用户管理", []), ("角色管理", [])]),
+            ("日志", [("登录日志", [])]),
+        ])
+
+    def test_menus_of_all_roles(self):
+        self.client.force_authenticate(self.user)
+        routes = self.get_routes()
+        # 子菜单按角色过滤, 父菜单未关联角色的"登录日志"不返回
+        self.assertEqual(self.names(routes), [("系统管理", [("用户管理", []), ("角色管理", [])])])
+        self.assertEqual(routes[0]["meta"], {"title": "系统管理", "icon": None, "hidden": False, "roles": ["运维", "开发"]})
+        self.assertEqual(routes[0]["children"][1]["meta"]["roles"], ["开发"])
+
+    def test_child_not_granted(self):
+        self.user.role.set([self.ops])
+        self.client.force_authenticate(self.user)
+        self.assertEqual(self.names(self.get_routes()), [("系统管理", [("用户管理", [])])])
+
+    def test_query_count_independent_of_menus(self):
+        self.client.force_authenticate(self.user)
+        with CaptureQueriesContext(connection) as context:
+            self.get_routes()
+        # 下一次请求开始时会清空查询记录
+        queries = len(context.captured_queries)
+        self.ops.menu.add(*[Menu.objects.create(name=f"菜单{index}", menu_type="MENU", parent=self.user_menu)
+                            for index in range(5)])
+        cache.clear()
+        with self.assertNumQueries(queries):
+            self.assertEqual(len(self.get_routes()[0]["children"][0]["children"]), 5)
+
+
+class MenuCycleTests(ApiTestCase):
+    """
+    把菜单移动到自身或其子孙菜单下时返回字段错误
+    """
+
+    def setUp(self):
+        super().setUp()
+        self.root = Menu.objects.create(name="系统", menu_type="CATALOG")
+        self.child = Menu.objects.create(name="用户", menu_type="MENU", parent=self.root)
+        self.leaf = Menu.objects.create(name="新增", menu_type="BUTTON", parent=self.child)
+        self.other = Menu.objects.create(name="监控", menu_type="CATALOG")
+
+    def assert_paths_unchanged(self):
+        self.assertEqual(
+            dict(Menu.objects.values_list("id", "tree_path")),
+            {self.root.id: f"/{self.root.id}/", self.child.id: f"/{self.root.id}/{self.child.id}/",
+             self.leaf.id: f"/{self.root.id}/{self.child.id}/{self.leaf.id}/", self.other.id: f"/{self.other.id}/"},
+        )
+
+    def test_update(self):
+        for parent in (self.root, self.leaf):
+            with self.subTest(parent=parent.name):
+                response = self.client.patch(f"/api/v1/users/menu/{self.root.id}/", {"parent": parent.id},
+                                             format="json")
+                self.assertEqual(response.status_code, 400)
+                self.assertEqual(response.data, {"父级菜单": ["不能将菜单移动到自身或其子菜单下"]})
+        self.assert_paths_unchanged()
+
+    def test_multiple_update(self):
+        response = self.client.patch("/api/v1/users/menu/multiple_update/", [
+            {"id": self.root.id, "parent": self.leaf.id},
+            {"id": self.other.id, "name": "监控中心"},
+        ], format="json")
+        self.assertEqual(response.data["msg"], "批量更新数据校验失败")
+        self.assertEqual(response.data["data"], [{"index": 0, "errors": {"父级菜单": ["不能将菜单移动到自身或其子菜单下"]}}])
+        self.assert_paths_unchanged()
+
+    def test_multiple_update_cycle_within_payload(self):
+        # 每行单独看都合法, 合在一起形成环
+        response = self.client.patch("/api/v1/users/menu/multiple_update/", [
+            {"id": self.root.id, "parent": self.other.id},
+            {"id": self.other.id, "parent": self.leaf.id},
+        ], format="json")
+        self.assertEqual(response.data["msg"], "批量更新数据校验失败")
+        self.assertEqual([row["index"] for row in response.data["data"]], [0, 1])
+        self.assert_paths_unchanged()
+
+    def test_valid_move(self):
+        response = self.client.patch(f"/api/v1/users/menu/{self.child.id}/", {"parent": self.other.id}, format="json")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(Menu.objects.get(id=self.leaf.id).tree_path,
+                         f"/{self.other.id}/{self.child.id}/{self.leaf.id}/")
+
+
+def construct_data(qs_filter, qs_node, is_parent):
+    """
+    原有的逐级遍历parent实现, 作为construct_queryset的对照
+    """
+    filter_node_ids = set(qs_filter.values_list("id", flat=True))
+    render_node_ids = set(qs_node.values_list("id", flat=True))
+
+    hidden_node_ids = set()
+    for node in qs_filter:
+        while node.parent:
+            if node.parent in qs_filter:
+                hidden_node_ids.add(node.id)
+            node = node.parent
+    on_show = filter_node_ids.difference(hidden_node_ids)
+    on_expand = hidden_node_ids & render_node_ids
+    return on_expand if is_parent else on_show
+
+
+class ConstructQuerysetTests(TestCase):
+    """
+    随机生成的菜单树上construct_queryset与原实现的结果一致
+    """
+
+    def build_tree(self, rng, size):
+        Menu.objects.all().delete()
+        menus = []
+        for index in range(size):
+            parent = rng.choice(menus) if menus and rng.random() < 0.8 else None
+            menus.append(Menu.objects.create(name=f"m{index}", parent=parent))
+        return [menu.id for menu in menus]
+
+    def assert_same_as_reference(self, rng, menu_ids):
+        for _ in range(5):
+            qs_filter = Menu.objects.filter(id__in=rng.sample(menu_ids, rng.randint(1, len(menu_ids))))
+            qs_node = Menu.objects.filter(id__in=rng.sample(menu_ids, rng.randint(1, len(menu_ids))))
+            for is_parent in (False, True):
+                expected = construct_data(qs_filter, qs_node, is_parent)
+                actual = set(construct_queryset(qs_filter, qs_node, is_parent).values_list("id", flat=True))
+                self.assertEqual(actual, expected)
+
+    def test_random_trees(self):
+        rng = random.Random(20240101)
+        for _ in range(30):
+            self.assert_same_as_reference(rng, self.build_tree(rng, rng.randint(5, 40)))
+
+    def test_random_trees_without_tree_path(self):
+        rng = random.Random(20240102)
+        for _ in range(10):
+            menu_ids = self.build_tree(rng, rng.randint(5, 40))
+            # 未回填物化路径的历史数据
+            Menu.objects.filter(id__in=rng.sample(menu_ids, 3)).update(tree_path="")
+            self.assert_same_as_reference(rng, menu_ids)
+
+    def test_uses_tree_path_query_only(self):
+        menu_ids = self.build_tree(random.Random(1), 30)
+        qs_filter = Menu.objects.filter(id__in=menu_ids[::2])
+        # 查询匹配节点的物化路径 + 返回结果
+        with self.assertNumQueries(2):
+            list(construct_queryset(qs_filter, Menu.objects.all(), False))
+
+
+class UserFilterView:
+    filter_fields = ["^name", "=username", "@description", "$mobile", "~email", "date_joined"]
+
+
+class FilterLookupTests(TestCase):
+    """
+    CustomDjangoFilterBackend: 字段前缀对应的查询表达式, 同一参数两个值时按区间查询
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        for username, name, mobile, email, day in (
+            ("alice", "张三", "13800000001", "alice@corp.com", 1),
+            ("bob", "李四", "13900000002", "bob@mail.com", 10),
+            ("carol", "张小明", "15000000003", "carol@corp.com", 20),
+        ):
+            Users.objects.create(username=username, name=name, mobile=mobile, email=email,
+                                 date_joined=f"2024-01-{day:02d} 08:00:00")
+
+    def filter_users(self, params):
+        request = Request(APIRequestFactory().get("/", params))
+        queryset = CustomDjangoFilterBackend().filter_queryset(request, Users.objects.all(), UserFilterView())
+        return sorted(queryset.values_list("username", flat=True))
+
+    def test_lookup_map(self):
+        backend = CustomDjangoFilterBackend()
+        request = Request(APIRequestFactory().get("/"))
+        filterset = backend.get_filterset(request, Users.objects.all(), UserFilterView())
+        self.assertEqual(backend.build_orm_lookup_map(filterset), {
+            "name": "name__istartswith",
+            "username": "username__iexact",
+            "description": "description__search",
+            "mobile": "mobile__iregex",
+            "email": "email__icontains",
+            "date_joined": "date_joined__exact",
+        })
+
+    def test_filterset_class_memoized(self):
+        class OtherFilterView:
+            filter_fields = ["^name", "=username"]
+
+        backend = CustomDjangoFilterBackend
+        with mock.patch.dict(backend.filterset_class_cache, clear=True), \
+                mock.patch.dict(backend.orm_lookup_map_cache, clear=True), \
+                mock.patch.object(backend, "build_filterset_class", autospec=True,
+                                  side_effect=backend.build_filterset_class) as build_filterset_class, \
+                mock.patch.object(backend, "build_orm_lookup_map", autospec=True,
+                                  side_effect=backend.build_orm_lookup_map) as build_orm_lookup_map:
+            for params in ({"name": "张"}, {"username": "bob"}, {"mobile": "138"}, {"name": "李"}):
+                self.filter_users(params)
+            self.assertEqual(build_filterset_class.call_count, 1)
+            self.assertEqual(build_orm_lookup_map.call_count, 1)
+            first = backend().get_filterset_class(UserFilterView(), Users.objects.all())
+            self.assertIs(backend().get_filterset_class(UserFilterView(), Users.objects.all()), first)
+            # 过滤字段不同的视图使用各自的FilterSet类
+            other = backend().get_filterset_class(OtherFilterView(), Users.objects.all())
+            self.assertIsNot(other, first)
+            self.assertEqual(build_filterset_class.call_count, 2)
+
+    def test_istartswith_prefix(self):
+        self.assertEqual(self.filter_users({"name": "张"}), ["alice", "carol"])
+
+    def test_iexact_prefix(self):
+        self.assertEqual(self.filter_users({"username": "ALICE"}), ["alice"])
+
+    def test_iregex_prefix(self):
+        self.assertEqual(self.filter_users({"mobile": "^13[89]"}), ["alice", "bob"])
+
+    def test_icontains_prefix(self):
+        self.assertEqual(self.filter_users({"email": "CORP"}), ["alice", "carol"])
+
+    def test_combined_params(self):
+        self.assertEqual(self.filter_users({"name": "张", "email": "alice"}), ["alice"])
+
+    def test_single_value_uses_field_lookup(self):
+        self.assertEqual(self.filter_users({"date_joined": "2024-01-10 08:00:00"}), ["bob"])
+
+    def test_two_values_use_range(self):
+        params = {"date_joined": ["2024-01-05 00:00:00", "2024-01-31 00:00:00"]}
+        self.assertEqual(self.filter_users(params), ["bob", "carol"])
+
+    def test_empty_and_unknown_params_ignored(self):
+        self.assertEqual(self.filter_users({"name": "", "unknown": "x"}), ["alice", "bob", "carol"])
+
+
+class AuditDataTestCase(ApiTestCase):
+    """
+    15个用户/角色/菜单, 创建人和修改人分布在5个用户上
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        auditors = [Users.objects.create(username=f"auditor{i}", name=f"审计{i}") for i in range(5)]
+        audit = [{"creator": auditors[i % 5], "modifier": str(auditors[(i + 1) % 5].id)} for i in range(15)]
+        cls.roles = [Role.objects.create(name=f"角色{i}", key=f"role{i}", **audit[i]) for i in range(15)]
+        cls.menus = [Menu.objects.create(name=f"菜单{i}", **audit[i]) for i in range(15)]
+        cls.users = [Users.objects.create(username=f"user{i}", name=f"用户{i}", **audit[i]) for i in range(15)]
+        for i in range(15):
+            cls.users[i].role.set(cls.roles[i:i + 2])
+            cls.roles[i].menu.set(cls.menus[i:i + 3])
+            cls.menus[i].roles.set(cls.roles[i:i + 2])
+
+
+class AuditUserNameQueryTests(AuditDataTestCase):
+    """
+    列表序列化时创建人/修改人姓名一次批量查询
+    """
+
+    def test_serializer_resolves_names_in_one_query(self):
+        cases = (
+            (UserSerializer, Users.objects.filter(username__startswith="user").prefetch_related("role")),
+            (RoleSerializer, Role.objects.prefetch_related("menu")),
+            (MenuSerializer, Menu.objects.prefetch_related("roles")),
+        )
+        for serializer_class, queryset in cases:
+            with self.subTest(serializer_class.__name__):
+                # 数据 + 多对多预取 + 创建人/修改人姓名
+                with self.assertNumQueries(3):
+                    data = serializer_class(queryset, many=True).data
+                self.assertEqual(len(data), 15)
+                self.assertTrue(all(row["creator_name"] and row["modifier_name"] for row in data))
+
+    def test_list_pages(self):
+        # 用户和角色列表: 总数 + 数据 + 多对多 + 创建人/修改人姓名; 菜单列表不分页
+        for url, queries in (("/api/v1/users/user/", 4), ("/api/v1/users/role/", 4), ("/api/v1/users/menu/", 3)):
+            with self.subTest(url):
+                with self.assertNumQueries(queries):
+                    response = self.client.get(url)
+                rows = response.data["data"]["data"]
+                rows = rows["results"] if isinstance(rows, dict) else rows
+                self.assertTrue(rows)
+                self.assertTrue(all(row["modifier_name"] for row in rows if row["modifier"]))
+
+
+class ViewSetQueryPlanTests(AuditDataTestCase):
+    """
+    list/retrieve的查询数量与序列化器推断的查询方案
+    """
+
+    def assert_queries(self, url, queries):
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200, response.data)
+        self.assertEqual(len(context.captured_queries), queries,
+                         "\n".join(query["sql"] for query in context.captured_queries))
+        return context.captured_queries
+
+    def test_list(self):
+        # 总数 + 数据 + 多对多 + 创建人/修改人姓名, 菜单列表不分页
+        for url, queries in (("/api/v1/users/user/", 4), ("/api/v1/users/role/", 4), ("/api/v1/users/menu/", 3)):
+            with self.subTest(url):
+                self.assert_queries(url, queries)
+
+    def test_retrieve(self):
+        # 数据 + 多对多 + 创建人/修改人姓名
+        for url in (f"/api/v1/users/user/{self.users[0].id}/", f"/api/v1/users/role/{self.roles[0].id}/",
+                    f"/api/v1/users/menu/{self.menus[0].id}/"):
+            with self.subTest(url):
+                self.assert_queries(url, 3)
+
+    def test_user_list_by_planner(self):
+        # 不使用values()快速路径时由查询方案预取角色
+        with mock.patch.object(UserViewSet, "values_queryset", None):
+            self.assert_queries("/api/v1/users/user/", 4)
+
+    def test_password_deferred(self):
+        user_url = "/api/v1/users/user/"
+        for url in (user_url, f"{user_url}{self.users[0].id}/"):
+            for values_queryset in (UserViewSet.values_queryset, None):
+                with self.subTest(url, values_path=values_queryset is not None):
+                    with mock.patch.object(UserViewSet, "values_queryset", values_queryset):
+                        queries = self.assert_queries(url, 4 if url == user_url else 3)
+                    user_queries = [query["sql"] for query in queries
+                                    if f'FROM "{Users._meta.db_table}"' in query["sql"]]
+                    self.assertTrue(user_queries)
+                    self.assertFalse([sql for sql in user_queries if '"password"' in sql])
+
+
+class ValuesFastPathTests(AuditDataTestCase):
+    """
+    values()快速路径与序列化器路径输出的响应字节一致
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        # 空值、中文、子菜单和没有关联的行
+        Users.objects.create(username="empty", name="", mobile=None, avatar="头像/\u2028")
+        Menu.objects.create(name="子菜单", menu_type="MENU", parent=cls.menus[0], icon=None, sort=None)
+        # 角色排序值不全相同, 多对多id的顺序取决于排序
+        Role.objects.filter(id=cls.roles[1].id).update(sort=0)
+
+    def assert_same_bytes(self, viewset, url):
+        fast = self.client.get(url)
+        with mock.patch.object(viewset, "values_queryset", None):
+            slow = self.client.get(url)
+        self.assertEqual(fast.status_code, 200)
+        self.assertEqual(fast.content, slow.content)
+        return fast
+
+    def test_user_list(self):
+        for query in ("", "?page=2&page_size=5", "?ordering=-username", "?name=用户1"):
+            with self.subTest(query=query):
+                self.assert_same_bytes(UserViewSet, f"/api/v1/users/user/{query}")
+
+    def test_menu_list(self):
+        for query in ("", f"?parent={self.menus[0].id}", "?name=菜单1"):
+            with self.subTest(query=query):
+                self.assert_same_bytes(MenuViewSet, f"/api/v1/users/menu/{query}")
+
+    def test_fast_path_used(self):
+        # 快速路径不实例化序列化器
+        for viewset, url in ((UserViewSet, "/api/v1/users/user/"), (MenuViewSet, "/api/v1/users/menu/")):
+            with self.subTest(url=url):
+                with mock.patch.object(viewset, "get_serializer", side_effect=AssertionError("实例化了序列化器")):
+                    self.assertEqual(self.client.get(url).status_code, 200)
+
+
+class RendererTests(AuditDataTestCase):
+    """
+    CustomJSONRenderer与DRF的JSONRenderer输出的字节一致
+    """
+
+    def assert_same_render(self, data):
+        self.assertEqual(CustomJSONRenderer().render(data), JSONRenderer().render(data))
+
+    def test_list_payloads(self):
+        for url in ("/api/v1/users/user/?page_size=100", "/api/v1/users/role/?page_size=100", "/api/v1/users/menu/",
+                    f"/api/v1/users/user/{self.users[0].id}/"):
+            with self.subTest(url=url):
+                response = self.client.get(url)
+                self.assertEqual(response.status_code, 200)
+                self.assert_same_render(response.data)
+                self.assertEqual(response.content, JSONRenderer().render(response.data))
+
+    def test_floats(self):
+        for value in (1e-07, 1e16, -2.5e-05, 1.2345678901234568e+17, 5e-324, 1.7976931348623157e+308,
+                      0.0001, 1e15, 0.1 + 0.2, -0.0, 12345.678):
+            with self.subTest(value=value):
+                self.assert_same_render({"value": value, "list": [value, 1, "1e16"]})
+
+    def test_exponent_like_strings(self):
+        self.assert_same_render({"hash": "3e4a9f00c1", "text": "role1:1e-7,0.00001", "value": 1.5})
+
+
+class CursorPaginationTests(ApiTestCase):
+    """
+    游标分页: 排序值大量相同时前后翻页不重不漏, 无效游标返回404, 与values()快速路径结果一致
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        Users.objects.bulk_create(Users(username=f"cursor{index}", name=f"游标{index}") for index in range(23))
+        # 三组相同的创建时间, 组内只能靠id区分先后
+        for index, user_id in enumerate(Users.objects.order_by("id").values_list("id", flat=True)):
+            Users.objects.filter(id=user_id).update(create_datetime=datetime(2024, 1, 1 + index % 3))
+        cls.expected = list(Users.objects.order_by("-create_datetime", "-id").values_list("id", flat=True))
+
+    def setUp(self):
+        super().setUp()
+        patcher = mock.patch.object(UserViewSet, "pagination_class", CustomCursorPagination)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    @staticmethod
+    def get_link(response, rel):
+        for link in filter(None, response.get("Link", "").split(", ")):
+            url, link_rel = link.split("; ")
+            if link_rel == f'rel="{rel}"':
+                return url[1:-1]
+        return None
+
+    def walk(self, url, rel):
+        pages = []
+        while url:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            pages.append([row["id"] for row in response.data["data"]["data"]])
+            url = self.get_link(response, rel)
+        return pages
+
+    def test_forward_and_backward_walk(self):
+        forward = self.walk("/api/v1/users/user/?page_size=4", "next")
+        self.assertEqual([len(page) for page in forward], [4, 4, 4, 4, 4, 4])
+        self.assertEqual(sum(forward, []), self.expected)
+
+        last = self.client.get("/api/v1/users/user/?page_size=4")
+        while self.get_link(last, "next"):
+            last = self.client.get(self.get_link(last, "next"))
+        backward = self.walk(self.get_link(last, "prev"), "prev")
+        self.assertEqual(backward[::-1], forward[:-1])
+
+    def test_values_fast_path_matches_serializer_path(self):
+        fast = self.walk("/api/v1/users/user/?page_size=5", "next")
+        with mock.patch.object(UserViewSet, "values_queryset", None):
+            slow = self.walk("/api/v1/users/user/?page_size=5", "next")
+        self.assertEqual(fast, slow)
+        response = self.client.get("/api/v1/users/user/?page_size=5")
+        next_url = self.get_link(response, "next")
+        fast = self.client.get(next_url).content
+        with mock.patch.object(UserViewSet, "values_queryset", None):
+            self.assertEqual(self.client.get(next_url).content, fast)
+
+    def test_invalid_cursor_returns_404(self):
+        def encode(data):
+            return urlsafe_b64encode(json.dumps(data).encode()).decode()
+
+        for cursor in (
+            "!!!",
+            "bm90IGpzb24",
+            encode([]),
+            encode({"p": ["2024-01-01T00:00:00"], "r": 0}),
+            encode({"p": {"a": 1, "b": 2}, "r": 0}),
+            encode({"p": ["yesterday", 1], "r": 0}),
+            encode({"p": ["2024-01-01T00:00:00", "abc"], "r": 0}),
+            encode({"p": [None, 1], "r": 0}),
+            encode({"p": [["2024-01-01"], {"id": 1}], "r": 0}),
+        ):
+            with self.subTest(cursor=cursor):
+                response = self.client.get(f"/api/v1/users/user/?cursor={cursor}")
+                self.assertEqual(response.status_code, 404)
+
+
+class ExportTests(ApiTestCase):
+    """
+    流式导出: ndjson/csv的内容与列表接口一致, 支持过滤参数, 按export_chunk_size分批输出
+    """
+    export_url = "/api/v1/users/user/export/"
+
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        cls.roles = [Role.objects.create(name=f"角色{index}", key=f"role{index}") for index in range(2)]
+        for index in range(7):
+            user = Users.objects.create(username=f"export{index}", name=f"导出{index}",
+                                        mobile=f"1380000000{index}" if index % 2 else None)
+            user.role.set(cls.roles[:index % 3])
+
+    def list_rows(self, query=""):
+        response = self.client.get(f"/api/v1/users/user/?page_size=100{query}")
+        return json.loads(response.content)["data"]["data"]["results"]
+
+    def export(self, query=""):
+        response = self.client.get(f"{self.export_url}{query}")
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.streaming)
+        return response, list(response.streaming_content)
+
+    def test_ndjson(self):
+        response, chunks = self.export()
+        self.assertEqual(response["Content-Type"], "application/x-ndjson; charset=utf-8")
+        self.assertEqual(response["Content-Disposition"], 'attachment; filename="users.ndjson"')
+        lines = b"".join(chunks).decode().splitlines()
+        self.assertEqual([json.loads(line) for line in lines], self.list_rows())
+
+    def test_csv(self):
+        response, chunks = self.export("?export_format=csv")
+        self.assertEqual(response["Content-Type"], "text/csv; charset=utf-8")
+        content = b"".join(chunks).decode()
+        self.assertTrue(content.startswith("\ufeff"))
+        rows = list(csv.DictReader(io.StringIO(content[1:])))
+        expected = self.list_rows()
+        self.assertEqual(list(rows[0]), list(expected[0]))
+        self.assertEqual(len(rows), len(expected))
+        for row, item in zip(rows, expected):
+            self.assertEqual(row["username"], item["username"])
+            self.assertEqual(row["mobile"], item["mobile"] or "")
+            self.assertEqual(json.loads(row["role"]), item["role"])
+
+    def test_invalid_format(self):
+        response = self.client.get(f"{self.export_url}?export_format=xlsx")
+        self.assertEqual(response.data["code"], 400)
+
+    @mock.patch.object(UserViewSet, "filter_backends", [CustomDjangoFilterBackend])
+    def test_filters(self):
+        Users.objects.filter(username="export5").update(is_active=False)
+        for query in ("&name=导出1", "&username=EXPORT3", "&is_active=False"):
+            with self.subTest(query=query):
+                _, chunks = self.export(f"?{query[1:]}")
+                exported = [json.loads(line)["username"] for line in b"".join(chunks).decode().splitlines()]
+                self.assertEqual(exported, [row["username"] for row in self.list_rows(query)])
+                self.assertEqual(len(exported), 1)
+
+    def test_chunked_streaming(self):
+        total = Users.objects.count()
+        for values_queryset in (UserViewSet.values_queryset, None):
+            with self.subTest(values_path=values_queryset is not None), \
+                    mock.patch.object(UserViewSet, "values_queryset", values_queryset), \
+                    mock.patch.object(UserViewSet, "export_chunk_size", 3):
+                _, chunks = self.export()
+                self.assertEqual([chunk.count(b"\n") for chunk in chunks], [3, 3, total - 6])
+                _, chunks = self.export("?export_format=csv")
+                # 第一批包含表头
+                self.assertEqual([chunk.count(b"\r\n") for chunk in chunks], [4, 3, total - 6])
+
+    def test_requires_own_rule(self):
+        # 接口按完整路径匹配, 列表接口的GET权限不包括导出, 导出需要单独配置规则
+        role = Role.objects.create(name="运维", key="ops")
+        role.menu.add(Menu.objects.create(name="用户列表", menu_type=2, api="/api/v1/users/user/", method="GET"))
+        user = Users.objects.create(username="ops", name="运维")
+        user.role.add(role)
+        self.client.force_authenticate(user)
+        self.assertEqual(self.client.get("/api/v1/users/user/").status_code, 200)
+        self.assertEqual(self.client.get(self.export_url).status_code, 403)
+
+        role.menu.add(Menu.objects.create(name="导出用户", menu_type=2, api=self.export_url, method="GET"))
+        self.assertEqual(self.client.get(self.export_url).status_code, 200)
+
+
+class ApiMatcherTests(SimpleTestCase):
+    """
+    合并编译的接口匹配器与逐个调用ValidationApi的结果一致, 接口正则只编译一次
+    """
+
+    @staticmethod
+    def make_rules(count):
+        rules = []
+        for index in range(count):
+            method = ("GET", "POST", "PUT", "DELETE", "*", None)[index % 6]
+            api = (f"/api/v1/module{index}/", f"/api/v1/module{index}/{{id}}/",
+                   f"/api/v1/module{index}/{{id}}/action/")[index % 3]
+            rules.append((method, api))
+        return rules
+
+    @staticmethod
+    def expected(rules, method, path):
+        return any(permission.ValidationApi(path, api) for rule_method, api in rules
+                   if (rule_method or "*").upper() in (method, "*"))
+
+    def test_same_result_as_validation_api(self):
+        rules = self.make_rules(120)
+        matcher = permission.ApiMatcher(rules)
+        rng = random.Random(0)
+        for _ in range(1000):
+            index = rng.randrange(150)
+            path = rng.choice((f"/api/v1/module{index}/", f"/api/v1/module{index}/{rng.randrange(100)}/",
+                               f"/api/v1/module{index}/7/action/", f"/api/v1/module{index}/7/other/",
+                               f"/API/V1/MODULE{index}/", f"/api/v1/module{index}/x/y/"))
+            method = rng.choice(("GET", "POST", "PUT", "DELETE", "PATCH"))
+            with self.subTest(method=method, path=path):
+                self.assertEqual(matcher.is_allowed(method, path), self.expected(rules, method, path))
+
+    def test_uncompilable_api_grants_nothing(self):
+        matcher = permission.ApiMatcher([("GET", "/api/v1/(broken/"), ("GET", "/api/v1/ok/"), ("GET", "")])
+        self.assertFalse(matcher.is_allowed("GET", "/api/v1/(broken/"))
+        self.assertTrue(matcher.is_allowed("get", "/api/v1/ok/"))
+
+    def test_patterns_compiled_once(self):
+        rules = frozenset(self.make_rules(30))
+        permission.compile_api_pattern.cache_clear()
+        permission.get_api_matcher.cache_clear()
+        for _ in range(5):
+            for _, api in rules:
+                permission.ValidationApi("/api/v1/module1/", api)
+        self.assertEqual(permission.compile_api_pattern.cache_info().misses, len({api for _, api in rules}))
+        matcher = permission.get_api_matcher(rules)
+        self.assertIs(permission.get_api_matcher(frozenset(rules)), matcher)
+        self.assertEqual(permission.get_api_matcher.cache_info().misses, 1)
+
+    def test_re_uuid(self):
+        self.assertEqual(permission.ReUUID("/api/v1/user/0a1b2c3d-0a1b-0a1b-0a1b-0a1b2c3d4e5f/"), "/api/v1/user/.*/")
+        self.assertIsNone(permission.ReUUID("/api/v1/user/1/"))
+
+
+class CustomPermissionTests(TestCase):
+    """
+    接口权限检查的结果, 匹配器的编译和复用
+    """
+    allowed = (
+        ("GET", "/api/v1/users/user/"),
+        ("PUT", "/api/v1/users/user/1/"),
+        ("GET", "/api/v1/users/role/"),
+        ("DELETE", "/api/v1/users/role/2/"),
+        ("GET", "/api/v1/users/menu/"),
+        ("POST", "/api/v1/users/menu/"),
+    )
+    denied = (
+        ("POST", "/api/v1/users/user/"),
+        # 详情接口的权限不包括详情下的操作, 列表接口的权限不包括列表下的操作
+        ("PUT", "/api/v1/users/user/1/kick/"),
+        ("GET", "/api/v1/users/user/export/"),
+        ("GET", "/api/v1/users/user/1/"),
+        ("PUT", "/api/v1/users/role/2/"),
+        ("GET", "/api/v1/users/dept/"),
+    )
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.role = Role.objects.create(name="运维", key="ops")
+        cls.role.menu.set([
+            Menu.objects.create(name=f"按钮{index}", menu_type=2, api=api, method=method)
+            for index, (method, api) in enumerate((
+                ("GET", "/api/v1/users/user/"),
+                ("PUT", "/api/v1/users/user/{id}/"),
+                ("GET", "/api/v1/users/role/"),
+                ("DELETE", "/api/v1/users/role/{id}/"),
+                ("*", "/api/v1/users/menu/"),
+            ))
+        ])
+        cls.user = Users.objects.create(username="ops", name="运维")
+        cls.user.role.add(cls.role)
+
+    def setUp(self):
+        invalidate_rbac_cache()
+        # 与无状态认证一致, 角色id来自token
+        self.user.token_role_ids = [self.role.id]
+        self.factory = APIRequestFactory()
+
+    def has_permission(self, method, path):
+        request = Request(self.factory.generic(method, path))
+        request.user = self.user
+        return permission.CustomPermission().has_permission(request, None)
+
+    def test_api_rules(self):
+        for method, path in self.allowed:
+            with self.subTest(method=method, path=path):
+                self.assertTrue(self.has_permission(method, path))
+        for method, path in self.denied:
+            with self.subTest(method=method, path=path):
+                self.assertFalse(self.has_permission(method, path))
+
+    def test_matcher_compiled_once(self):
+        # 耗时见 python manage.py benchmark permission, 这里只检查每次检查所做的工作
+        permission.get_api_matcher.cache_clear()
+        requests = []
+        for method, path in self.allowed * 20:
+            request = Request(self.factory.generic(method, path))
+            request.user = self.user
+            requests.append(request)
+        check = permission.CustomPermission().has_permission
+        with mock.patch.object(permission, "get_api_rules", wraps=permission.get_api_rules) as get_api_rules, \
+                mock.patch.object(permission, "ApiMatcher", wraps=permission.ApiMatcher) as matcher_class, \
+                mock.patch.object(permission, "get_cache_version",
+                                  wraps=permission.get_cache_version) as get_cache_version:
+            self.assertTrue(check(requests[0], None))
+            # 匹配器编译后: 不查询数据库, 每次检查只读取一次缓存版本
+            with self.assertNumQueries(0):
+                self.assertTrue(all(check(request, None) for request in requests[1:]))
+            self.assertEqual(get_api_rules.call_count, 1)
+            self.assertEqual(matcher_class.call_count, 1)
+            self.assertEqual(get_cache_version.call_count, len(requests))
+
+            # 缓存版本变化后重新读取接口列表, 接口没有变化时复用已编译的匹配器
+            invalidate_rbac_cache()
+            for request in requests[:len(self.allowed)]:
+                request._request._permission_context = None
+                self.assertTrue(check(request, None))
+            self.assertEqual(get_api_rules.call_count, 2)
+            self.assertEqual(matcher_class.call_count, 1)
+
+    def test_stale_matcher_not_used_after_invalidation(self):
+        test = self
+        path = "/api/v1/users/user/"
+
+        class InterleavedMatchers(dict):
+            """
+            旧版本的请求切换进程内匹配器版本时, 插入一个修改权限后的新版本请求
+            """
+            interleaved = False
+
+            def __setitem__(self, key, value):
+                super().__setitem__(key, value)
+                if key == "version" and not self.interleaved:
+                    self.interleaved = True
+                    test.role.menu.filter(api=path).delete()
+                    invalidate_rbac_cache()
+                    test.assertFalse(test.has_permission("GET", path))
+
+        # 旧版本的接口列表已在共享缓存中
+        self.assertIn(("GET", path), permission.get_api_rules(self.user, [self.role.id]))
+        with mock.patch.object(permission, "_role_api_matchers", InterleavedMatchers(version=None, matchers={})):
+            self.assertTrue(self.has_permission("GET", path))
+            self.assertFalse(self.has_permission("GET", path))
+
+
+@override_settings(PASSWORD_HASH_ITERATIONS=1000)
+class LoginFloodTests(TestCase):
+    """
+    登录请求占满登录线程池时: 超出的登录请求立即返回429, 读接口的延迟不受影响
+    """
+    login_url = "/api/v1/auth/login/"
+    read_url = "/api/v1/users/user/"
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = Users.objects.create(username="admin", name="超管", is_superuser=True)
+
+    def setUp(self):
+        token = add_token_claims(RefreshToken.for_user(self.admin), self.admin)
+        self.client = AsyncClient()
+        self.headers = {"authorization": f"Bearer {token.access_token}"}
+        # 阻塞的登录任务模拟耗时的密码校验, 占住线程池直到release被设置
+        self.release = threading.Event()
+        self.addCleanup(self.release.set)
+        patcher = mock.patch("users.views.login.validate_login", side_effect=self.slow_login)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def slow_login(self, data):
+        self.release.wait(10)
+        return {"code": 2000, "data": {"username": data.get("username")}, "msg": "登录成功"}, None
+
+    async def read_latency(self, times=5):
+        latencies = []
+        for _ in range(times):
+            start = time.perf_counter()
+            response = await self.client.get(self.read_url, headers=self.headers)
+            latencies.append(time.perf_counter() - start)
+            self.assertEqual(response.status_code, 200)
+        return statistics.median(latencies)
+
+    async def wait_done(self, tasks, count):
+        for _ in range(500):
+            if sum(task.done() for task in tasks) >= count:
+                return
+            await asyncio.sleep(0.01)
+        self.fail(f"{count}个登录请求未在5秒内返回")
+
+    async def test_flood(self):
+        capacity = login_pool.LOGIN_POOL_MAX_PENDING
+        baseline = await self.read_latency()
+
+        tasks = [
+            asyncio.create_task(self.client.post(self.login_url, {"username": f"user{index}", "password": "x"},
+                                                 content_type="application/json"))
+            for index in range(capacity * 3)
+        ]
+        # 超出线程池容量的请求不等待, 立即被拒绝
+        await self.wait_done(tasks, capacity * 2)
+        rejected = [task.result() for task in tasks if task.done()]
+        self.assertEqual(len(rejected), capacity * 2)
+        for response in rejected:
+            self.assertEqual(response.status_code, 429)
+            self.assertEqual(response["Retry-After"], str(login_pool.LOGIN_RETRY_AFTER))
+            self.assertEqual(json.loads(response.content)["code"], 429)
+
+        # 线程池占满期间读接口的延迟不变
+        during_flood = await self.read_latency()
+        self.assertLess(during_flood, baseline * 3 + 0.05, f"{baseline * 1e3:.1f}ms -> {during_flood * 1e3:.1f}ms")
+        self.assertEqual(sum(not task.done() for task in tasks), capacity)
+
+        self.release.set()
+        accepted = await asyncio.gather(*(task for task in tasks if not task.done()))
+        self.assertEqual([response.status_code for response in accepted], [200] * capacity)
+        # 任务完成后释放容量, 新的登录请求可以提交
+        response = await self.client.post(self.login_url, {"username": "admin", "password": "x"},
+                                          content_type="application/json")
+        self.assertEqual(response.status_code, 200)
+
+
+@override_settings(PASSWORD_HASH_ITERATIONS=1000)
+class AsyncLoginViewTests(TestCase):
+    """
+    异步登录接口与LoginView的响应字节一致
+    """
+    login_url = "/api/v1/auth/login/"
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = Users.objects.create(username="ops", name="运维")
+        cls.user.set_password("old-pass")
+        cls.user.save()
+
+    def sync_login(self, data):
+        request = APIRequestFactory().post(self.login_url, data, format="json")
+        return LoginView.as_view()(request).render()
+
+    async def async_login(self, data):
+        return await AsyncClient().post(self.login_url, data, content_type="application/json")
+
+    def assert_same_response(self, data):
+        expected = self.sync_login(data)
+        response = asyncio.run(self.async_login(data))
+        self.assertEqual(response.status_code, expected.status_code)
+        self.assertEqual(response["Content-Type"], expected["Content-Type"])
+        self.assertEqual(response.content, expected.content)
+        return response
+
+    def test_validation_errors(self):
+        response = self.assert_same_response({"username": "ops"})
+        self.assertEqual(response.status_code, 400)
+
+    def test_login_result(self):
+        # 异步视图在另一个数据库连接中看不到测试事务中的数据, token中又有签发时间和jti: 固定校验结果后比较
+        for password in ("old-pass", "wrong-pass"):
+            serializer = LoginSerializer(data={"username": "ops", "password": password})
+            serializer.is_valid(raise_exception=True)
+            result = serializer.validated_data
+            with self.subTest(password=password), mock.patch.object(LoginSerializer, "validate", return_value=result):
+                response = self.assert_same_response({"username": "ops", "password": password})
+                self.assertEqual(json.loads(response.content), result)
+
+
+class DeleteByKeysTests(ApiTestCase):
+    """
+    批量删除: 树形菜单删除所有子孙节点, 每条语句的参数个数不超过分批大小
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        cls.role = Role.objects.create(name="运维", key="ops")
+        cls.through_labels = (Role.menu.through._meta.label, Menu.roles.through._meta.label)
+
+    def capture_params(self):
+        """
+        记录每条语句的参数个数
+        """
+        counts = []
+
+        def wrapper(execute, sql, params, many, context):
+            counts.append(len(params or ()))
+            return execute(sql, params, many, context)
+
+        self.addCleanup(lambda: self.assertTrue(counts))
+        return connection.execute_wrapper(wrapper), counts
+
+    def create_chain(self, depth):
+        """
+        深度为depth的链, 每个节点下另有两个关联角色的按钮
+        """
+        nodes, parent = [], None
+        for level in range(depth):
+            parent = Menu.objects.create(name=f"目录{level}", menu_type="CATALOG", parent=parent)
+            buttons = [Menu.objects.create(name=f"按钮{level}-{index}", menu_type="BUTTON", parent=parent)
+                       for index in range(2)]
+            for button in buttons:
+                button.roles.add(self.role)
+            nodes += [parent, *buttons]
+        self.role.menu.add(*nodes)
+        return nodes
+
+    def test_deep_tree(self):
+        nodes = self.create_chain(40)
+        kept = self.create_chain(3)
+        # 根节点、中间节点和叶子节点同时提交, 子树重叠的部分只删除一次
+        keys = [nodes[0].id, nodes[30].id, nodes[-1].id, str(nodes[60].id), nodes[0].id]
+        wrapper, params = self.capture_params()
+        with wrapper:
+            total, counts = delete_by_keys(Menu.objects.all(), keys, chunk_size=7)
+        self.assertEqual(counts, {"users.Menu": 120, self.through_labels[0]: 120, self.through_labels[1]: 80})
+        self.assertEqual(total, 320)
+        self.assertLessEqual(max(params), 7)
+        self.assertCountEqual(Menu.objects.values_list("id", flat=True), [menu.id for menu in kept])
+        self.assertEqual(self.role.menu.count(), 9)
+
+    def test_10k_keys(self):
+        roots = Menu.objects.bulk_create(Menu(name=f"目录{index}", menu_type="CATALOG") for index in range(100))
+        children = Menu.objects.bulk_create(
+            Menu(name=f"菜单{index}", menu_type="MENU", parent=roots[index % 100]) for index in range(9900)
+        )
+        Role.menu.through.objects.bulk_create(
+            Role.menu.through(role=self.role, menu=menu) for menu in children[:1000]
+        )
+        kept = Menu.objects.create(name="保留", menu_type="MENU")
+        keys = [menu.id for menu in roots + children] + [0, -1]
+        random.Random(0).shuffle(keys)
+
+        wrapper, params = self.capture_params()
+        with wrapper:
+            response = self.client.delete("/api/v1/users/menu/multiple_delete/", {"keys": keys}, format="json")
+        self.assertEqual(response.status_code, 200, response.data)
+        self.assertEqual(response.data["data"]["data"], {
+            "total": 11000, "models": {"users.Menu": 10000, self.through_labels[0]: 1000},
+        })
+        self.assertLessEqual(max(params), DELETE_CHUNK_SIZE)
+        self.assertEqual(list(Menu.objects.values_list("id", flat=True)), [kept.id])
+
+
+@override_settings(PASSWORD_HASH_ITERATIONS=1000)
+class TokenTestCase(TestCase):
+    """
+    以普通用户登录得到的access/refresh token调用接口
+    """
+    info_url = "/api/v1/users/user/user_info/"
+    refresh_url = "/token/refresh/"
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.role = Role.objects.create(name="运维", key="ops")
+        cls.user = Users.objects.create(username="ops", name="运维")
+        cls.user.set_password("old-pass")
+        cls.user.save()
+        cls.user.role.add(cls.role)
+
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.refresh = LoginSerializer.get_token(Users.objects.get(pk=self.user.pk))
+        self.access = str(self.refresh.access_token)
+
+    def get_info(self, access):
+        return self.client.get(self.info_url, HTTP_AUTHORIZATION=f"Bearer {access}")
+
+    def refresh_token(self, refresh=None):
+        return self.client.post(self.refresh_url, {"refresh": str(refresh or self.refresh)}, format="json")
+
+    def assert_logged_out(self):
+        self.assertEqual(self.get_info(self.access).status_code, 401)
+        self.assertEqual(self.refresh_token().status_code, 401)
+
+
+@override_settings(PASSWORD_HASH_ITERATIONS=1000)
+class PasswordHasherTests(TokenTestCase):
+    """
+    登录时的密码校验: 旧版本MD5摘要的哈希、其它哈希器和迭代次数变更后重新哈希, 重新哈希后旧token失效
+    """
+
+    def login(self, password):
+        serializer = LoginSerializer(data={"username": "ops", "password": password})
+        serializer.is_valid(raise_exception=True)
+        return serializer.validated_data
+
+    def set_encoded(self, encoded):
+        Users.objects.filter(pk=self.user.pk).update(password=encoded)
+
+    def get_encoded(self):
+        return Users.objects.get(pk=self.user.pk).password
+
+    def assert_current_hash(self, iterations):
+        algorithm, hash_iterations, _, _ = self.get_encoded().split("$")
+        self.assertEqual((algorithm, int(hash_iterations)), ("pbkdf2_sha256_v2", iterations))
+        self.assertTrue(check_password("old-pass", self.get_encoded()))
+
+    def test_current_hash_not_rehashed(self):
+        encoded = self.get_encoded()
+        self.assertEqual(self.login("old-pass")["code"], "00000")
+        self.assertEqual(self.get_encoded(), encoded)
+        self.assertEqual(self.get_info(self.access).status_code, 200)
+
+    def test_legacy_md5_login(self):
+        self.set_encoded(make_password(hashlib.md5(b"old-pass").hexdigest(), hasher="pbkdf2_sha256"))
+        self.assertEqual(self.login("wrong-pass")["code"], "40000")
+        self.assertTrue(self.get_encoded().startswith("pbkdf2_sha256$"))
+        self.assertEqual(self.login("old-pass")["code"], "00000")
+        self.assert_current_hash(1000)
+
+    def test_legacy_md5_disabled(self):
+        self.set_encoded(make_password(hashlib.md5(b"old-pass").hexdigest(), hasher="pbkdf2_sha256"))
+        with override_settings(PASSWORD_LEGACY_MD5=False):
+            self.assertEqual(self.login("old-pass")["code"], "40000")
+
+    def test_md5_not_tried_for_current_hash(self):
+        self.set_encoded(make_password(hashlib.md5(b"old-pass").hexdigest()))
+        self.assertEqual(self.login("old-pass")["code"], "40000")
+
+    def test_rehash_from_other_hasher(self):
+        self.set_encoded(make_password("old-pass", hasher="pbkdf2_sha256"))
+        self.assertEqual(self.login("old-pass")["code"], "00000")
+        self.assert_current_hash(1000)
+
+    def test_iteration_change_rehashes_and_logs_out_other_sessions(self):
+        with override_settings(PASSWORD_HASH_ITERATIONS=2000):
+            data = self.login("old-pass")["data"]
+            self.assert_current_hash(2000)
+            # 重新哈希改变了密码哈希, 此前签发的access和refresh token都失效, 本次登录的token可用
+            self.assert_logged_out()
+            self.assertEqual(self.get_info(data["accessToken"]).status_code, 200)
+            self.assertEqual(self.refresh_token(data["refreshToken"]).status_code, 200)
+
+
+@override_settings(PASSWORD_HASH_ITERATIONS=1000)
+class RoleMenuPermissionTests(TokenTestCase):
+    """
+    role_get_menu: 按钮权限来自请求的权限上下文, 查询数与菜单数量无关
+    """
+    url = "/api/v1/users/role/role_get_menu/"
+
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        cls.menus = [Menu.objects.create(name=f"菜单{index}", menu_type="MENU") for index in range(3)]
+        cls.buttons = [
+            Menu.objects.create(name=f"按钮{index}", menu_type="BUTTON", perm=f"button:{index}",
+                                parent=cls.menus[index % 2])
+            for index in range(4)
+        ]
+        cls.role.menu.set([*cls.menus, cls.buttons[0], cls.buttons[3]])
+
+    def get_menus(self, access=None):
+        response = self.client.get(self.url, HTTP_AUTHORIZATION=f"Bearer {access or self.access}")
+        self.assertEqual(response.status_code, 200)
+        return {menu["name"]: [button["perm"] for button in menu["menuPermission"]] for menu in response.data["data"]}
+
+    def test_role_buttons(self):
+        self.assertEqual(self.get_menus(), {
+            "菜单0": ["button:0"], "菜单1": ["button:3"], "菜单2": [],
+            "按钮0": [], "按钮3": [],
+        })
+
+    def test_admin_gets_all_buttons(self):
+        admin = Users.objects.create(username="admin", name="超管", is_superuser=True)
+        access = LoginSerializer.get_token(admin).access_token
+        menus = self.get_menus(access)
+        self.assertEqual(menus["菜单0"], ["button:0", "button:2"])
+        self.assertEqual(menus["菜单1"], ["button:1", "button:3"])
+
+    def test_query_count_independent_of_menus(self):
+        self.get_menus()
+        with CaptureQueriesContext(connection) as context:
+            self.get_menus()
+        # 下一次请求开始时会清空查询记录
+        queries = len(context.captured_queries)
+        self.role.menu.add(*[Menu.objects.create(name=f"菜单{index}", menu_type="MENU") for index in range(3, 8)])
+        self.get_menus()
+        with self.assertNumQueries(queries):
+            self.assertEqual(len(self.get_menus()), 10)
+
+
+class TokenVersionTests(TokenTestCase):
+    """
+    密码/状态/角色变更后旧token的处理: 修改密码或停用后access和refresh都失效, 角色变更后可以刷新得到新的token
+    """
+
+    def test_valid_token(self):
+        self.assertEqual(self.get_info(self.access).status_code, 200)
+        response = self.refresh_token()
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.get_info(response.data["data"]["access"]).status_code, 200)
+
+    def test_password_change(self):
+        response = self.client.put(
+            f"/api/v1/users/user/{self.user.pk}/change_password/",
+            {"oldPassword": "old-pass", "newPassword": "new-pass", "newPassword2": "new-pass"},
+            format="json", HTTP_AUTHORIZATION=f"Bearer {self.access}",
+        )
+        self.assertEqual(response.data["msg"], "修改成功")
+        self.assert_logged_out()
+
+    def test_password_reset(self):
+        user = Users.objects.get(pk=self.user.pk)
+        user.set_password("123456")
+        user.save()
+        self.assert_logged_out()
+
+    def test_deactivated(self):
+        Users.objects.filter(pk=self.user.pk).update(is_active=False)
+        Users.objects.get(pk=self.user.pk).save()
+        self.assert_logged_out()
+
+    def test_role_change(self):
+        admin_role = Role.objects.create(name="管理员", key="admin", admin=True)
+        self.user.role.set([admin_role])
+        self.assertEqual(self.get_info(self.access).status_code, 401)
+        # 角色变更后refresh token仍可用, 新token带有新的角色
+        response = self.refresh_token()
+        self.assertEqual(response.status_code, 200)
+        response = self.get_info(response.data["data"]["access"])
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data["data"]["roles"], ["admin"])
+
+    def test_refresh_without_credential_version(self):
+        del self.refresh["cred"]
+        self.assertEqual(self.refresh_token().status_code, 401)
+
+
+class RevocationTests(TokenTestCase):
+    """
+    注销、轮换后的refresh token和强制下线
+    """
+
+    def test_logout(self):
+        response = self.client.delete("/api/v1/auth/logout/", {"refresh": str(self.refresh)}, format="json",
+                                      HTTP_AUTHORIZATION=f"Bearer {self.access}")
+        self.assertEqual(response.status_code, 200)
+        self.assert_logged_out()
+
+    def test_rotated_refresh_reuse(self):
+        response = self.refresh_token()
+        self.assertEqual(response.status_code, 200)
+        rotated = response.data["data"]["refresh"]
+        # 轮换后旧的refresh token不能再使用, 新的可以
+        self.assertEqual(self.refresh_token().status_code, 401)
+        self.assertEqual(self.refresh_token(rotated).status_code, 200)
+
+    def test_kick(self):
+        admin = Users.objects.create(username="admin", name="超管", is_superuser=True)
+        admin_client = APIClient()
+        admin_client.force_authenticate(admin)
+        response = admin_client.put(f"/api/v1/users/user/{self.user.pk}/kick/")
+        self.assertEqual(response.data["msg"], "已强制下线")
+        self.assert_logged_out()
+
+        for pk in ("abc", "0"):
+            with self.subTest(pk=pk):
+                response = admin_client.put(f"/api/v1/users/user/{pk}/kick/")
+                self.assertEqual(response.data["msg"], "未获取到用户")
+
+    def test_kick_requires_own_rule(self):
+        # 只有修改用户的权限时不能强制下线
+        button = Menu.objects.create(name="修改用户", menu_type="BUTTON", api="/api/v1/users/user/{id}/", method="PUT")
+        self.role.menu.add(button)
+        response = self.client.put(f"/api/v1/users/user/{self.user.pk}/kick/",
+                                   HTTP_AUTHORIZATION=f"Bearer {self.access}")
+        self.assertEqual(response.status_code, 403)
+        button = Menu.objects.create(name="强制下线", menu_type="BUTTON", api="/api/v1/users/user/{id}/kick/",
+                                     method="PUT")
+        self.role.menu.add(button)
+        response = self.client.put(f"/api/v1/users/user/{self.user.pk}/kick/",
+                                   HTTP_AUTHORIZATION=f"Bearer {self.access}")
+        self.assertEqual(response.data["msg"], "已强制下线")
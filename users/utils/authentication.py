@@ -0,0 +1,168 @@
+# -*- coding: utf-8 -*-
+
+"""
+@Remark: 无状态JWT认证
+登录时把用户id/账号/是否超级管理员/角色id和token版本写入token, 认证时直接由token构建用户对象, 不查询用户表;
+token版本由密码、启用状态、超级管理员标识和角色计算, 短时间缓存, 这些信息变更后旧token失效;
+refresh token另外记录只由密码和启用状态计算的凭证版本: 角色变更后可以刷新得到新的token, 修改密码或停用后不能再刷新;
+注销的token(jti)和被强制下线用户的下线时间保存在缓存中直到token过期, 认证时与token版本一次批量读取
+"""
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import router
+from django.utils.crypto import salted_hmac
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import InvalidToken
+from rest_framework_simplejwt.settings import api_settings
+
+from users.models import Users
+
+TOKEN_VERSION_CLAIM = "ver"
+CREDENTIAL_VERSION_CLAIM = "cred"
+TOKEN_VERSION_CACHE_PREFIX = "token_version"
+TOKEN_VERSION_TIMEOUT = getattr(settings, "TOKEN_VERSION_TIMEOUT", 60)
+REVOKED_TOKEN_PREFIX = "revoked_token"
+REVOKED_USER_PREFIX = "revoked_user"
+
+
+def compute_token_version(password, is_active, is_superuser, role_ids):
+    value = f"{password}:{int(is_active)}:{int(is_superuser)}:{','.join(str(i) for i in sorted(role_ids))}"
+    return salted_hmac(TOKEN_VERSION_CACHE_PREFIX, value).hexdigest()[:16]
+
+
+def compute_credential_version(password, is_active):
+    return salted_hmac(CREDENTIAL_VERSION_CLAIM, f"{password}:{int(is_active)}").hexdigest()[:16]
+
+
+def is_credential_changed(token, user):
+    """
+    签发token后用户的密码或启用状态是否已变更, 没有凭证版本的token按已变更处理
+    """
+    return token.get(CREDENTIAL_VERSION_CLAIM) != compute_credential_version(user.password, user.is_active)
+
+
+def get_token_version_key(user_id):
+    return f"{TOKEN_VERSION_CACHE_PREFIX}:{user_id}"
+
+
+def load_token_version(user_id):
+    """
+    从数据库计算用户当前的token版本并缓存TOKEN_VERSION_TIMEOUT秒, 用户不存在时为空字符串
+    """
+    user = Users.objects.filter(id=user_id).values("password", "is_active", "is_superuser").first()
+    if user is None:
+        version = ""
+    else:
+        role_ids = Users.role.through.objects.filter(users_id=user_id).values_list("role_id", flat=True)
+        version = compute_token_version(user["password"], user["is_active"], user["is_superuser"], role_ids)
+    cache.set(get_token_version_key(user_id), version, TOKEN_VERSION_TIMEOUT)
+    return version
+
+
+def get_token_version(user_id):
+    """
+    获取用户当前的token版本, 优先读缓存
+    """
+    version = cache.get(get_token_version_key(user_id))
+    if version is None:
+        version = load_token_version(user_id)
+    return version
+
+
+def invalidate_token_version(user_id):
+    cache.delete(get_token_version_key(user_id))
+
+
+def get_revocation_keys(token):
+    return (
+        f"{REVOKED_TOKEN_PREFIX}:{token[api_settings.JTI_CLAIM]}",
+        f"{REVOKED_USER_PREFIX}:{token[api_settings.USER_ID_CLAIM]}",
+    )
+
+
+def revoke_token(token):
+    """
+    注销单个token(access或refresh), 记录保留到token过期
+    """
+    timeout = int(token["exp"] - time.time())
+    if timeout > 0:
+        cache.set(get_revocation_keys(token)[0], 1, timeout)
+
+
+def revoke_user_tokens(user_id):
+    """
+    强制下线: 此前签发给该用户的所有token失效(按秒比较签发时间, 同一秒内签发的token同样失效),
+    记录保留到refresh token的最长有效期
+    """
+    cache.set(f"{REVOKED_USER_PREFIX}:{user_id}", int(time.time()),
+              int(api_settings.REFRESH_TOKEN_LIFETIME.total_seconds()))
+
+
+def is_token_revoked(token, cached_values=None):
+    """
+    :param cached_values: 已批量读取的缓存 {键: 值}, 为空时读取缓存
+    """
+    token_key, user_key = get_revocation_keys(token)
+    if cached_values is None:
+        cached_values = cache.get_many([token_key, user_key])
+    if token_key in cached_values:
+        return True
+    revoked_before = cached_values.get(user_key)
+    return revoked_before is not None and token.get("iat", 0) <= revoked_before
+
+
+def add_token_claims(token, user):
+    """
+    写入无状态认证需要的用户信息
+    """
+    role_ids = sorted(user.role.values_list("id", flat=True))
+    token["username"] = user.username
+    token["is_superuser"] = user.is_superuser
+    token["role_ids"] = role_ids
+    token[TOKEN_VERSION_CLAIM] = compute_token_version(user.password, user.is_active, user.is_superuser, role_ids)
+    token[CREDENTIAL_VERSION_CLAIM] = compute_credential_version(user.password, user.is_active)
+    return token
+
+
+class StatelessJWTAuthentication(JWTAuthentication):
+    """
+    由token声明构建用户对象的JWT认证, 只校验缓存中的注销记录和token版本;
+    没有版本声明的旧token按原方式查询用户
+    """
+
+    def get_user(self, validated_token):
+        try:
+            user_id = validated_token[api_settings.USER_ID_CLAIM]
+            version_key = get_token_version_key(user_id)
+            cached_values = cache.get_many([*get_revocation_keys(validated_token), version_key])
+        except KeyError:
+            raise InvalidToken("token中没有可识别的用户信息")
+        if is_token_revoked(validated_token, cached_values):
+            raise InvalidToken("token已注销, 请重新登录")
+
+        if TOKEN_VERSION_CLAIM not in validated_token:
+            return super().get_user(validated_token)
+        try:
+            claims = {
+                "id": user_id,
+                "username": validated_token["username"],
+                "is_superuser": validated_token["is_superuser"],
+                "is_active": True,
+            }
+            role_ids = validated_token["role_ids"]
+        except KeyError:
+            raise InvalidToken("token中没有可识别的用户信息")
+
+        version = cached_values.get(version_key)
+        if version is None:
+            version = load_token_version(user_id)
+        if version != validated_token[TOKEN_VERSION_CLAIM]:
+            raise InvalidToken("token已失效, 请重新登录")
+
+        # from_db要求取值顺序与模型字段顺序一致
+        field_names = [field.attname for field in Users._meta.concrete_fields if field.attname in claims]
+        user = Users.from_db(router.db_for_read(Users), field_names, [claims[name] for name in field_names])
+        user.token_role_ids = list(role_ids)
+        return user
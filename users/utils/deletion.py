@@ -0,0 +1,77 @@
+# -*- coding: utf-8 -*-
+
+"""
+@Remark: 分批删除
+按主键分批删除, 每批的IN列表长度有上限; 带物化路径(tree_path)的树形模型按最上层的路径前缀分批查询取出所有子孙节点,
+按层级从深到浅删除, 级联收集时不再需要逐层递归查询. 删除仍通过QuerySet.delete()执行, pre/post_delete信号照常发送
+"""
+from collections import Counter
+
+from django.conf import settings
+from django.core.exceptions import FieldDoesNotExist
+from django.db import transaction
+from django.db.models import Q
+
+DELETE_CHUNK_SIZE = getattr(settings, "DELETE_CHUNK_SIZE", 500)
+
+
+def chunked(items, size):
+    items = list(items)
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+
+def has_tree_path(model):
+    try:
+        model._meta.get_field("tree_path")
+    except FieldDoesNotExist:
+        return False
+    return True
+
+
+def get_subtree_depths(model, ids, chunk_size):
+    """
+    一组节点及其所有子孙节点的层级 {id: 层级}
+    """
+    paths = []
+    for chunk in chunked(ids, chunk_size):
+        paths.extend(model._default_manager.filter(pk__in=chunk).values_list("tree_path", flat=True))
+    # 只保留最上层的路径前缀, 已被其它前缀覆盖的子树不重复查询(跨批去重, 前缀查询的条件数不随子孙节点数增长)
+    prefixes = []
+    for path in sorted(paths):
+        if path and not (prefixes and path.startswith(prefixes[-1])):
+            prefixes.append(path)
+    depths = {pk: None for pk in ids}
+    for chunk in chunked(prefixes, chunk_size):
+        condition = Q()
+        for prefix in chunk:
+            condition |= Q(tree_path__startswith=prefix)
+        for pk, tree_path in model._default_manager.filter(condition).values_list("pk", "tree_path"):
+            depths[pk] = tree_path.count("/") - 1
+    # 没有物化路径的节点(未回填)按最深处理, 由级联收集兜底
+    max_depth = max((depth for depth in depths.values() if depth is not None), default=0)
+    return {pk: max_depth + 1 if depth is None else depth for pk, depth in depths.items()}
+
+
+def delete_by_keys(queryset, keys, chunk_size=None):
+    """
+    按主键分批删除queryset中的数据, 树形模型同时删除所有子孙节点
+    :param keys: 主键列表, 不在queryset中的主键忽略
+    :return: (删除总数, {模型label: 删除数量}), 与QuerySet.delete()的返回值格式一致
+    """
+    chunk_size = chunk_size or DELETE_CHUNK_SIZE
+    model = queryset.model
+    pk_field = model._meta.pk
+    keys = list(dict.fromkeys(pk_field.to_python(key) for key in keys))
+    deleted = Counter()
+    with transaction.atomic():
+        ids = []
+        for chunk in chunked(keys, chunk_size):
+            ids.extend(queryset.filter(pk__in=chunk).values_list("pk", flat=True))
+        if has_tree_path(model):
+            depths = get_subtree_depths(model, ids, chunk_size)
+            ids = sorted(depths, key=lambda pk: depths[pk], reverse=True)
+        for chunk in chunked(ids, chunk_size):
+            _, counts = model._default_manager.filter(pk__in=chunk).delete()
+            deleted.update(counts)
+    return sum(deleted.values()), dict(deleted)
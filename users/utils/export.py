@@ -0,0 +1,65 @@
+# -*- coding: utf-8 -*-
+
+"""
+@Remark: 流式导出
+查询集通过iterator(chunk_size)分批读取, 每批序列化后立即编码输出, 内存占用与数据总量无关
+"""
+import csv
+import io
+
+from django.conf import settings
+
+from users.utils.renderers import CustomJSONRenderer
+
+EXPORT_CHUNK_SIZE = getattr(settings, "EXPORT_CHUNK_SIZE", 1000)
+
+
+def iter_chunks(iterable, size):
+    """
+    把迭代器按size切分为列表, 不预先读取全部数据
+    """
+    chunk = []
+    for item in iterable:
+        chunk.append(item)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def ndjson_stream(chunks):
+    """
+    每行一个JSON对象, 编码与接口响应一致
+    """
+    renderer = CustomJSONRenderer()
+    for rows in chunks:
+        yield b"".join(renderer.render(row) + b"\n" for row in rows)
+
+
+def format_csv_value(value, renderer):
+    if value is None:
+        return ""
+    if isinstance(value, (dict, list)):
+        return renderer.render(value).decode()
+    return value
+
+
+def csv_stream(field_names, chunks):
+    """
+    表头为field_names, 列表/字典类型的值按JSON写入单元格
+    """
+    renderer = CustomJSONRenderer()
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    # 带BOM, Excel打开时按UTF-8识别中文
+    buffer.write("\ufeff")
+    writer.writerow(field_names)
+    for rows in chunks:
+        for row in rows:
+            writer.writerow([format_csv_value(row.get(name), renderer) for name in field_names])
+        yield buffer.getvalue().encode()
+        buffer.seek(0)
+        buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue().encode()
@@ -20,6 +20,16 @@ from django_filters.rest_framework import DjangoFilterBackend
 from django_filters.utils import get_model_field
 from rest_framework.filters import BaseFilterBackend
 
+from users.models import parse_tree_path
+
+try:
+    from timezone_field import TimeZoneField
+except ImportError:  # 未安装django-timezone-field
+    TimeZoneField = None
+
+# 不生成过滤器的模型字段类型
+NON_FILTER_FIELD_TYPES = (models.JSONField, TimeZoneField) if TimeZoneField else (models.JSONField,)
+
 
 class CustomDjangoFilterBackend(DjangoFilterBackend):
     lookup_prefixes = {
@@ -30,6 +40,10 @@ class CustomDjangoFilterBackend(DjangoFilterBackend):
         "~": "icontains",
     }
     filter_fields = "__all__"
+    # {(视图类, 模型, 过滤字段): AutoFilterSet}
+    filterset_class_cache = {}
+    # {(视图类, FilterSet类, filter_fields): {查询参数名: ORM查询表达式}}
+    orm_lookup_map_cache = {}
 
     def construct_search(self, field_name, lookup_expr=None):
         lookup = self.lookup_prefixes.get(field_name[0])
@@ -43,14 +57,36 @@ class CustomDjangoFilterBackend(DjangoFilterBackend):
             return LOOKUP_SEP.join([field_name, lookup])
         return field_name
 
-    def find_filter_lookups(self, orm_lookups, search_term_key):
-        for lookup in orm_lookups:
-            # if lookup.find(search_term_key) >= 0:
-            new_lookup = LOOKUP_SEP.join(lookup.split(LOOKUP_SEP)[:-1]) if len(lookup.split(LOOKUP_SEP)) > 1 else lookup
-            # 修复条件搜索错误 bug
-            if new_lookup == search_term_key:
-                return lookup
-        return None
+    def build_orm_lookup_map(self, filterset):
+        """
+        生成 {查询参数名: ORM查询表达式} 映射, 按lookup_prefixes把带前缀的字段转换为对应的查询表达式,
+        如 "^name" => {"name": "name__istartswith"}
+        """
+        filter_fields = filterset.filters if self.filter_fields == "__all__" else self.filter_fields
+        orm_lookup_dict = dict(
+            zip(
+                [field for field in filter_fields],
+                [filterset.filters[lookup].lookup_expr for lookup in filterset.filters.keys()],
+            )
+        )
+        orm_lookup_map = {}
+        for lookup, lookup_expr in orm_lookup_dict.items():
+            orm_lookup = self.construct_search(lookup, lookup_expr)
+            lookup_parts = orm_lookup.split(LOOKUP_SEP)
+            search_term_key = LOOKUP_SEP.join(lookup_parts[:-1]) if len(lookup_parts) > 1 else orm_lookup
+            # 同一查询参数对应多个表达式时使用第一个
+            orm_lookup_map.setdefault(search_term_key, orm_lookup)
+        return orm_lookup_map
+
+    def get_orm_lookup_map(self, view, filterset):
+        """
+        按(视图类, FilterSet类, filter_fields)缓存查询参数映射, 请求时每个参数只需一次字典查找
+        """
+        cache_key = (view.__class__, filterset.__class__, self.get_fields_cache_key(self.filter_fields))
+        orm_lookup_map = self.orm_lookup_map_cache.get(cache_key)
+        if orm_lookup_map is None:
+            orm_lookup_map = self.orm_lookup_map_cache.setdefault(cache_key, self.build_orm_lookup_map(filterset))
+        return orm_lookup_map
 
     def get_filterset_class(self, view, queryset=None):
         """
@@ -94,120 +130,138 @@ class CustomDjangoFilterBackend(DjangoFilterBackend):
             return filterset_class
 
         if filterset_fields and queryset is not None:
-            MetaBase = getattr(self.filterset_base, "Meta", object)
-
-            class AutoFilterSet(self.filterset_base):
-                @classmethod
-                def get_all_model_fields(cls, model):
-                    opts = model._meta
-
-                    return [
-                        f.name
-                        for f in sorted(opts.fields + opts.many_to_many)
-                        if (f.name == "id")
-                        or not isinstance(f, models.AutoField)
-                        and not (getattr(f.remote_field, "parent_link", False))
-                    ]
-
-                @classmethod
-                def get_fields(cls):
-                    """
-                    Resolve the 'fields' argument that should be used for generating filters on the
-                    filterset. This is 'Meta.fields' sans the fields in 'Meta.exclude'.
-                    """
-                    model = cls._meta.model
-                    fields = cls._meta.fields
-                    exclude = cls._meta.exclude
-
-                    assert not (fields is None and exclude is None), (
-                        "Setting 'Meta.model' without either 'Meta.fields' or 'Meta.exclude' "
-                        "has been deprecated since 0.15.0 and is now disallowed. Add an explicit "
-                        "'Meta.fields' or 'Meta.exclude' to the %s class." % cls.__name__
-                    )
+            # 动态生成的FilterSet类按(视图类, 模型, 过滤字段)缓存, 避免每次请求都重新执行元类
+            cache_key = (view.__class__, queryset.model, self.get_fields_cache_key(filterset_fields))
+            filterset_class = self.filterset_class_cache.get(cache_key)
+            if filterset_class is None:
+                filterset_class = self.filterset_class_cache.setdefault(
+                    cache_key, self.build_filterset_class(queryset.model, filterset_fields)
+                )
+            return filterset_class
+
+        return None
+
+    @staticmethod
+    def get_fields_cache_key(filterset_fields):
+        if isinstance(filterset_fields, (list, tuple)):
+            return tuple(filterset_fields)
+        if isinstance(filterset_fields, dict):
+            return tuple((field, tuple(lookups)) for field, lookups in filterset_fields.items())
+        return filterset_fields
+
+    def build_filterset_class(self, queryset_model, filterset_fields):
+        """
+        根据模型和过滤字段生成 `AutoFilterSet` 类
+        """
+        MetaBase = getattr(self.filterset_base, "Meta", object)
+
+        class AutoFilterSet(self.filterset_base):
+            @classmethod
+            def get_all_model_fields(cls, model):
+                opts = model._meta
+
+                return [
+                    f.name
+                    for f in sorted(opts.fields + opts.many_to_many)
+                    if (f.name == "id")
+                    or not isinstance(f, models.AutoField)
+                    and not (getattr(f.remote_field, "parent_link", False))
+                ]
 
-                    # Setting exclude with no fields implies all other fields.
-                    if exclude is not None and fields is None:
-                        fields = ALL_FIELDS
-
-                    # Resolve ALL_FIELDS into all fields for the filterset's model.
-                    if fields == ALL_FIELDS:
-                        fields = cls.get_all_model_fields(model)
-
-                    # Remove excluded fields
-                    exclude = exclude or []
-                    if not isinstance(fields, dict):
-                        fields = [(f, [settings.DEFAULT_LOOKUP_EXPR]) for f in fields if f not in exclude]
-                    else:
-                        fields = [(f, lookups) for f, lookups in fields.items() if f not in exclude]
-
-                    return OrderedDict(fields)
-
-                @classmethod
-                def get_filters(cls):
-                    """
-                    Get all filters for the filterset. This is the combination of declared and
-                    generated filters.
-                    """
-
-                    # No model specified - skip filter generation
-                    if not cls._meta.model:
-                        return cls.declared_filters.copy()
-
-                    # Determine the filters that should be included on the filterset.
-                    filters = OrderedDict()
-                    fields = cls.get_fields()
-                    undefined = []
-
-                    for field_name, lookups in fields.items():
-                        field = get_model_field(cls._meta.model, field_name)
-                        from django.db import models
-                        from timezone_field import TimeZoneField
-
-                        # 不进行 过滤的model 类
-                        if isinstance(field, (models.JSONField, TimeZoneField)):
+            @classmethod
+            def get_fields(cls):
+                """
+                Resolve the 'fields' argument that should be used for generating filters on the
+                filterset. This is 'Meta.fields' sans the fields in 'Meta.exclude'.
+                """
+                model = cls._meta.model
+                fields = cls._meta.fields
+                exclude = cls._meta.exclude
+
+                assert not (fields is None and exclude is None), (
+                    "Setting 'Meta.model' without either 'Meta.fields' or 'Meta.exclude' "
+                    "has been deprecated since 0.15.0 and is now disallowed. Add an explicit "
+                    "'Meta.fields' or 'Meta.exclude' to the %s class." % cls.__name__
+                )
+
+                # Setting exclude with no fields implies all other fields.
+                if exclude is not None and fields is None:
+                    fields = ALL_FIELDS
+
+                # Resolve ALL_FIELDS into all fields for the filterset's model.
+                if fields == ALL_FIELDS:
+                    fields = cls.get_all_model_fields(model)
+
+                # Remove excluded fields
+                exclude = exclude or []
+                if not isinstance(fields, dict):
+                    fields = [(f, [settings.DEFAULT_LOOKUP_EXPR]) for f in fields if f not in exclude]
+                else:
+                    fields = [(f, lookups) for f, lookups in fields.items() if f not in exclude]
+
+                return OrderedDict(fields)
+
+            @classmethod
+            def get_filters(cls):
+                """
+                Get all filters for the filterset. This is the combination of declared and
+                generated filters.
+                """
+
+                # No model specified - skip filter generation
+                if not cls._meta.model:
+                    return cls.declared_filters.copy()
+
+                # Determine the filters that should be included on the filterset.
+                filters = OrderedDict()
+                fields = cls.get_fields()
+                undefined = []
+
+                for field_name, lookups in fields.items():
+                    field = get_model_field(cls._meta.model, field_name)
+                    # 不进行 过滤的model 类
+                    if isinstance(field, NON_FILTER_FIELD_TYPES):
+                        continue
+                    # warn if the field doesn't exist.
+                    if field is None:
+                        undefined.append(field_name)
+                    # 更新默认字符串搜索为模糊搜索
+                    if (
+                        isinstance(field, (models.CharField))
+                        and filterset_fields == "__all__"
+                        and lookups == ["exact"]
+                    ):
+                        lookups = ["icontains"]
+                    for lookup_expr in lookups:
+                        filter_name = cls.get_filter_name(field_name, lookup_expr)
+
+                        # If the filter is explicitly declared on the class, skip generation
+                        if filter_name in cls.declared_filters:
+                            filters[filter_name] = cls.declared_filters[filter_name]
                             continue
-                        # warn if the field doesn't exist.
-                        if field is None:
-                            undefined.append(field_name)
-                        # 更新默认字符串搜索为模糊搜索
-                        if (
-                            isinstance(field, (models.CharField))
-                            and filterset_fields == "__all__"
-                            and lookups == ["exact"]
-                        ):
-                            lookups = ["icontains"]
-                        for lookup_expr in lookups:
-                            filter_name = cls.get_filter_name(field_name, lookup_expr)
-
-                            # If the filter is explicitly declared on the class, skip generation
-                            if filter_name in cls.declared_filters:
-                                filters[filter_name] = cls.declared_filters[filter_name]
-                                continue
-
-                            if field is not None:
-                                filters[filter_name] = cls.filter_for_field(field, field_name, lookup_expr)
-
-                    # Allow Meta.fields to contain declared filters *only* when a list/tuple
-                    if isinstance(cls._meta.fields, (list, tuple)):
-                        undefined = [f for f in undefined if f not in cls.declared_filters]
-
-                    if undefined:
-                        raise TypeError(
-                            "'Meta.fields' must not contain non-model field names: %s" % ", ".join(undefined)
-                        )
-
-                    # Add in declared filters. This is necessary since we don't enforce adding
-                    # declared filters to the 'Meta.fields' option
-                    filters.update(cls.declared_filters)
-                    return filters
-
-                class Meta(MetaBase):
-                    model = queryset.model
-                    fields = filterset_fields
-
-            return AutoFilterSet
 
-        return None
+                        if field is not None:
+                            filters[filter_name] = cls.filter_for_field(field, field_name, lookup_expr)
+
+                # Allow Meta.fields to contain declared filters *only* when a list/tuple
+                if isinstance(cls._meta.fields, (list, tuple)):
+                    undefined = [f for f in undefined if f not in cls.declared_filters]
+
+                if undefined:
+                    raise TypeError(
+                        "'Meta.fields' must not contain non-model field names: %s" % ", ".join(undefined)
+                    )
+
+                # Add in declared filters. This is necessary since we don't enforce adding
+                # declared filters to the 'Meta.fields' option
+                filters.update(cls.declared_filters)
+                return filters
+
+            class Meta(MetaBase):
+                model = queryset_model
+                fields = filterset_fields
+
+        return AutoFilterSet
 
     def filter_queryset(self, request, queryset, view):
         filterset = self.get_filterset(request, queryset, view)
@@ -215,21 +269,11 @@ class CustomDjangoFilterBackend(DjangoFilterBackend):
             return queryset
         if filterset.__class__.__name__ == "AutoFilterSet":
             queryset = filterset.queryset
-            filter_fields = filterset.filters if self.filter_fields == "__all__" else self.filter_fields
-            orm_lookup_dict = dict(
-                zip(
-                    [field for field in filter_fields],
-                    [filterset.filters[lookup].lookup_expr for lookup in filterset.filters.keys()],
-                )
-            )
-            orm_lookups = [
-                self.construct_search(lookup, lookup_expr) for lookup, lookup_expr in orm_lookup_dict.items()
-            ]
-            # print(orm_lookups)
+            orm_lookup_map = self.get_orm_lookup_map(view, filterset)
             conditions = []
             queries = []
             for search_term_key in filterset.data.keys():
-                orm_lookup = self.find_filter_lookups(orm_lookups, search_term_key)
+                orm_lookup = orm_lookup_map.get(search_term_key)
                 if not orm_lookup or filterset.data.get(search_term_key) == '':
                     continue
                 filterset_data_len = len(filterset.data.getlist(search_term_key))
@@ -237,8 +281,8 @@ class CustomDjangoFilterBackend(DjangoFilterBackend):
                     query = Q(**{orm_lookup: filterset.data[search_term_key]})
                     queries.append(query)
                 elif filterset_data_len == 2:
-                    orm_lookup += '__range'
-                    query = Q(**{orm_lookup: filterset.data.getlist(search_term_key)})
+                    # 两个值时按区间查询, 替换掉原有的查询表达式(如 create_datetime__exact)
+                    query = Q(**{search_term_key + '__range': filterset.data.getlist(search_term_key)})
                     queries.append(query)
             if len(queries) > 0:
                 conditions.append(reduce(operator.and_, queries))
@@ -270,6 +314,38 @@ def calculate_execution_time(func):
 
 
 
+def get_node_paths(queryset):
+    """
+    查询集中每个节点从根节点到自身的id路径 {id: [根节点id, ..., 自身id]}
+    优先使用物化路径(tree_path), 只查询一次查询集本身;
+    模型没有tree_path或存在未回填的路径时, 取一次整表的(id, parent_id)在内存中向上查找
+    """
+    model = queryset.model
+    if any(field.name == "tree_path" for field in model._meta.concrete_fields):
+        rows = list(queryset.values_list("id", "tree_path"))
+        if all(tree_path for _, tree_path in rows):
+            return {node_id: parse_tree_path(tree_path) for node_id, tree_path in rows}
+        node_ids = [node_id for node_id, _ in rows]
+    else:
+        node_ids = list(queryset.values_list("id", flat=True))
+
+    parents = dict(model._base_manager.values_list("id", "parent_id"))
+    paths = {}
+    for node_id in node_ids:
+        # 向上查找到已计算路径的祖先为止, 每个节点只计算一次
+        chain, chain_ids = [], set()
+        current = node_id
+        while current is not None and current not in paths and current not in chain_ids:
+            chain.append(current)
+            chain_ids.add(current)
+            current = parents.get(current)
+        path = paths.get(current, [])
+        for chain_id in reversed(chain):
+            path = path + [chain_id]
+            paths[chain_id] = path
+    return {node_id: paths[node_id] for node_id in node_ids}
+
+
 def next_layer_data(qs_filter, qs_node):
     parent_nodes = set(qs_node.values_list("id", flat=True))
     if set(qs_filter) == set(qs_node):
@@ -291,24 +367,26 @@ def next_layer_data(qs_filter, qs_node):
     return parent_ids
 
 
-def construct_data(qs_filter, qs_node, is_parent):
-    filter_node_ids = set(qs_filter.values_list("id", flat=True))
-    render_node_ids = set(qs_node.values_list("id", flat=True))
-
+def construct_queryset(qs_filter, qs_node, is_parent):
+    """
+    懒加载树的搜索结果:
+    on_show: 查询结果中父节点不在查询结果内的节点, 搜索后首先渲染
+    on_expand(is_parent): 祖先链上父节点在查询结果内的节点中, 属于待展示节点(qs_node)的部分
+    节点路径取自物化路径, 隐藏节点在内存中用集合运算得到, 最后用一次id__in查询返回结果
+    """
+    model = qs_filter.model
+    paths = get_node_paths(qs_filter)
+    filter_node_ids = set(paths)
     hidden_node_ids = set()
-    for node in qs_filter:
-        while node.parent:
-            if node.parent in qs_filter:
-                hidden_node_ids.add(node.id)
-            node = node.parent
-    on_show = filter_node_ids.difference(hidden_node_ids)
-    on_expand = hidden_node_ids & render_node_ids
-    # print(f"完整查询结果 {filter_node_ids}")
-    # print(f"待展示的节点(未过滤) {render_node_ids}")
-    # print(f"查询结果中的子节点 {hidden_node_ids}")
-    # print(f"查询后首先渲染的父节点 {on_show}")
-    # print(f"展开父节点时要渲染的节点 {on_expand}")
-    return on_expand if is_parent else on_show
+    for path in paths.values():
+        # 路径上父节点也在查询结果中的节点都需要隐藏
+        for index in range(1, len(path)):
+            if path[index - 1] in filter_node_ids:
+                hidden_node_ids.add(path[index])
+
+    if is_parent:
+        return model.objects.filter(id__in=hidden_node_ids).filter(id__in=qs_node.values("id"))
+    return model.objects.filter(id__in=filter_node_ids - hidden_node_ids)
 
 
 class FilterSetOptions:
@@ -369,7 +447,5 @@ class LazyLoadFilter(FilterSet, metaclass=LazyLoadFilterSetMetaclass):
             # node_ids = next_layer_data(super().qs, queryset)
 
             # 按匹配结果显示
-            node_ids = construct_data(super().qs, queryset, is_parent)
-
-            return queryset.model.objects.filter(id__in=node_ids)
+            return construct_queryset(super().qs, queryset, is_parent)
         return super().qs
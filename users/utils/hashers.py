@@ -0,0 +1,77 @@
+# -*- coding: utf-8 -*-
+
+"""
+@Remark: 密码哈希策略
+迭代次数由 settings.PASSWORD_HASH_ITERATIONS 配置, 登录成功时按当前策略自动重新哈希;
+旧版本保存的可能是密码MD5摘要的哈希, 只对旧格式的哈希尝试MD5兼容校验, 成功后升级为当前格式;
+重新哈希会改变保存的密码哈希, 因此也会改变token版本和凭证版本(users.utils.authentication):
+调整迭代次数或升级旧哈希后, 用户下次登录时其它会话此前签发的access和refresh token都会失效
+"""
+import hashlib
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.contrib.auth.backends import ModelBackend
+from django.contrib.auth.hashers import PBKDF2PasswordHasher, check_password, identify_hasher
+
+
+class ConfigurablePBKDF2PasswordHasher(PBKDF2PasswordHasher):
+    """
+    迭代次数可配置的PBKDF2哈希, 使用独立的算法标识: 该格式的哈希保存的一定是原始密码的哈希
+    """
+    algorithm = "pbkdf2_sha256_v2"
+
+    @property
+    def iterations(self):
+        return getattr(settings, "PASSWORD_HASH_ITERATIONS", PBKDF2PasswordHasher.iterations)
+
+
+def is_legacy_password(encoded):
+    """
+    是否为旧格式(可能是MD5摘要)的密码哈希
+    """
+    try:
+        return identify_hasher(encoded).algorithm != ConfigurablePBKDF2PasswordHasher.algorithm
+    except ValueError:
+        return False
+
+
+def verify_password(user, raw_password):
+    """
+    校验用户密码, 成功且哈希不符合当前策略时重新哈希保存
+    当前格式的哈希只校验一次, 旧格式的哈希在开启 PASSWORD_LEGACY_MD5 时再按MD5摘要校验一次
+    """
+    def setter(raw_password):
+        user.set_password(raw_password)
+        user.save(update_fields=["password"])
+
+    encoded = user.password
+    if check_password(raw_password, encoded, setter):
+        return True
+    if getattr(settings, "PASSWORD_LEGACY_MD5", True) and is_legacy_password(encoded):
+        if check_password(hashlib.md5(raw_password.encode(encoding="UTF-8")).hexdigest(), encoded):
+            setter(raw_password)
+            return True
+    return False
+
+
+class CustomBackend(ModelBackend):
+    """
+    账号密码认证, 使用 verify_password 校验密码
+    """
+
+    def authenticate(self, request, username=None, password=None, **kwargs):
+        UserModel = get_user_model()
+        if username is None:
+            username = kwargs.get(UserModel.USERNAME_FIELD)
+        if username is None or password is None:
+            return None
+        try:
+            user = UserModel._default_manager.get_by_natural_key(username)
+        except UserModel.DoesNotExist:
+            # 用户不存在时同样计算一次哈希, 避免通过响应时间判断账号是否存在
+            UserModel().set_password(password)
+            return None
+        if verify_password(user, password) and self.user_can_authenticate(user):
+            return user
+        return None
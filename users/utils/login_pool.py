@@ -0,0 +1,52 @@
+# -*- coding: utf-8 -*-
+
+"""
+@Remark: 登录密码校验线程池
+PBKDF2计算(hashlib.pbkdf2_hmac)会释放GIL, 放到独立线程池中执行不会阻塞处理其它请求的线程;
+线程池中等待和执行的任务总数有上限, 达到上限时立即拒绝, 由调用方返回429
+"""
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.db import close_old_connections
+
+LOGIN_POOL_WORKERS = getattr(settings, "LOGIN_POOL_WORKERS", os.cpu_count() or 1)
+LOGIN_POOL_MAX_PENDING = getattr(settings, "LOGIN_POOL_MAX_PENDING", LOGIN_POOL_WORKERS * 4)
+LOGIN_RETRY_AFTER = getattr(settings, "LOGIN_RETRY_AFTER", 1)
+
+_executor = ThreadPoolExecutor(max_workers=LOGIN_POOL_WORKERS, thread_name_prefix="login")
+_slots = threading.BoundedSemaphore(LOGIN_POOL_MAX_PENDING)
+
+
+class LoginPoolFull(Exception):
+    """
+    登录线程池已满
+    """
+
+
+def _run(fn, args, kwargs):
+    # 线程池中的线程不经过请求周期, 需要自行按CONN_MAX_AGE回收数据库连接
+    close_old_connections()
+    try:
+        return fn(*args, **kwargs)
+    finally:
+        close_old_connections()
+
+
+def submit_login(fn, *args, **kwargs):
+    """
+    提交登录任务
+    :return: concurrent.futures.Future
+    :raise LoginPoolFull: 等待和执行中的任务数已达 LOGIN_POOL_MAX_PENDING
+    """
+    if not _slots.acquire(blocking=False):
+        raise LoginPoolFull()
+    try:
+        future = _executor.submit(_run, fn, args, kwargs)
+    except BaseException:
+        _slots.release()
+        raise
+    future.add_done_callback(lambda _: _slots.release())
+    return future
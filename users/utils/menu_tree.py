@@ -0,0 +1,71 @@
+# -*- coding: utf-8 -*-
+
+"""
+@Remark: 菜单路由树构建
+"""
+from collections import defaultdict
+
+from users.models import Menu, Role
+
+# 构建路由树需要的菜单字段
+MENU_TREE_FIELDS = ("id", "parent_id", "path", "component", "redirect", "name", "icon", "visible")
+
+
+def get_user_menus(user, role_ids=None):
+    """
+    获取用户可访问的菜单查询集
+    超级管理员返回全部菜单, 其余用户返回其所有角色关联的菜单(每一级子菜单都需要关联到角色)
+    :param user: 当前用户
+    :param role_ids: 已加载的用户角色id, 为空时使用子查询
+    :return: Menu查询集
+    """
+    if user.is_superuser:
+        return Menu.objects.all()
+    if role_ids is None:
+        role_ids = user.role.values("id")
+    role_menus = Role.menu.through.objects.filter(role_id__in=role_ids).values("menu_id")
+    return Menu.objects.filter(id__in=role_menus)
+
+
+def build_menu_tree(menus):
+    """
+    在内存中构建前端路由树, 查询次数固定为两次(菜单 + 菜单关联角色)
+    菜单按角色过滤后, 父菜单不在查询集中的子菜单(及其子菜单)不出现在路由树中, 也不会提升为根节点
+    :param menus: Menu查询集(可已按角色过滤), 只有parent为空的菜单作为根节点
+    :return: 路由树列表
+    """
+    rows = list(menus.order_by("sort", "id").values(*MENU_TREE_FIELDS))
+
+    role_names = defaultdict(list)
+    menu_roles = (
+        Menu.roles.through.objects.filter(menu_id__in=menus.values("id"))
+        .order_by("role__sort", "role__id")
+        .values_list("menu_id", "role__name")
+    )
+    for menu_id, role_name in menu_roles:
+        role_names[menu_id].append(role_name)
+
+    nodes = {}
+    for row in rows:
+        nodes[row["id"]] = {
+            "path": row["path"],
+            "component": row["component"],
+            "redirect": row["redirect"],
+            "name": row["name"],
+            "meta": {
+                "title": row["name"],
+                "icon": row["icon"],
+                "hidden": not row["visible"],
+                "roles": role_names[row["id"]],
+            },
+            "children": [],
+        }
+
+    tree = []
+    for row in rows:
+        parent_id = row["parent_id"]
+        if parent_id is None:
+            tree.append(nodes[row["id"]])
+        elif parent_id in nodes:
+            nodes[parent_id]["children"].append(nodes[row["id"]])
+    return tree
@@ -0,0 +1,75 @@
+# -*- coding: utf-8 -*-
+
+"""
+@Remark: 根据序列化器字段推断查询集的 select_related/prefetch_related/defer
+"""
+from collections import namedtuple
+
+from django.core.exceptions import FieldDoesNotExist
+from django.db.models import Prefetch
+from rest_framework import serializers
+from rest_framework.relations import ManyRelatedField, PrimaryKeyRelatedField, RelatedField
+
+QuerysetPlan = namedtuple("QuerysetPlan", ["select_related", "prefetch_related", "deferred"])
+
+# {序列化器类: QuerysetPlan}
+_queryset_plans = {}
+
+
+def get_model_field(model, name):
+    try:
+        return model._meta.get_field(name)
+    except FieldDoesNotExist:
+        return None
+
+
+def build_queryset_plan(serializer_class):
+    """
+    分析序列化器的可读字段:
+    (1)外键: 主键字段直接读取xxx_id不需要关联, 其余关联字段或嵌套序列化器使用select_related
+    (2)多对多/反向关联: 使用prefetch_related, 只需要主键时只查询主键
+    (3)Meta.exclude中排除的普通字段使用defer延迟加载(如password)
+    """
+    model = serializer_class.Meta.model
+    select_related, prefetch_related = [], []
+    for field in serializer_class().fields.values():
+        if field.write_only or field.source == "*":
+            continue
+        source = field.source_attrs[0] if field.source_attrs else field.source
+        model_field = get_model_field(model, source)
+        if model_field is None or not model_field.is_relation:
+            continue
+        if isinstance(field, ManyRelatedField) or isinstance(field, serializers.ListSerializer):
+            child = getattr(field, "child_relation", None)
+            if isinstance(child, PrimaryKeyRelatedField) and not child.pk_field:
+                related_model = model_field.related_model
+                # 默认排序相同的行按主键排序, 与values()快速路径的输出顺序一致
+                queryset = related_model._default_manager.only("pk").order_by(*related_model._meta.ordering, "pk")
+                prefetch_related.append(Prefetch(source, queryset=queryset))
+            else:
+                prefetch_related.append(source)
+        elif isinstance(field, PrimaryKeyRelatedField):
+            continue
+        elif isinstance(field, (RelatedField, serializers.BaseSerializer)):
+            if model_field.many_to_one or model_field.one_to_one:
+                select_related.append(source)
+            else:
+                prefetch_related.append(source)
+
+    deferred = []
+    for name in getattr(serializer_class.Meta, "exclude", None) or ():
+        model_field = get_model_field(model, name)
+        if model_field is not None and model_field.concrete and not model_field.many_to_many \
+                and not model_field.primary_key:
+            deferred.append(name)
+    return QuerysetPlan(select_related, prefetch_related, deferred)
+
+
+def get_queryset_plan(serializer_class):
+    """
+    按序列化器类缓存的查询优化方案
+    """
+    plan = _queryset_plans.get(serializer_class)
+    if plan is None:
+        plan = _queryset_plans.setdefault(serializer_class, build_queryset_plan(serializer_class))
+    return plan
@@ -0,0 +1,113 @@
+# -*- coding: utf-8 -*-
+
+"""
+@Remark: 角色路由/权限缓存
+按用户的角色集合缓存已序列化的路由树和按钮权限列表, 菜单和角色变更时通过信号整体失效
+"""
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+
+from users.models import Menu, Role
+from users.utils.menu_tree import build_menu_tree, get_user_menus
+
+RBAC_CACHE_PREFIX = "rbac"
+RBAC_CACHE_VERSION_KEY = f"{RBAC_CACHE_PREFIX}:version"
+RBAC_CACHE_TIMEOUT = getattr(settings, "RBAC_CACHE_TIMEOUT", 60 * 60 * 24)
+SUPERUSER_CACHE_KEY = "superuser"
+
+
+def get_cache_version():
+    """
+    获取当前缓存版本, 版本不存在(首次使用或被淘汰)时生成新版本
+    """
+    version = cache.get(RBAC_CACHE_VERSION_KEY)
+    if version is None:
+        cache.add(RBAC_CACHE_VERSION_KEY, time.time_ns(), None)
+        version = cache.get(RBAC_CACHE_VERSION_KEY)
+    return version
+
+
+def invalidate_rbac_cache():
+    """
+    使所有角色的缓存失效: 更换版本号, 旧版本的缓存条目自然过期
+    """
+    cache.set(RBAC_CACHE_VERSION_KEY, time.time_ns(), None)
+
+
+def get_role_key(user, role_ids=None):
+    """
+    用户的角色缓存键: 超级管理员使用固定键, 其余用户使用排序后的角色id
+    """
+    if user.is_superuser:
+        return SUPERUSER_CACHE_KEY
+    if role_ids is None:
+        role_ids = user.role.values_list("id", flat=True)
+    return ",".join(str(role_id) for role_id in sorted(role_ids))
+
+
+def get_roles(role_ids):
+    """
+    按角色id获取角色信息(id/key/name/admin), 优先读缓存
+    """
+    role_ids = sorted(role_ids)
+    cache_key = f"{RBAC_CACHE_PREFIX}:{get_cache_version()}:roles:{','.join(str(role_id) for role_id in role_ids)}"
+    roles = cache.get(cache_key)
+    if roles is None:
+        roles = list(Role.objects.filter(id__in=role_ids).values("id", "key", "name", "admin"))
+        cache.set(cache_key, roles, RBAC_CACHE_TIMEOUT)
+    return roles
+
+
+def get_user_perms(user, role_ids=None):
+    """
+    获取用户拥有的按钮权限标识(不读缓存)
+    """
+    if user.is_superuser:
+        perms = Menu.objects.values_list("perm", flat=True)
+    else:
+        if role_ids is None:
+            role_ids = user.role.values("id")
+        perms = (
+            Role.menu.through.objects.filter(role_id__in=role_ids)
+            .order_by("role__sort", "role_id", "menu__sort", "menu_id")
+            .values_list("menu__perm", flat=True)
+        )
+    return [perm for perm in perms if perm]
+
+
+def get_rbac_data(user, role_ids=None):
+    """
+    获取用户角色对应的路由树和按钮权限, 优先读缓存
+    :param role_ids: 已加载的用户角色id(如请求权限上下文中的role_ids), 为空时查询
+    :return: {"routes": [...], "perms": [...]}
+    """
+    if role_ids is None and not user.is_superuser:
+        role_ids = list(user.role.values_list("id", flat=True))
+    cache_key = f"{RBAC_CACHE_PREFIX}:{get_cache_version()}:{get_role_key(user, role_ids)}"
+    data = cache.get(cache_key)
+    if data is None:
+        data = {
+            "routes": build_menu_tree(get_user_menus(user, role_ids)),
+            "perms": get_user_perms(user, role_ids),
+        }
+        cache.set(cache_key, data, RBAC_CACHE_TIMEOUT)
+    return data
+
+
+def get_api_rules(user, role_ids=None, version=None):
+    """
+    获取用户角色授权的接口 frozenset({(请求方法, 接口)}), 优先读缓存
+    """
+    if role_ids is None and not user.is_superuser:
+        role_ids = list(user.role.values_list("id", flat=True))
+    if version is None:
+        version = get_cache_version()
+    cache_key = f"{RBAC_CACHE_PREFIX}:{version}:{get_role_key(user, role_ids)}:api"
+    rules = cache.get(cache_key)
+    if rules is None:
+        menus = get_user_menus(user, role_ids).exclude(api__isnull=True).exclude(api="")
+        rules = frozenset(menus.values_list("method", "api"))
+        cache.set(cache_key, rules, RBAC_CACHE_TIMEOUT)
+    return rules
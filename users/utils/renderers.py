@@ -0,0 +1,65 @@
+# -*- coding: utf-8 -*-
+
+"""
+@Remark: JSON渲染器
+安装了orjson时使用orjson编码紧凑格式的响应, 输出与DRF的JSONRenderer一致; 未安装、需要缩进或ensure_ascii输出时使用DRF原有实现
+"""
+import re
+from itertools import chain
+
+from rest_framework.renderers import JSONRenderer
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+if orjson is not None:
+    # datetime交给DRF的JSONEncoder处理(毫秒精度, UTC输出为Z), 与原有输出保持一致
+    ORJSON_OPTIONS = orjson.OPT_PASSTHROUGH_DATETIME | orjson.OPT_NON_STR_KEYS
+
+# 绝对值小于1e-4或不小于1e16的浮点数, Python输出为1e-05/1e+16, orjson输出为0.00001/1e16, 其余浮点数两者一致;
+# 两个正则都以字面字符开头, 扫描时可以跳过不相关的内容
+EXPONENT_RE = re.compile(rb"e[-0-9]")
+SMALL_DECIMAL_RE = re.compile(rb"0\.0000")
+
+
+def has_exponent_float(content):
+    """
+    orjson的输出中是否有与Python格式不同的浮点数: 匹配位置向前跳过数字, 前一个字符是 : , [ 时才是JSON中的数字;
+    字符串中恰好出现相同内容时同样返回True, 只会多一次回退, 不影响结果
+    """
+    for match in chain(EXPONENT_RE.finditer(content), SMALL_DECIMAL_RE.finditer(content)):
+        start = match.start()
+        while start and content[start - 1] in b"0123456789.-":
+            start -= 1
+        if match.re is EXPONENT_RE and start == match.start():
+            # e前面不是数字
+            continue
+        if start and content[start - 1] in b":,[":
+            return True
+    return False
+
+
+class CustomJSONRenderer(JSONRenderer):
+    """
+    orjson不支持的类型(Decimal、懒翻译字符串、QuerySet等)通过 encoder_class.default 转换;
+    超出64位的整数等orjson无法编码的数据, 以及输出中有指数形式浮点数时回退到DRF原有实现;
+    NaN/Infinity在DRF中抛出ValueError, orjson输出为null
+    """
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b""
+        if orjson is None or self.ensure_ascii or not self.compact:
+            return super().render(data, accepted_media_type, renderer_context)
+        if self.get_indent(accepted_media_type, renderer_context or {}):
+            return super().render(data, accepted_media_type, renderer_context)
+        try:
+            ret = orjson.dumps(data, default=self.encoder_class().default, option=ORJSON_OPTIONS)
+        except (TypeError, orjson.JSONEncodeError):
+            return super().render(data, accepted_media_type, renderer_context)
+        if has_exponent_float(ret):
+            return super().render(data, accepted_media_type, renderer_context)
+        # 与JSONRenderer一致, 转义JavaScript中不合法的U+2028/U+2029
+        return ret.replace(b"\xe2\x80\xa8", b"\\u2028").replace(b"\xe2\x80\xa9", b"\\u2029")
@@ -3,18 +3,332 @@
 """
 @Remark: 自定义序列化器
 """
+import threading
+
+from django.core.exceptions import ValidationError as DjangoValidationError
+from django.db import connections, models, router
+from django.db.models.signals import m2m_changed, post_save
+from django.utils import timezone
 from rest_framework import serializers
 from rest_framework.fields import empty
+from rest_framework.relations import ManyRelatedField, PrimaryKeyRelatedField
 from rest_framework.request import Request
-from rest_framework.serializers import ModelSerializer
+from rest_framework.settings import api_settings
+from rest_framework.serializers import LIST_SERIALIZER_KWARGS, ModelSerializer, raise_errors_on_nested_writes
+from rest_framework.utils import model_meta
 
 from users.models import Users
+from users.utils.validator import CustomValidationError
+
+
+# {序列化器类: {模型字段名: verbose_name}}
+_verbose_names = {}
+_verbose_names_lock = threading.Lock()
+
+
+def parse_user_id(value):
+    """
+    modifier字段保存的是字符串形式的用户id
+    """
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def get_user_names(user_ids):
+    """
+    批量查询用户姓名
+    :param user_ids: 用户id集合
+    :return: {用户id: 姓名}
+    """
+    if not user_ids:
+        return {}
+    return dict(Users.objects.filter(id__in=user_ids).values_list("id", "name"))
+
+
+def get_pk(value):
+    return value.pk if isinstance(value, models.Model) else value
+
+
+class BulkPrimaryKeyRelatedField(PrimaryKeyRelatedField):
+    """
+    CustomModelSerializer的主键关联字段: 批量校验时优先使用列表序列化器一次查询出的关联对象
+    """
+    prefetched_objects = None
+
+    def to_internal_value(self, data):
+        if self.prefetched_objects is not None and not self.pk_field and not isinstance(data, bool):
+            try:
+                instance = self.prefetched_objects.get(self.get_queryset().model._meta.pk.to_python(data))
+            except (DjangoValidationError, TypeError):
+                instance = None
+            if instance is not None:
+                return instance
+        return super().to_internal_value(data)
+
+
+class CustomListSerializer(serializers.ListSerializer):
+    """
+    CustomModelSerializer(many=True)默认使用的列表序列化器
+    (1)create: 按批bulk_create, 多对多关联通过中间表bulk_create写入, 写入后补发post_save/m2m_changed(post_add)信号
+    (2)update: self.instance为与数据逐行对应的实例列表, 按批bulk_update
+    (3)errors: 每行的错误(包括唯一性校验失败)按字段verbose_name返回
+    (4)子序列化器重写了create/update时逐行调用子序列化器的create/update, 不批量写入
+    """
+    batch_size = 500
+
+    def child_overrides(self, method_name):
+        """
+        子序列化器是否重写了CustomModelSerializer的方法
+        """
+        return getattr(type(self.child), method_name) is not getattr(CustomModelSerializer, method_name)
+
+    def get_bulk_related_fields(self):
+        """
+        子序列化器中可批量预取的主键关联字段 [(字段名, 关联字段, 是否多对多)]
+        """
+        related_fields = []
+        for field_name, field in self.child.fields.items():
+            if field.read_only:
+                continue
+            relation = field.child_relation if isinstance(field, ManyRelatedField) else field
+            if isinstance(relation, BulkPrimaryKeyRelatedField) and not relation.pk_field:
+                related_fields.append((field_name, relation, relation is not field))
+        return related_fields
+
+    def to_internal_value(self, data):
+        """
+        校验前每个主键关联字段用一次查询取出所有行引用的关联对象, 避免逐行逐个查询
+        """
+        related_fields = self.get_bulk_related_fields() if isinstance(data, list) else []
+        for field_name, relation, many in related_fields:
+            model_pk = relation.get_queryset().model._meta.pk
+            pks = set()
+            for row in data:
+                values = row.get(field_name) if isinstance(row, dict) else None
+                if values is None:
+                    continue
+                for value in (values if many and isinstance(values, list) else [values]):
+                    try:
+                        pks.add(model_pk.to_python(value))
+                    except (DjangoValidationError, TypeError):
+                        continue
+            pks.discard(None)
+            relation.prefetched_objects = relation.get_queryset().in_bulk(pks) if pks else {}
+        try:
+            if isinstance(data, list):
+                return self.rows_to_internal_value(data)
+            return super().to_internal_value(data)
+        finally:
+            for _, relation, _ in related_fields:
+                relation.prefetched_objects = None
+
+    def check_rows_length(self, data):
+        """
+        与ListSerializer.to_internal_value一致的空列表/数量校验
+        """
+        checks = (
+            ("empty", not self.allow_empty and not data, {}),
+            ("max_length", self.max_length is not None and len(data) > self.max_length, {"max_length": self.max_length}),
+            ("min_length", self.min_length is not None and len(data) < self.min_length, {"min_length": self.min_length}),
+        )
+        for code, failed, params in checks:
+            if failed:
+                message = self.error_messages[code].format(**params)
+                raise serializers.ValidationError({api_settings.NON_FIELD_ERRORS_KEY: [message]}, code=code)
+
+    def run_child_validation(self, data):
+        """
+        校验一行数据: 唯一性校验抛出的CustomValidationError不是ValidationError, 转换为该行对应字段的错误
+        """
+        try:
+            return self.child.run_validation(data)
+        except CustomValidationError as exc:
+            field_name = exc.field_name or api_settings.NON_FIELD_ERRORS_KEY
+            raise serializers.ValidationError({field_name: [exc.detail]})
+
+    def rows_to_internal_value(self, data):
+        """
+        逐行校验, 错误按行返回;
+        批量更新时self.instance为与data逐行对应的实例列表, 校验每行时把子序列化器的instance设为该行的实例
+        """
+        self.check_rows_length(data)
+        instances = self.instance if isinstance(self.instance, list) else None
+        if instances is not None and len(data) != len(instances):
+            raise serializers.ValidationError({api_settings.NON_FIELD_ERRORS_KEY: ["数据与待更新的实例数量不一致"]})
+        ret, errors = [], []
+        try:
+            for index, item in enumerate(data):
+                if instances is not None:
+                    self.child.instance = instances[index]
+                try:
+                    validated = self.run_child_validation(item)
+                except serializers.ValidationError as exc:
+                    errors.append(exc.detail)
+                else:
+                    ret.append(validated)
+                    errors.append({})
+        finally:
+            if instances is not None:
+                self.child.instance = self.instance
+        if any(errors):
+            raise serializers.ValidationError(errors)
+        return ret
+
+    def update(self, instances, validated_data):
+        """
+        批量更新: 普通字段通过bulk_update写入(同时写入修改人和修改时间), 多对多关联按差异批量增删中间表,
+        写入后补发post_save和m2m_changed(post_remove/post_add)信号
+        """
+        child = self.child
+        if self.child_overrides("update"):
+            return self.update_rows(instances, validated_data)
+        model = child.Meta.model
+        using = router.db_for_write(model)
+        info = model_meta.get_field_info(model)
+        field_names = {field.name for field in model._meta.concrete_fields}
+        now = timezone.now()
+        update_fields, relations = set(), []
+        for instance, attrs in zip(instances, validated_data):
+            raise_errors_on_nested_writes("update", child, attrs)
+            attrs = dict(attrs)
+            if child.request and hasattr(instance, child.modifier_field_id):
+                attrs[child.modifier_field_id] = child.get_request_user_id()
+            if "update_datetime" in field_names:
+                # bulk_update不会触发auto_now
+                attrs["update_datetime"] = now
+            relations.append({
+                field_name: attrs.pop(field_name)
+                for field_name, relation_info in info.relations.items()
+                if relation_info.to_many and field_name in attrs
+            })
+            for attr, value in attrs.items():
+                setattr(instance, attr, value)
+            update_fields.update(attr for attr in attrs if attr in field_names)
+        if update_fields:
+            model._default_manager.db_manager(using).bulk_update(instances, update_fields, batch_size=self.batch_size)
+            for instance in instances:
+                post_save.send(sender=model, instance=instance, created=False, update_fields=frozenset(update_fields),
+                               raw=False, using=using)
+
+        for field_name in {field_name for instance_relations in relations for field_name in instance_relations}:
+            field = model._meta.get_field(field_name)
+            changed = [(instance, instance_relations[field_name])
+                       for instance, instance_relations in zip(instances, relations) if field_name in instance_relations]
+            if not field.many_to_many or field.auto_created:
+                for instance, values in changed:
+                    getattr(instance, field_name).set(values)
+                continue
+            self.replace_many_to_many(field, changed, using)
+        return instances
+
+    def update_rows(self, instances, validated_data):
+        """
+        逐行调用子序列化器的update
+        """
+        try:
+            for instance, attrs in zip(instances, validated_data):
+                self.child.instance = instance
+                self.child.update(instance, attrs)
+        finally:
+            self.child.instance = self.instance
+        return instances
+
+    def replace_many_to_many(self, field, changed, using):
+        """
+        一次查询现有关联, 按差异删除/新增中间表数据
+        :param changed: [(实例, 新的关联对象或主键列表)]
+        """
+        through = field.remote_field.through
+        source_name, target_name = f"{field.m2m_field_name()}_id", f"{field.m2m_reverse_field_name()}_id"
+        existing = {}
+        rows = through._default_manager.db_manager(using).filter(
+            **{f"{source_name}__in": [instance.pk for instance, _ in changed]}
+        ).values_list("pk", source_name, target_name)
+        for row_pk, source_pk, target_pk in rows:
+            existing.setdefault(source_pk, {})[target_pk] = row_pk
+
+        removed_rows, added_rows, signals = [], [], []
+        for instance, values in changed:
+            current = existing.get(instance.pk, {})
+            new_pks = {get_pk(value) for value in values}
+            removed = set(current) - new_pks
+            added = new_pks - set(current)
+            removed_rows.extend(current[pk] for pk in removed)
+            added_rows.extend(through(**{source_name: instance.pk, target_name: pk}) for pk in added)
+            signals.append((instance, removed, added))
+        if removed_rows:
+            through._default_manager.db_manager(using).filter(pk__in=removed_rows).delete()
+        through._default_manager.db_manager(using).bulk_create(added_rows, batch_size=self.batch_size,
+                                                                ignore_conflicts=True)
+        for instance, removed, added in signals:
+            for action, pk_set in (("post_remove", removed), ("post_add", added)):
+                if pk_set:
+                    m2m_changed.send(sender=through, instance=instance, action=action, reverse=False,
+                                     model=field.related_model, pk_set=pk_set, using=using)
+
+    @property
+    def errors(self):
+        errors = super().errors
+        if not isinstance(errors, list):
+            return errors
+        return [self.child.get_verbose_errors(row_errors) if isinstance(row_errors, dict) else row_errors
+                for row_errors in errors]
+
+    def create(self, validated_data):
+        child = self.child
+        model = child.Meta.model
+        using = router.db_for_write(model)
+        if self.child_overrides("create") or not connections[using].features.can_return_rows_from_bulk_insert:
+            # 子序列化器重写了create或数据库无法返回批量插入的主键时逐行创建
+            return super().create(validated_data)
+
+        info = model_meta.get_field_info(model)
+        instances, relations = [], []
+        for attrs in validated_data:
+            raise_errors_on_nested_writes("create", child, attrs)
+            attrs = child.add_create_audit_fields(dict(attrs))
+            relations.append({
+                field_name: attrs.pop(field_name)
+                for field_name, relation_info in info.relations.items()
+                if relation_info.to_many and field_name in attrs
+            })
+            instances.append(model(**attrs))
+        model._default_manager.db_manager(using).bulk_create(instances, batch_size=self.batch_size)
+        for instance in instances:
+            post_save.send(sender=model, instance=instance, created=True, update_fields=None, raw=False, using=using)
+
+        for field_name in {field_name for instance_relations in relations for field_name in instance_relations}:
+            field = model._meta.get_field(field_name)
+            if not field.many_to_many or field.auto_created:
+                # 反向关联等无法直接写中间表的字段按原方式设置
+                for instance, instance_relations in zip(instances, relations):
+                    if field_name in instance_relations:
+                        getattr(instance, field_name).set(instance_relations[field_name])
+                continue
+            through = field.remote_field.through
+            source_name, target_name = f"{field.m2m_field_name()}_id", f"{field.m2m_reverse_field_name()}_id"
+            rows, pk_sets = [], []
+            for instance, instance_relations in zip(instances, relations):
+                pk_set = {get_pk(value) for value in instance_relations.get(field_name, ())}
+                rows.extend(through(**{source_name: instance.pk, target_name: pk}) for pk in pk_set)
+                pk_sets.append((instance, pk_set))
+            through._default_manager.db_manager(using).bulk_create(rows, batch_size=self.batch_size,
+                                                                    ignore_conflicts=True)
+            for instance, pk_set in pk_sets:
+                if pk_set:
+                    m2m_changed.send(sender=through, instance=instance, action="post_add", reverse=False,
+                                     model=field.related_model, pk_set=pk_set, using=using)
+        return instances
 
 
 class CustomModelSerializer(ModelSerializer):
     """
         自定义基础Serializer
     """
+    serializer_related_field = BulkPrimaryKeyRelatedField
+
     # 修改人的审计字段名称, 默认modifier, 继承使用时可自定义覆盖
     modifier_field_id = "modifier"
     modifier_name = serializers.SerializerMethodField(read_only=True)
@@ -22,20 +336,44 @@ class CustomModelSerializer(ModelSerializer):
     def get_modifier_name(self, instance):
         if not hasattr(instance, "modifier"):
             return None
-        queryset = (
-            Users.objects.filter(id=instance.modifier)
-            .values_list("name", flat=True)
-            .first()
-        )
-        if queryset:
-            return queryset
-        return None
+        return self.get_audit_user_name(instance, self.get_modifier_id(instance)) or None
 
     # 创建人的审计字段名称, 默认creator, 继承使用时可自定义覆盖
     creator_field_id = "creator"
-    creator_name = serializers.SlugRelatedField(
-        slug_field="name", source="creator", read_only=True
-    )
+    creator_name = serializers.SerializerMethodField(read_only=True)
+
+    def get_creator_name(self, instance):
+        return self.get_audit_user_name(instance, self.get_creator_id(instance))
+
+    def get_modifier_id(self, instance):
+        return parse_user_id(getattr(instance, self.modifier_field_id, None))
+
+    def get_creator_id(self, instance):
+        return getattr(instance, f"{self.creator_field_id}_id", None)
+
+    def get_audit_user_name(self, instance, user_id):
+        """
+        获取创建人/修改人姓名: 列表序列化时一次性查询当前页所有行的创建人和修改人
+        """
+        if user_id is None:
+            return None
+        if not hasattr(self, "_audit_user_names"):
+            self._audit_user_names = {}
+        user_names = self._audit_user_names
+        if user_id not in user_names:
+            instances = [instance]
+            if isinstance(self.parent, serializers.ListSerializer) and self.parent.instance is not None:
+                instances = self.parent.instance
+                if isinstance(instances, models.Manager):
+                    instances = instances.all()
+            user_ids = {user_id}
+            for row in instances:
+                user_ids.update({self.get_modifier_id(row), self.get_creator_id(row)})
+            user_ids.difference_update(user_names, {None})
+            user_names.update(dict.fromkeys(user_ids))
+            user_names.update(get_user_names(user_ids))
+        return user_names[user_id]
+
     # 添加默认时间返回格式
     create_datetime = serializers.DateTimeField(
         format="%Y-%m-%d %H:%M:%S", required=False, read_only=True
@@ -51,14 +389,36 @@ class CustomModelSerializer(ModelSerializer):
     def save(self, **kwargs):
         return super().save(**kwargs)
 
-    def create(self, validated_data):
+    @classmethod
+    def many_init(cls, *args, **kwargs):
+        """
+        Meta中未指定list_serializer_class时使用支持批量写入的CustomListSerializer(不修改Meta), 参数处理与ListSerializer一致
+        """
+        meta = getattr(cls, "Meta", None)
+        if hasattr(meta, "list_serializer_class"):
+            return super().many_init(*args, **kwargs)
+        list_kwargs = {}
+        for key in ("allow_empty", "max_length", "min_length"):
+            value = kwargs.pop(key, None)
+            if value is not None:
+                list_kwargs[key] = value
+        list_kwargs.update({key: value for key, value in kwargs.items() if key in LIST_SERIALIZER_KWARGS})
+        return CustomListSerializer(*args, child=cls(*args, **kwargs), **list_kwargs)
+
+    def add_create_audit_fields(self, validated_data):
+        """
+        写入创建人/修改人
+        """
         if self.request:
             if str(self.request.user) != "AnonymousUser":
                 if self.modifier_field_id in self.fields.fields:
                     validated_data[self.modifier_field_id] = self.get_request_user_id()
                 if self.creator_field_id in self.fields.fields:
                     validated_data[self.creator_field_id] = self.request.user
-        return super().create(validated_data)
+        return validated_data
+
+    def create(self, validated_data):
+        return super().create(self.add_create_audit_fields(validated_data))
 
     def update(self, instance, validated_data):
         if self.request:
@@ -88,13 +448,31 @@ class CustomModelSerializer(ModelSerializer):
 
     @property
     def errors(self):
-        # get errors
-        errors = super().errors
-        verbose_errors = {}
+        return self.get_verbose_errors(super().errors)
+
+    @classmethod
+    def get_verbose_names(cls):
+        """
+        模型字段名到verbose_name的映射, 每个序列化器类首次使用时计算一次
+        """
+        verbose_names = _verbose_names.get(cls)
+        if verbose_names is None:
+            with _verbose_names_lock:
+                verbose_names = _verbose_names.get(cls)
+                if verbose_names is None:
+                    # fields = { field.name: field.verbose_name } for each field in model
+                    verbose_names = _verbose_names[cls] = {
+                        field.name: field.verbose_name for field in
+                        cls.Meta.model._meta.get_fields() if hasattr(field, 'verbose_name')
+                    }
+        return verbose_names
 
-        # fields = { field.name: field.verbose_name } for each field in model
-        fields = {field.name: field.verbose_name for field in
-                  self.Meta.model._meta.get_fields() if hasattr(field, 'verbose_name')}
+    def get_verbose_errors(self, errors):
+        """
+        将错误中的字段名替换为模型字段的verbose_name
+        """
+        verbose_errors = {}
+        fields = self.get_verbose_names()
 
         # iterate over errors and replace error key with verbose name if exists
         for field_name, error in errors.items():
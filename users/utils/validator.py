@@ -4,18 +4,24 @@
 @Remark: 自定义验证器
 """
 
+from collections import Counter
+
 from django.db import DataError
-from rest_framework.exceptions import APIException
+from django.db.models import QuerySet
+from rest_framework.exceptions import APIException, ValidationError
+from rest_framework.serializers import ListSerializer
 from rest_framework.validators import UniqueValidator
 
 
 class CustomValidationError(APIException):
     """
     继承并重写验证器返回的结果,避免暴露字段
+    field_name: 校验失败的序列化器字段, 批量校验时按行、按字段返回错误
     """
 
-    def __init__(self, detail):
+    def __init__(self, detail, field_name=None):
         self.detail = detail
+        self.field_name = field_name
 
 
 def qs_exists(queryset):
@@ -53,6 +59,31 @@ class CustomUniqueValidator(UniqueValidator):
             return queryset.exclude(pk=instance.pk)
         return queryset
 
+    def get_existing_values(self, list_serializer, serializer_field, field_name):
+        """
+        列表序列化时一次查询所有行的取值, 结果缓存在列表序列化器上
+        :return: ({取值: 在请求数据中出现的次数}, {已存在的取值: {主键}}), 无法批量判断时返回None
+        """
+        cache = list_serializer.__dict__.setdefault("_unique_values", {})
+        cache_key = (id(self), field_name)
+        if cache_key not in cache:
+            candidates = Counter()
+            for row in list_serializer.initial_data:
+                if not isinstance(row, dict) or serializer_field.field_name not in row:
+                    continue
+                try:
+                    candidates[serializer_field.to_internal_value(row[serializer_field.field_name])] += 1
+                except (ValidationError, TypeError):
+                    continue
+            existing = {}
+            if candidates:
+                rows = qs_filter(self.queryset, **{f"{field_name}__in": list(candidates)}).values_list(field_name, "pk")
+                for existing_value, pk in rows:
+                    existing.setdefault(existing_value, set()).add(pk)
+            # 数据库的比较规则与python不一致时(如大小写不敏感的排序规则)退回逐行查询
+            cache[cache_key] = (candidates, existing) if all(key in candidates for key in existing) else None
+        return cache[cache_key]
+
     def __call__(self, value, serializer_field):
         # Determine the underlying model field name. This may not be the
         # same as the serializer field name if `source=<>` is set.
@@ -60,11 +91,27 @@ class CustomUniqueValidator(UniqueValidator):
         # Determine the existing instance, if this is an update operation.
         instance = getattr(serializer_field.parent, 'instance', None)
 
+        # 列表序列化(批量新增/批量更新)时: 请求数据内的重复值和数据库中的已有值都按一次查询的结果判断
+        list_serializer = getattr(serializer_field.parent, 'parent', None)
+        if self.lookup == 'exact' and isinstance(list_serializer, ListSerializer) \
+                and hasattr(list_serializer, 'initial_data') and not isinstance(instance, (list, QuerySet)):
+            values = self.get_existing_values(list_serializer, serializer_field, field_name)
+            if values is not None and value in values[0]:
+                candidates, existing = values
+                if candidates[value] > 1:
+                    raise CustomValidationError(self.message, serializer_field.field_name)
+                pks = existing.get(value, set())
+                if instance is not None:
+                    pks = pks - {instance.pk}
+                if pks:
+                    raise CustomValidationError(self.message, serializer_field.field_name)
+                return
+
         queryset = self.queryset
         queryset = self.filter_queryset(value, queryset, field_name)
         queryset = self.exclude_current_instance(queryset, instance)
         if qs_exists(queryset):
-            raise CustomValidationError(self.message)
+            raise CustomValidationError(self.message, serializer_field.field_name)
 
     def __repr__(self):
         return super().__repr__()
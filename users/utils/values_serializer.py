@@ -0,0 +1,145 @@
+# -*- coding: utf-8 -*-
+
+"""
+@Remark: 基于values()的只读列表快速序列化
+按序列化器的字段预编译取值/格式化规则, 直接处理values()返回的字典, 不实例化序列化器
+输出与序列化器的结果一致, 序列化器中有无法预编译的字段(自定义方法字段、嵌套序列化器等)时不启用
+"""
+from collections import defaultdict
+
+from django.core.exceptions import FieldDoesNotExist
+from rest_framework.relations import ManyRelatedField, PrimaryKeyRelatedField
+from rest_framework.serializers import BaseSerializer, SerializerMethodField
+
+from users.utils.serializers import CustomModelSerializer, get_user_names, parse_user_id
+
+# {序列化器类: ValuesSerializer或None(不支持)}
+_values_serializers = {}
+
+
+class UnsupportedField(Exception):
+    pass
+
+
+class ValuesSerializer:
+    """
+    预编译的values()序列化器, 通过 get_values_serializer(serializer_class) 获取
+    """
+
+    def __init__(self, serializer_class):
+        self.model = serializer_class.Meta.model
+        self.columns = ["pk"]
+        self.many_to_many = {}
+        self.formatters = []
+        for field_name, field in serializer_class().fields.items():
+            if field.write_only:
+                continue
+            self.formatters.append((field_name, self.compile_field(serializer_class, field_name, field)))
+
+    def add_column(self, column):
+        if column not in self.columns:
+            self.columns.append(column)
+        return column
+
+    def compile_field(self, serializer_class, field_name, field):
+        """
+        返回 (取值方式, 取值参数, 格式化函数)
+        """
+        if isinstance(field, SerializerMethodField):
+            # 只支持基础序列化器中的创建人/修改人姓名
+            method = getattr(serializer_class, field.method_name, None)
+            if field.method_name == "get_modifier_name" and method is CustomModelSerializer.get_modifier_name:
+                return "modifier", self.add_column(serializer_class.modifier_field_id), None
+            if field.method_name == "get_creator_name" and method is CustomModelSerializer.get_creator_name:
+                return "creator", self.add_column(f"{serializer_class.creator_field_id}_id"), None
+            raise UnsupportedField(field_name)
+        if isinstance(field, BaseSerializer) or len(field.source_attrs) != 1:
+            raise UnsupportedField(field_name)
+        try:
+            model_field = self.model._meta.get_field(field.source)
+        except FieldDoesNotExist:
+            raise UnsupportedField(field_name)
+
+        if isinstance(field, ManyRelatedField):
+            child = field.child_relation
+            if not model_field.many_to_many or model_field.auto_created \
+                    or not isinstance(child, PrimaryKeyRelatedField) or child.pk_field:
+                raise UnsupportedField(field_name)
+            self.many_to_many[field_name] = model_field
+            return "many_to_many", field_name, None
+        if isinstance(field, PrimaryKeyRelatedField):
+            if not (model_field.many_to_one or model_field.one_to_one) or field.pk_field:
+                raise UnsupportedField(field_name)
+            return "column", self.add_column(model_field.attname), None
+        if model_field.is_relation or not model_field.concrete:
+            raise UnsupportedField(field_name)
+        return "column", self.add_column(model_field.attname), field.to_representation
+
+    def values(self, queryset):
+        return queryset.values(*self.columns)
+
+    def get_many_to_many_ids(self, pks):
+        """
+        每个多对多字段一次查询, 按关联模型的默认排序, 相同时按关联主键排序(与查询方案中的预取一致)
+        """
+        result = {}
+        for field_name, model_field in self.many_to_many.items():
+            through = model_field.remote_field.through
+            source_column = f"{model_field.m2m_field_name()}_id"
+            target_name = model_field.m2m_reverse_field_name()
+            ordering = [
+                f"-{target_name}__{item[1:]}" if item.startswith("-") else f"{target_name}__{item}"
+                for item in model_field.related_model._meta.ordering if isinstance(item, str)
+            ]
+            related_ids = defaultdict(list)
+            rows = (
+                through.objects.filter(**{f"{source_column}__in": pks})
+                .order_by(*ordering, f"{target_name}_id")
+                .values_list(source_column, f"{target_name}_id")
+            )
+            for pk, related_id in rows:
+                related_ids[pk].append(related_id)
+            result[field_name] = related_ids
+        return result
+
+    def serialize(self, rows):
+        rows = list(rows)
+        many_to_many_ids = self.get_many_to_many_ids([row["pk"] for row in rows]) if self.many_to_many else {}
+
+        user_ids = set()
+        for _, (kind, column, _) in self.formatters:
+            if kind == "modifier":
+                user_ids.update(parse_user_id(row[column]) for row in rows)
+            elif kind == "creator":
+                user_ids.update(row[column] for row in rows)
+        user_ids.discard(None)
+        user_names = get_user_names(user_ids)
+
+        data = []
+        for row in rows:
+            item = {}
+            for field_name, (kind, column, to_representation) in self.formatters:
+                if kind == "column":
+                    value = row[column]
+                    item[field_name] = value if value is None or to_representation is None else to_representation(value)
+                elif kind == "many_to_many":
+                    item[field_name] = many_to_many_ids[column].get(row["pk"], [])
+                elif kind == "modifier":
+                    item[field_name] = user_names.get(parse_user_id(row[column])) or None
+                else:
+                    item[field_name] = user_names.get(row[column])
+            data.append(item)
+        return data
+
+
+def get_values_serializer(serializer_class):
+    """
+    获取序列化器对应的预编译values()序列化器, 不支持时返回None
+    """
+    if serializer_class not in _values_serializers:
+        try:
+            values_serializer = ValuesSerializer(serializer_class)
+        except UnsupportedField:
+            values_serializer = None
+        _values_serializers[serializer_class] = values_serializer
+    return _values_serializers[serializer_class]
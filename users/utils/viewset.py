@@ -4,13 +4,30 @@
 @Remark: 自定义视图集
 """
 
+import hashlib
+import json
+import operator
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+from functools import reduce
+
+from django.core.cache import cache
+from django.core.exceptions import ValidationError as DjangoValidationError
 from django.db import transaction
+from django.db.models import Q, prefetch_related_objects
+from django.http import StreamingHttpResponse
 from rest_framework.decorators import action
+from rest_framework.exceptions import NotFound
 from rest_framework.viewsets import ModelViewSet
-from rest_framework.pagination import PageNumberPagination
+from rest_framework.serializers import ListSerializer
+from rest_framework.pagination import BasePagination, PageNumberPagination, _positive_int
+from rest_framework.utils.urls import replace_query_param
 
+from users.utils.deletion import delete_by_keys
+from users.utils.export import EXPORT_CHUNK_SIZE, csv_stream, iter_chunks, ndjson_stream
 from users.utils.json_response import SuccessResponse, ErrorResponse, DetailResponse
 from users.utils.permission import CustomPermission
+from users.utils.queryset_plan import get_queryset_plan
+from users.utils.values_serializer import get_values_serializer
 
 
 class CustomPagination(PageNumberPagination):
@@ -22,13 +39,170 @@ class CustomPagination(PageNumberPagination):
     max_page_size = 100   # 每页最大显示的数量
 
 
+class CustomCursorPagination(BasePagination):
+    """
+    游标(keyset)分页器, 视图中设置 pagination_class = CustomCursorPagination 启用:
+    (1)按ordering中的字段做范围查询定位, 没有COUNT和OFFSET, 深分页不会变慢
+    (2)ordering字段排序方向需一致、不能为空且需要有联合索引, 默认与Users.Meta.ordering一致的(create_datetime, id)
+    (3)total_mode: "exact"精确总数, "approximate"缓存的总数, None不返回总数
+    (4)返回格式与SuccessResponse一致, 上一页/下一页地址通过Link响应头返回
+    """
+    page_size = 10
+    page_size_query_param = 'page_size'
+    max_page_size = 100
+    cursor_query_param = 'cursor'
+    ordering = ('-create_datetime', '-id')
+    total_mode = None
+    approximate_total_timeout = 60
+    invalid_cursor_message = '无效的游标'
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.base_url = request.build_absolute_uri()
+        self.page_size = self.get_page_size(request)
+        self.cursor = request.query_params.get(self.cursor_query_param)
+        self.total = self.get_total(queryset)
+
+        position, reverse = self.decode_cursor(self.cursor, queryset.model) if self.cursor else (None, False)
+        descending = self.ordering[0].startswith('-')
+        fields = [field.lstrip('-') for field in self.ordering]
+        # 向前翻页时反向排序取数, 取完后再倒序
+        if descending != reverse:
+            order_by = ['-' + field for field in fields]
+        else:
+            order_by = fields
+        queryset = queryset.order_by(*order_by)
+        if position is not None:
+            lookup = 'lt' if descending != reverse else 'gt'
+            queryset = queryset.filter(self.get_position_filter(fields, position, lookup))
+
+        results = list(queryset[:self.page_size + 1])
+        has_more = len(results) > self.page_size
+        results = results[:self.page_size]
+        if reverse:
+            results.reverse()
+
+        self.next_position = self.previous_position = None
+        if results:
+            first, last = self.get_position(results[0], fields), self.get_position(results[-1], fields)
+            if reverse:
+                self.next_position = last
+                self.previous_position = first if has_more else None
+            else:
+                self.next_position = last if has_more else None
+                self.previous_position = first if position is not None else None
+        return results
+
+    def get_page_size(self, request):
+        if self.page_size_query_param:
+            try:
+                return _positive_int(
+                    request.query_params[self.page_size_query_param],
+                    strict=True,
+                    cutoff=self.max_page_size
+                )
+            except (KeyError, ValueError):
+                pass
+        return self.page_size
+
+    def get_total(self, queryset):
+        if self.total_mode == 'exact':
+            return queryset.count()
+        if self.total_mode == 'approximate':
+            sql_hash = hashlib.md5(str(queryset.query).encode()).hexdigest()
+            cache_key = f"pagination:total:{queryset.model._meta.db_table}:{sql_hash}"
+            return cache.get_or_set(cache_key, queryset.count, self.approximate_total_timeout)
+        return None
+
+    @staticmethod
+    def get_position(row, fields):
+        if isinstance(row, dict):
+            values = [row[field] for field in fields]
+        else:
+            values = [getattr(row, field) for field in fields]
+        return [value.isoformat() if hasattr(value, 'isoformat') else value for value in values]
+
+    @staticmethod
+    def get_position_filter(fields, position, lookup):
+        """
+        按字段顺序比较的范围条件: (a, b) < (x, y) => a < x OR (a = x AND b < y)
+        """
+        conditions = []
+        for index, field in enumerate(fields):
+            condition = {prev_field: position[i] for i, prev_field in enumerate(fields[:index])}
+            condition[f"{field}__{lookup}"] = position[index]
+            conditions.append(Q(**condition))
+        return reduce(operator.or_, conditions)
+
+    def encode_cursor(self, position, reverse):
+        data = json.dumps({'p': position, 'r': int(reverse)}, separators=(',', ':'))
+        cursor = urlsafe_b64encode(data.encode()).decode()
+        return replace_query_param(self.base_url, self.cursor_query_param, cursor)
+
+    def decode_cursor(self, cursor, model):
+        """
+        游标可被客户端篡改, 位置值按ordering字段的类型转换, 任何不合法的值都返回404
+        """
+        try:
+            data = json.loads(urlsafe_b64decode(cursor.encode()))
+            position, reverse = data['p'], bool(data['r'])
+            if not isinstance(position, list) or len(position) != len(self.ordering):
+                raise ValueError
+            fields = [model._meta.get_field(field.lstrip('-')) for field in self.ordering]
+            position = [field.to_python(value) for field, value in zip(fields, position)]
+            if None in position:
+                raise ValueError
+        except (TypeError, ValueError, KeyError, DjangoValidationError):
+            raise NotFound(self.invalid_cursor_message)
+        return position, reverse
+
+    def get_next_link(self):
+        if self.next_position is None:
+            return None
+        return self.encode_cursor(self.next_position, False)
+
+    def get_previous_link(self):
+        if self.previous_position is None:
+            return None
+        return self.encode_cursor(self.previous_position, True)
+
+    def get_paginated_response(self, data):
+        links = [f'<{url}>; rel="{rel}"' for rel, url in
+                 (('next', self.get_next_link()), ('prev', self.get_previous_link())) if url]
+        headers = {'Link': ', '.join(links)} if links else None
+        return SuccessResponse(data=data, page=self.cursor, limit=self.page_size, total=self.total,
+                               headers=headers)
+
+    def get_schema_operation_parameters(self, view):
+        return [
+            {
+                'name': self.cursor_query_param,
+                'required': False,
+                'in': 'query',
+                'description': '分页游标',
+                'schema': {'type': 'string'},
+            },
+            {
+                'name': self.page_size_query_param,
+                'required': False,
+                'in': 'query',
+                'description': '每页显示的数量',
+                'schema': {'type': 'integer'},
+            },
+        ]
+
+
 class CustomModelViewSet(ModelViewSet):
     """
     自定义的ModelViewSet:
     统一标准的返回格式;新增,查询,修改可使用不同序列化器
-    (1)ORM性能优化, 尽可能使用values_queryset形式
+    (1)ORM性能优化, 尽可能使用values_queryset形式: 设置values_queryset后list使用values()快速序列化
     (2)xxx_serializer_class 某个方法下使用的序列化器(xxx=create|update|list|retrieve|destroy)
     (3)filter_fields = '__all__' 默认支持全部model中的字段查询(除json字段外)
+    (4)optimize_actions 中的方法根据序列化器字段自动 select_related/prefetch_related/defer,
+       可通过 select_related_fields/prefetch_related_fields/deferred_fields 覆盖, auto_optimize_queryset = False 关闭
+    (5)export 按过滤条件流式导出全部数据(ndjson|csv), export_chunk_size 为每批读取的行数;
+       接口权限按完整路径匹配, 列表的GET权限不包括导出, 需要为 GET .../export/ 单独配置菜单接口
     """
     values_queryset = None
     ordering_fields = '__all__'
@@ -38,9 +212,43 @@ class CustomModelViewSet(ModelViewSet):
     search_fields = ()
     permission_classes = [CustomPermission]
     pagination_class = CustomPagination
+    auto_optimize_queryset = True
+    optimize_actions = ('list', 'retrieve', 'export')
+    select_related_fields = None
+    prefetch_related_fields = None
+    deferred_fields = None
+    export_chunk_size = EXPORT_CHUNK_SIZE
+    export_formats = {
+        'ndjson': 'application/x-ndjson; charset=utf-8',
+        'csv': 'text/csv; charset=utf-8',
+    }
+
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        if self.auto_optimize_queryset and self.action in self.optimize_actions:
+            queryset = self.optimize_queryset(queryset)
+        return queryset
+
+    def optimize_queryset(self, queryset):
+        """
+        按当前序列化器推断的方案优化查询集, 视图中设置了对应属性时以视图为准
+        """
+        plan = get_queryset_plan(self.get_serializer_class())
+        select_related = plan.select_related if self.select_related_fields is None else self.select_related_fields
+        prefetch_related = plan.prefetch_related if self.prefetch_related_fields is None else self.prefetch_related_fields
+        deferred = plan.deferred if self.deferred_fields is None else self.deferred_fields
+        if select_related:
+            queryset = queryset.select_related(*select_related)
+        if prefetch_related:
+            queryset = queryset.prefetch_related(*prefetch_related)
+        if deferred:
+            queryset = queryset.defer(*deferred)
+        return queryset
 
     def get_serializer_class(self):
-        action_serializer_name = f"{self.action}_serializer_class"
+        # 部分更新与更新使用同一个序列化器
+        action = "update" if self.action == "partial_update" else self.action
+        action_serializer_name = f"{action}_serializer_class"
         action_serializer_class = getattr(self, action_serializer_name, None)
         if action_serializer_class:
             return action_serializer_class
@@ -51,23 +259,74 @@ class CustomModelViewSet(ModelViewSet):
         serializer_class = self.get_serializer_class()
         kwargs.setdefault('context', self.get_serializer_context())
         if isinstance(self.request.data, list):
-            with transaction.atomic():
-                return serializer_class(many=True, *args, **kwargs)
+            return serializer_class(many=True, *args, **kwargs)
         else:
             return serializer_class(*args, **kwargs)
 
+    def get_row_errors(self, serializer):
+        """
+        批量校验失败时按行返回错误, index为请求列表中的下标; 不是逐行错误时返回None
+        """
+        errors = serializer.errors
+        if not isinstance(errors, list):
+            return None
+        return [{"index": index, "errors": row_errors} for index, row_errors in enumerate(errors) if row_errors]
+
+    def prefetch_instances(self, serializer):
+        """
+        一次性预取批量写入的所有行在响应中需要的关联数据
+        """
+        plan = get_queryset_plan(serializer.child.__class__)
+        prefetch_related_objects(serializer.instance, *plan.prefetch_related)
+
     def create(self, request, *args, **kwargs):
         serializer = self.get_serializer(data=request.data, request=request)
+        is_many = isinstance(serializer, ListSerializer)
+        if is_many and not serializer.is_valid():
+            row_errors = self.get_row_errors(serializer)
+            if row_errors is not None:
+                return ErrorResponse(data=row_errors, msg="批量新增数据校验失败")
         serializer.is_valid(raise_exception=True)
-        self.perform_create(serializer)
+        with transaction.atomic():
+            self.perform_create(serializer)
+        if is_many:
+            self.prefetch_instances(serializer)
         return DetailResponse(data=serializer.data, msg="新增成功")
 
+    def get_values_serializer(self):
+        """
+        设置了values_queryset且序列化器字段都可预编译时, 返回values()快速序列化器
+        """
+        if self.values_queryset is None:
+            return None
+        return get_values_serializer(self.get_serializer_class())
+
+    def values_list_response(self, values_serializer, queryset):
+        """
+        values()快速路径: 返回结果与序列化器一致, 但不实例化序列化器
+        """
+        queryset = values_serializer.values(queryset)
+        page = self.paginate_queryset(queryset)
+        if page is not None:
+            paginated_response = self.get_paginated_response(values_serializer.serialize(page))
+            if isinstance(paginated_response, SuccessResponse):
+                return paginated_response
+            return SuccessResponse(paginated_response.data)
+        return SuccessResponse(data=values_serializer.serialize(queryset))
+
     def list(self, request, *args, **kwargs):
+        values_serializer = self.get_values_serializer()
+        if values_serializer is not None:
+            queryset = self.filter_queryset(self.values_queryset.all())
+            return self.values_list_response(values_serializer, queryset)
         queryset = self.filter_queryset(self.get_queryset())
         page = self.paginate_queryset(queryset)
         if page is not None:
             serializer = self.get_serializer(page, many=True, request=request)
-            return SuccessResponse(self.get_paginated_response(serializer.data).data)
+            paginated_response = self.get_paginated_response(serializer.data)
+            if isinstance(paginated_response, SuccessResponse):
+                return paginated_response
+            return SuccessResponse(paginated_response.data)
         serializer = self.get_serializer(queryset, many=True, request=request)
         return SuccessResponse(data=serializer.data)
 
@@ -94,12 +353,91 @@ class CustomModelViewSet(ModelViewSet):
         instance.delete()
         return DetailResponse(data=[], msg="删除成功")
 
+    def get_export_field_names(self):
+        serializer = self.get_serializer_class()()
+        return [field_name for field_name, field in serializer.fields.items() if not field.write_only]
+
+    def get_export_chunks(self):
+        """
+        按过滤条件分批读取并序列化, 返回每次产出一批数据列表的迭代器;
+        查询集在调用时构建, 过滤参数错误在开始输出前抛出
+        """
+        chunk_size = self.export_chunk_size
+        values_serializer = self.get_values_serializer()
+        if values_serializer is not None:
+            queryset = values_serializer.values(self.filter_queryset(self.values_queryset.all()))
+            chunks = iter_chunks(queryset.iterator(chunk_size=chunk_size), chunk_size)
+            return (values_serializer.serialize(rows) for rows in chunks)
+        queryset = self.filter_queryset(self.get_queryset())
+        chunks = iter_chunks(queryset.iterator(chunk_size=chunk_size), chunk_size)
+        return (self.get_serializer(instances, many=True, request=self.request).data for instances in chunks)
+
+    @action(methods=['get'], detail=False)
+    def export(self, request, *args, **kwargs):
+        """
+        流式导出: export_format=ndjson(默认)|csv, 支持与列表相同的过滤参数, 不分页;
+        列表接口的权限不包括导出, 需要单独配置 GET .../export/ 的权限
+        """
+        export_format = request.query_params.get('export_format', 'ndjson')
+        if export_format not in self.export_formats:
+            return ErrorResponse(msg=f"不支持的导出格式, 可选: {', '.join(self.export_formats)}")
+        chunks = self.get_export_chunks()
+        if export_format == 'csv':
+            content = csv_stream(self.get_export_field_names(), chunks)
+        else:
+            content = ndjson_stream(chunks)
+        response = StreamingHttpResponse(content, content_type=self.export_formats[export_format])
+        file_name = f"{self.get_queryset().model._meta.model_name}.{export_format}"
+        response['Content-Disposition'] = f'attachment; filename="{file_name}"'
+        return response
+
+    @action(methods=['patch'], detail=False)
+    def multiple_update(self, request, *args, **kwargs):
+        """
+        批量更新: 请求数据为[{id, ...字段}], 按部分更新校验, 在一个事务中批量写入
+        """
+        request_data = request.data
+        if not isinstance(request_data, list) or not request_data:
+            return ErrorResponse(msg="请求数据必须是非空列表")
+        queryset = self.filter_queryset(self.get_queryset())
+        pk_field = queryset.model._meta.pk
+        try:
+            keys = [pk_field.to_python(item.get('id')) if isinstance(item, dict) else None for item in request_data]
+        except DjangoValidationError:
+            return ErrorResponse(msg="id格式不正确")
+        if None in keys:
+            return ErrorResponse(msg="每行数据都必须包含id")
+        if len(set(keys)) != len(keys):
+            return ErrorResponse(msg="id不能重复")
+
+        serializer_class = self.update_serializer_class or self.get_serializer_class()
+        with transaction.atomic():
+            instances = queryset.select_for_update().in_bulk(keys)
+            missing = [index for index, key in enumerate(keys) if key not in instances]
+            if missing:
+                return ErrorResponse(data=missing, msg="未获取到数据")
+            serializer = serializer_class([instances[key] for key in keys], data=request_data, many=True,
+                                          partial=True, context=self.get_serializer_context(), request=request)
+            if not serializer.is_valid():
+                row_errors = self.get_row_errors(serializer)
+                if row_errors is not None:
+                    return ErrorResponse(data=row_errors, msg="批量更新数据校验失败")
+                serializer.is_valid(raise_exception=True)
+            serializer.save()
+        self.prefetch_instances(serializer)
+        return DetailResponse(data=serializer.data, msg="更新成功")
+
     @action(methods=['delete'], detail=False)
     def multiple_delete(self, request, *args, **kwargs):
         request_data = request.data
         keys = request_data.get('keys', None)
         if keys:
-            self.get_queryset().filter(id__in=keys).delete()
-            return SuccessResponse(data=[], msg="删除成功")
+            if not isinstance(keys, list):
+                return ErrorResponse(msg="keys必须是列表")
+            try:
+                total, counts = delete_by_keys(self.get_queryset(), keys)
+            except DjangoValidationError:
+                return ErrorResponse(msg="keys格式不正确")
+            return SuccessResponse(data={"total": total, "models": counts}, msg="删除成功")
         else:
             return ErrorResponse(msg="未获取到keys字段")
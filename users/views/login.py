@@ -1,21 +1,46 @@
-from rest_framework.status import HTTP_401_UNAUTHORIZED
+import asyncio
+import json
+
+from django.http import HttpResponse
+from django.utils.decorators import method_decorator
+from django.views import View
+from django.views.decorators.csrf import csrf_exempt
+from rest_framework.status import HTTP_400_BAD_REQUEST, HTTP_401_UNAUTHORIZED, HTTP_429_TOO_MANY_REQUESTS
 from rest_framework.views import APIView
+from rest_framework_simplejwt.exceptions import TokenError
+from rest_framework_simplejwt.settings import api_settings
 from rest_framework_simplejwt.tokens import RefreshToken, AccessToken
 from rest_framework_simplejwt.views import TokenObtainPairView, TokenRefreshView
 
 from users.models import Users
 from users.serializers.login import LoginSerializer
+from users.utils.authentication import add_token_claims, is_credential_changed, is_token_revoked, revoke_token
 from users.utils.json_response import ErrorResponse, DetailResponse
+from users.utils.login_pool import LOGIN_RETRY_AFTER, LoginPoolFull, submit_login
+from users.utils.renderers import CustomJSONRenderer
 
 
 class CustomTokenRefreshView(TokenRefreshView):
     """
-    自定义token刷新
+    自定义token刷新: 开启ROTATE_REFRESH_TOKENS时同时轮换refresh token并注销旧的refresh token;
+    签发后修改了密码或被停用的用户不能刷新, 角色等其它变更重新写入token
     """
     def post(self, request, *args, **kwargs):
         refresh_token = request.data.get("refresh")
         try:
             token = RefreshToken(refresh_token)
+            if is_token_revoked(token):
+                return ErrorResponse(status=HTTP_401_UNAUTHORIZED)
+            user = Users.objects.get(id=token[api_settings.USER_ID_CLAIM], is_active=True)
+            if is_credential_changed(token, user):
+                return ErrorResponse(status=HTTP_401_UNAUTHORIZED)
+            if api_settings.ROTATE_REFRESH_TOKENS:
+                revoke_token(token)
+                token.set_jti()
+                token.set_exp()
+                token.set_iat()
+            # 重新写入用户信息, 使角色等变更后刷新得到的token可以通过无状态认证
+            add_token_claims(token, user)
             data = {
                 "access": str(token.access_token),
                 "refresh": str(token)
@@ -33,8 +58,62 @@ class LoginView(TokenObtainPairView):
     permission_classes = []
 
 
+def validate_login(data):
+    serializer = LoginSerializer(data=data)
+    if serializer.is_valid():
+        return serializer.validated_data, None
+    return None, serializer.errors
+
+
+@method_decorator(csrf_exempt, name="dispatch")
+class AsyncLoginView(View):
+    """
+    异步登录接口: 账号密码校验在登录线程池中执行, 不阻塞其它请求;
+    线程池已满时返回429并通过Retry-After提示重试时间. 返回格式与LoginView一致,
+    使用与LoginView相同的JSON渲染器, 校验结果相同时响应字节一致
+    """
+    renderer_class = CustomJSONRenderer
+
+    def render(self, data, status=None):
+        renderer = self.renderer_class()
+        return HttpResponse(renderer.render(data), status=status, content_type=renderer.media_type)
+
+    async def post(self, request, *args, **kwargs):
+        if request.content_type == "application/json":
+            try:
+                data = json.loads(request.body or b"{}")
+            except ValueError:
+                return self.render({"code": 400, "data": None, "msg": "请求数据格式错误"}, status=HTTP_400_BAD_REQUEST)
+        else:
+            data = request.POST.dict()
+
+        try:
+            future = submit_login(validate_login, data)
+        except LoginPoolFull:
+            response = self.render({"code": 429, "data": None, "msg": "登录请求过多, 请稍后重试"},
+                                   status=HTTP_429_TOO_MANY_REQUESTS)
+            response["Retry-After"] = str(LOGIN_RETRY_AFTER)
+            return response
+        result, errors = await asyncio.wrap_future(future)
+        if errors is not None:
+            return self.render(errors, status=HTTP_400_BAD_REQUEST)
+        return self.render(result)
+
+
 class LogoutView(APIView):
     def delete(self, request):
-        Users.objects.filter(id=self.request.user.id).update(last_token=None)
+        """
+        注销当前access token, 请求中带有refresh时一并注销
+        """
+        if request.auth is not None:
+            revoke_token(request.auth)
+        refresh_token = request.data.get("refresh")
+        if refresh_token:
+            try:
+                token = RefreshToken(refresh_token)
+            except TokenError:
+                pass
+            else:
+                if token[api_settings.USER_ID_CLAIM] == request.user.id:
+                    revoke_token(token)
         return DetailResponse(msg="注销成功")
-
@@ -3,12 +3,15 @@
 """
 @Remark: 菜单模块
 """
+from django.core.exceptions import ValidationError as DjangoValidationError
 from rest_framework import serializers
 from rest_framework.decorators import action
 from rest_framework.permissions import IsAuthenticated
 
 from users.models import Menu
 from users.utils.json_response import SuccessResponse, DetailResponse
+from users.utils.permission import get_permission_context
+from users.utils.rbac_cache import get_rbac_data
 from users.utils.serializers import CustomModelSerializer
 from users.utils.viewset import CustomModelViewSet
 
@@ -19,7 +22,8 @@ class MenuSerializer(CustomModelSerializer):
     """
     class Meta:
         model = Menu
-        fields = "__all__"
+        # tree_path为内部维护的物化路径, 不在接口中返回
+        exclude = ["tree_path"]
         read_only_fields = ["id"]
 
 
@@ -29,9 +33,45 @@ class MenuCreateSerializer(CustomModelSerializer):
     """
     name = serializers.CharField(required=False)
 
+    def get_parent_map(self):
+        """
+        {菜单id: 父级菜单id}, 批量更新时按请求中其它行修改后的父级计算, 同一请求内只查询一次
+        """
+        if not isinstance(self.parent, serializers.ListSerializer):
+            return dict(Menu.objects.values_list("id", "parent_id"))
+        parents = getattr(self.parent, "_menu_parents", None)
+        if parents is None:
+            parents = dict(Menu.objects.values_list("id", "parent_id"))
+            pk_field = Menu._meta.pk
+            for row in self.parent.initial_data:
+                if not isinstance(row, dict) or "parent" not in row:
+                    continue
+                try:
+                    parents[pk_field.to_python(row.get("id"))] = pk_field.to_python(row["parent"])
+                except DjangoValidationError:
+                    # 格式不正确的id/parent由字段校验报错
+                    continue
+            self.parent._menu_parents = parents
+        return parents
+
+    def validate_parent(self, value):
+        """
+        不能把菜单移动到自身或其子孙菜单下
+        """
+        if value is None or self.instance is None:
+            return value
+        parents, node_id, visited = self.get_parent_map(), value.pk, set()
+        while node_id is not None and node_id not in visited:
+            if node_id == self.instance.pk:
+                raise serializers.ValidationError("不能将菜单移动到自身或其子菜单下")
+            visited.add(node_id)
+            node_id = parents.get(node_id)
+        return value
+
     class Meta:
         model = Menu
-        fields = "__all__"
+        # tree_path为内部维护的物化路径, 不在接口中返回
+        exclude = ["tree_path"]
         read_only_fields = ["id"]
 
 
@@ -41,7 +81,8 @@ class RoutesSerializer(CustomModelSerializer):
     """
     class Meta:
         model = Menu
-        fields = "__all__"
+        # tree_path为内部维护的物化路径, 不在接口中返回
+        exclude = ["tree_path"]
         read_only_fields = ["id"]
 
 
@@ -55,6 +96,7 @@ class MenuViewSet(CustomModelViewSet):
     destroy:删除
     """
     queryset = Menu.objects.all()
+    values_queryset = Menu.objects.all()
     serializer_class = MenuSerializer
     create_serializer_class = MenuCreateSerializer
     update_serializer_class = MenuCreateSerializer
@@ -63,49 +105,27 @@ class MenuViewSet(CustomModelViewSet):
 
     @action(methods=['GET'], detail=False, permission_classes=[IsAuthenticated])
     def routes(self, request):
-        """用于前端获取当前角色的路由"""
-        user = request.user
-        menus = self.get_user_menus(user)
-        if user.is_superuser:
-            # Return all menus for superuser
-            return self.serialize_menus(Menu.objects.filter(parent__isnull=True))
-        else:
-            # Return menus based on user's roles
-            return self.serialize_menus(user.role.first().menu.filter(parent__isnull=True))
-
+        """
+        用于前端获取当前角色的路由: 超级管理员返回全部菜单;
+        其余用户返回所有角色关联的菜单, 子菜单同样按角色过滤, 父菜单未关联角色的子菜单不返回
+        """
+        menus = get_rbac_data(request.user, get_permission_context(request).role_ids)["routes"]
         return DetailResponse(data=menus, msg="获取成功")
 
-    def serialize_menus(self, menus):
-        serialized_menus = []
-        for menu in menus:
-            serialized_menu = {
-                "path": menu.path,
-                "component": menu.component,
-                "redirect": menu.redirect,
-                "name": menu.name,
-                "meta": {
-                    "title": menu.name,
-                    "icon": menu.icon,
-                    "hidden": not menu.visible,
-                    "roles": [role.name for role in menu.roles.all()],
-                },
-                "children": self.serialize_menus(menu.children.all()) if menu.children.exists() else []
-            }
-            serialized_menus.append(serialized_menu)
-        return serialized_menus
-
     def list(self, request):
         """懒加载"""
         params = request.query_params
         parent = params.get('parent', None)
+        values_serializer = self.get_values_serializer()
+        queryset = self.get_queryset() if values_serializer is None else self.values_queryset.all()
         if params:
             if parent:
-                queryset = self.queryset.filter(parent=parent)
-            else:
-                queryset = self.queryset
+                queryset = queryset.filter(parent=parent)
         else:
-            queryset = self.queryset.filter(parent__isnull=True)
+            queryset = queryset.filter(parent__isnull=True)
         queryset = self.filter_queryset(queryset)
+        if values_serializer is not None:
+            return SuccessResponse(data=values_serializer.serialize(values_serializer.values(queryset)))
         serializer = MenuSerializer(queryset, many=True, request=request)
         data = serializer.data
         return SuccessResponse(data=data)
@@ -3,6 +3,8 @@
 """
 @Remark: 角色管理
 """
+from collections import defaultdict
+
 from rest_framework import serializers
 from rest_framework.decorators import action
 from rest_framework.permissions import IsAuthenticated
@@ -10,6 +12,7 @@ from rest_framework.permissions import IsAuthenticated
 from users.models import Role, Menu
 from users.views.menu import MenuSerializer
 from users.utils.json_response import SuccessResponse, DetailResponse
+from users.utils.permission import get_permission_context
 from users.utils.serializers import CustomModelSerializer
 from users.utils.validator import CustomUniqueValidator
 from users.utils.viewset import CustomModelViewSet
@@ -69,19 +72,30 @@ class RoleCreateUpdateSerializer(CustomModelSerializer):
 
 class MenuPermissonSerializer(CustomModelSerializer):
     """
-    菜单的按钮权限
+    菜单的按钮权限: 按钮为菜单下menu_type为BUTTON的子菜单,
+    超级管理员和admin角色返回全部按钮, 其余用户返回其角色关联的按钮
     """
     menuPermission = serializers.SerializerMethodField()
 
+    def get_menu_buttons(self):
+        """
+        {菜单id: [按钮]}, 角色的菜单来自请求的权限上下文, 列表序列化时所有菜单共用一次查询
+        """
+        root = self.parent if isinstance(self.parent, serializers.ListSerializer) else self
+        menu_buttons = getattr(root, "_menu_buttons", None)
+        if menu_buttons is None:
+            permission_context = get_permission_context(self.request)
+            queryset = Menu.objects.filter(menu_type="BUTTON")
+            if not (permission_context.is_superuser or permission_context.is_admin):
+                queryset = queryset.filter(id__in=permission_context.menu_ids)
+            menu_buttons = defaultdict(list)
+            for button in queryset.order_by("sort", "id").values("id", "parent_id", "name", "perm"):
+                menu_buttons[button.pop("parent_id")].append(button)
+            root._menu_buttons = menu_buttons
+        return menu_buttons
+
     def get_menuPermission(self, instance):
-        is_superuser = self.request.user.is_superuser
-        if is_superuser:
-            queryset = MenuButton.objects.filter(menu__id=instance.id)
-        else:
-            menu_permission_id_list = self.request.user.role.values_list('permission', flat=True)
-            queryset = MenuButton.objects.filter(id__in=menu_permission_id_list, menu__id=instance.id)
-        serializer = MenuButtonSerializer(queryset, many=True, read_only=True)
-        return serializer.data
+        return self.get_menu_buttons().get(instance.id, [])
 
     class Meta:
         model = Menu
@@ -106,13 +120,11 @@ class RoleViewSet(CustomModelViewSet):
     @action(methods=['GET'], detail=False, permission_classes=[IsAuthenticated])
     def role_get_menu(self, request):
         """根据当前用户的角色返回角色拥有的菜单"""
-        is_superuser = request.user.is_superuser
-        is_admin = request.user.role.values_list('admin', flat=True)
-        if is_superuser or True in is_admin:
-            queryset = Menu.objects.filter(status=True).all()
+        permission_context = get_permission_context(request)
+        if permission_context.is_superuser or permission_context.is_admin:
+            queryset = Menu.objects.all()
         else:
-            menu_id_list = request.user.role.values_list('menu', flat=True)
-            queryset = Menu.objects.filter(id__in=menu_id_list)
+            queryset = Menu.objects.filter(id__in=permission_context.menu_ids)
         # queryset = self.filter_queryset(queryset)
         serializer = MenuPermissonSerializer(queryset, many=True,request=request)
         return DetailResponse(data=serializer.data)
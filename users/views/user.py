@@ -1,11 +1,14 @@
-import hashlib
-
-from django.contrib.auth.hashers import make_password, check_password
+from django.contrib.auth.hashers import make_password
+from django.core.exceptions import ValidationError as DjangoValidationError
 from rest_framework import serializers
 from rest_framework.decorators import action, permission_classes
 from rest_framework.permissions import IsAuthenticated
-from users.models import Users, Role, Menu
+from users.models import Users, Role
+from users.utils.authentication import revoke_user_tokens
+from users.utils.hashers import verify_password
 from users.utils.json_response import ErrorResponse, DetailResponse
+from users.utils.permission import get_permission_context
+from users.utils.rbac_cache import get_rbac_data
 from users.utils.serializers import CustomModelSerializer
 from users.utils.validator import CustomUniqueValidator
 from users.utils.viewset import CustomModelViewSet
@@ -50,8 +53,7 @@ class UserCreateSerializer(CustomModelSerializer):
         """
         对密码进行验证
         """
-        password = self.initial_data.get("password")
-        if password:
+        if value:
             return make_password(value)
         return value
 
@@ -130,6 +132,7 @@ class UserViewSet(CustomModelViewSet):
 
     # queryset = Users.objects.exclude(is_superuser=True).all()
     queryset = Users.objects.all()
+    values_queryset = Users.objects.all()
     serializer_class = UserSerializer
     create_serializer_class = UserCreateSerializer
     update_serializer_class = UserUpdateSerializer
@@ -140,28 +143,19 @@ class UserViewSet(CustomModelViewSet):
     def user_info(self, request):
         """获取当前用户信息"""
         user = request.user
+        permission_context = get_permission_context(request)
         data = {
             "userId": user.id,
             "nickname": user.username,
             "avatar": user.avatar,
-            "roles": [role.key for role in user.role.all()],
-            "perms": self.get_user_perms(user),
+            "roles": permission_context.role_keys,
+            "perms": self.get_user_perms(user, permission_context.role_ids),
         }
 
         return DetailResponse(data=data, msg="获取成功")
 
-    def get_user_perms(self, user):
-        perms = []
-        if user.is_superuser:
-            for menu in Menu.objects.all():
-                if menu.perm:
-                    perms.append(menu.perm)
-        else:
-            for role in user.role.all():
-                for perm in role.menu.values_list('perm', flat=True):
-                    if perm:
-                        perms.append(perm)
-        return perms
+    def get_user_perms(self, user, role_ids=None):
+        return get_rbac_data(user, role_ids)["perms"]
 
     @action(methods=["PUT"], detail=False, permission_classes=[IsAuthenticated])
     def update_user_info(self, request):
@@ -182,11 +176,8 @@ class UserViewSet(CustomModelViewSet):
             return ErrorResponse(msg="参数不能为空")
         if new_pwd != new_pwd2:
             return ErrorResponse(msg="两次密码不匹配")
-        verify_password = check_password(old_pwd, self.request.user.password)
-        if not verify_password:
-            verify_password = check_password(hashlib.md5(old_pwd.encode(encoding='UTF-8')).hexdigest(), self.request.user.password)
-        if verify_password:
-            request.user.password = make_password(new_pwd)
+        if verify_password(request.user, old_pwd):
+            request.user.set_password(new_pwd)
             request.user.save()
             return DetailResponse(data=None, msg="修改成功")
         else:
@@ -221,3 +212,17 @@ class UserViewSet(CustomModelViewSet):
                 return DetailResponse(data=None, msg="修改成功")
         else:
             return ErrorResponse(msg="未获取到用户")
+
+    @action(methods=["PUT"], detail=True)
+    def kick(self, request, pk):
+        """
+        强制下线: 注销该用户已签发的所有token
+        """
+        try:
+            pk = Users._meta.pk.to_python(pk)
+        except DjangoValidationError:
+            return ErrorResponse(msg="未获取到用户")
+        if not Users.objects.filter(id=pk).exists():
+            return ErrorResponse(msg="未获取到用户")
+        revoke_user_tokens(pk)
+        return DetailResponse(data=None, msg="已强制下线")